@@ -0,0 +1,10 @@
+"""
+Shared runtime helpers for the Modal ComfyUI apps.
+
+Imported both locally (at `modal deploy` time) and inside the containers,
+so modules here only import heavy dependencies lazily inside functions.
+"""
+
+from .engine import ComfyEngine, ComfyExecutionError, ExecutionResult
+
+__all__ = ["ComfyEngine", "ComfyExecutionError", "ExecutionResult"]
@@ -0,0 +1,298 @@
+"""
+VRAM- and time-aware admission of workflows on a container.
+
+`estimate_cost` derives a workflow's cost from its graph: the input image
+resolution, how the image is scaled along the way (upscale models,
+`ImageScaleBy`, UltimateSDUpscale's `upscale_by`, downscaling to a size),
+the tile sizes, steps and denoise of the sampling nodes, and the size of the
+model files it loads. The
+constants are rough figures for Flux-class models on an L4 and only need to
+rank workflows correctly, not predict them exactly.
+
+`AdmissionController` admits a job on a container when its activations fit
+the GPU at all and the work already admitted leaves enough time for it.
+ComfyUI runs one prompt at a time, so admitted jobs do not hold VRAM while
+they wait, and the live free VRAM (which mostly reflects the models ComfyUI
+keeps loaded) is not a capacity limit. Jobs that do not fit soon are
+rejected with `AdmissionRejected`, so they can be sent to another container.
+"""
+
+import base64
+import io
+import logging
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .inputs import COMFY_INPUT_DIR, INPUTS_DIR, is_input_key
+from .loaders import required_models
+from .models import COMFY_MODELS_DIR
+
+logger = logging.getLogger(__name__)
+
+# Resolution assumed for inputs whose size cannot be read
+DEFAULT_SIZE = (1024, 1024)
+
+# Sampler activations and time per megapixel (per step) of the image being sampled
+SAMPLING_BYTES_PER_MEGAPIXEL = 2 * 1024 ** 3
+SAMPLING_SECONDS_PER_MEGAPIXEL_STEP = 2.0
+
+# ComfyUI runs upscale models tile by tile, so their memory does not grow with the image
+UPSCALE_MODEL_BYTES = 1024 ** 3
+UPSCALE_SECONDS_PER_MEGAPIXEL = 0.5
+
+# Fixed overhead of a prompt: queueing, text encoding, VAE and saving
+BASE_SECONDS = 5.0
+
+DEFAULT_STEPS = 20
+
+# Share of the GPU's memory a single job's activations may use
+DEFAULT_VRAM_HEADROOM = 0.9
+
+# Seconds of admitted work after which new jobs are rejected (below the worker timeout)
+DEFAULT_MAX_QUEUED_SECONDS = 480.0
+
+# How long a job waits for room on the container before it is rejected
+DEFAULT_ADMISSION_WAIT = 30.0
+
+IMAGE_INPUT_NODES = ("ETN_LoadImageBase64", "LoadImage")
+SAMPLER_NODES = ("KSampler", "KSamplerAdvanced", "SamplerCustomAdvanced")
+
+# Nodes that scale an image down to `size` pixels on its longer side (`mode` true) or shorter side
+DOWNSCALE_TO_SIZE_NODES = ("easy imageScaleDownToSize",)
+
+
+class AdmissionRejected(RuntimeError):
+    """Raised when a job does not fit on this container."""
+
+    def __init__(self, message: str, permanent: bool = False):
+        super().__init__(message)
+        # Permanent rejections would not fit on any container of this GPU type either
+        self.permanent = permanent
+
+
+@dataclass
+class WorkflowCost:
+    """Estimated GPU memory and run time of a workflow."""
+
+    activation_bytes: int
+    model_bytes: int
+    seconds: float
+    peak_megapixels: float
+
+    @property
+    def vram_bytes(self) -> int:
+        return self.activation_bytes + self.model_bytes
+
+    def describe(self) -> str:
+        return (
+            f"{self.vram_bytes / 1024 ** 3:.1f} GB VRAM "
+            f"({self.activation_bytes / 1024 ** 3:.1f} GB activations), "
+            f"~{self.seconds:.0f}s, {self.peak_megapixels:.1f} MP peak"
+        )
+
+
+def image_size(data: str) -> Optional[Tuple[int, int]]:
+    """Width and height of a base64 image, read from its header."""
+    try:
+        return image_file_size(io.BytesIO(base64.b64decode(data)))
+    except Exception:
+        return None
+
+
+def image_file_size(fp) -> Optional[Tuple[int, int]]:
+    """Width and height of an image file (a path or file object), read from its header."""
+    try:
+        from PIL import Image
+
+        with Image.open(fp) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+def _upscale_factor(model_name: str) -> float:
+    # Upscale models are named after their factor, e.g. 4x_foolhardy_Remacri.pth
+    match = re.match(r"^(\d+)x", Path(model_name).name, re.IGNORECASE)
+    return float(match.group(1)) if match else 4.0
+
+
+def _denoise_steps(inputs: Dict) -> int:
+    # Partial denoising only runs the last steps
+    steps = inputs.get("steps") if isinstance(inputs.get("steps"), int) else DEFAULT_STEPS
+    denoise = inputs.get("denoise") if isinstance(inputs.get("denoise"), (int, float)) else 1.0
+    # Rounded first, so that e.g. 30 steps at 0.1 denoise are 3 steps despite float error
+    return math.ceil(round(steps * denoise, 6))
+
+
+def estimate_cost(workflow: Dict, models_dir: str = COMFY_MODELS_DIR, inputs_dir: str = INPUTS_DIR) -> WorkflowCost:
+    """Estimate the cost of an API-format workflow. Stored input images (see `inputs.py`) are read from `inputs_dir`."""
+    nodes = {node_id: node for node_id, node in workflow.items() if isinstance(node, dict)}
+
+    # Size of the largest input image or empty latent
+    width, height = 0, 0
+    for node in nodes.values():
+        inputs = node.get("inputs", {})
+        size = None
+        if node.get("class_type") in IMAGE_INPUT_NODES and isinstance(inputs.get("image"), str):
+            image = inputs["image"]
+            if is_input_key(image):
+                size = image_file_size(Path(inputs_dir) / image)
+            elif node["class_type"] == "ETN_LoadImageBase64":
+                size = image_size(image)
+            else:
+                size = image_file_size(Path(COMFY_INPUT_DIR) / image)
+        elif node.get("class_type") == "EmptyLatentImage":
+            batch = inputs.get("batch_size", 1) if isinstance(inputs.get("batch_size"), int) else 1
+            if isinstance(inputs.get("width"), int) and isinstance(inputs.get("height"), int):
+                size = (inputs["width"], inputs["height"] * batch)
+        if size and size[0] * size[1] > width * height:
+            width, height = size
+    if not width:
+        width, height = DEFAULT_SIZE
+
+    scales: Dict[str, float] = {}
+
+    def is_link(value) -> bool:
+        return isinstance(value, list) and len(value) == 2 and str(value[0]) in nodes
+
+    def carries_image(node_id: str) -> bool:
+        # Nodes without links (model loaders, seeds) only feed their outputs, not an image
+        node = nodes[node_id]
+        return node.get("class_type") in IMAGE_INPUT_NODES + ("EmptyLatentImage",) or any(
+            is_link(value) for value in node.get("inputs", {}).values()
+        )
+
+    def input_scale(node_id: str, visiting=()) -> float:
+        """Linear scale of the image flowing into a node, relative to the input image."""
+        linked = [
+            output_scale(str(value[0]), visiting + (node_id,))
+            for value in nodes.get(node_id, {}).get("inputs", {}).values()
+            if is_link(value) and carries_image(str(value[0]))
+        ]
+        return max(linked, default=1.0)
+
+    def output_scale(node_id: str, visiting=()) -> float:
+        if node_id in scales:
+            return scales[node_id]
+        if node_id in visiting:
+            return 1.0
+        node = nodes[node_id]
+        inputs = node.get("inputs", {})
+        scale = input_scale(node_id, visiting)
+        class_type = node.get("class_type")
+        if class_type == "UltimateSDUpscale" and isinstance(inputs.get("upscale_by"), (int, float)):
+            scale *= inputs["upscale_by"]
+        elif class_type == "ImageScaleBy" and isinstance(inputs.get("scale_by"), (int, float)):
+            scale *= inputs["scale_by"]
+        elif class_type == "ImageUpscaleWithModel":
+            link = inputs.get("upscale_model")
+            loader = nodes.get(str(link[0]), {}) if isinstance(link, list) else {}
+            scale *= _upscale_factor(loader.get("inputs", {}).get("model_name", ""))
+        elif class_type in DOWNSCALE_TO_SIZE_NODES and isinstance(inputs.get("size"), (int, float)):
+            side = max(width, height) if inputs.get("mode", True) else min(width, height)
+            # Images already smaller than `size` are left alone
+            scale = min(scale, inputs["size"] / side)
+        scales[node_id] = scale
+        return scale
+
+    activation_bytes, seconds, peak = 0, BASE_SECONDS, 0.0
+    for node_id, node in nodes.items():
+        inputs = node.get("inputs", {})
+        class_type = node.get("class_type")
+        out_megapixels = width * height * output_scale(node_id) ** 2 / 1e6
+        peak = max(peak, out_megapixels)
+        if class_type == "UltimateSDUpscale":
+            tile_w = inputs.get("tile_width") or 512
+            tile_h = inputs.get("tile_height") or 512
+            scale = output_scale(node_id)
+            tiles = math.ceil(width * scale / tile_w) * math.ceil(height * scale / tile_h)
+            tile_megapixels = tile_w * tile_h / 1e6
+            activation_bytes = max(activation_bytes, int(tile_megapixels * SAMPLING_BYTES_PER_MEGAPIXEL))
+            seconds += tiles * _denoise_steps(inputs) * tile_megapixels * SAMPLING_SECONDS_PER_MEGAPIXEL_STEP
+        elif class_type in SAMPLER_NODES:
+            activation_bytes = max(activation_bytes, int(out_megapixels * SAMPLING_BYTES_PER_MEGAPIXEL))
+            seconds += _denoise_steps(inputs) * out_megapixels * SAMPLING_SECONDS_PER_MEGAPIXEL_STEP
+        elif class_type == "ImageUpscaleWithModel":
+            activation_bytes = max(activation_bytes, UPSCALE_MODEL_BYTES)
+            seconds += out_megapixels * UPSCALE_SECONDS_PER_MEGAPIXEL
+
+    model_bytes = 0
+    for subfolder, filename in required_models(workflow):
+        try:
+            model_bytes += (Path(models_dir) / subfolder / filename).stat().st_size
+        except OSError:
+            pass
+
+    return WorkflowCost(activation_bytes, model_bytes, seconds, peak)
+
+
+class AdmissionController:
+    """Admit jobs on a container against its GPU and the work already admitted."""
+
+    def __init__(
+        self,
+        vram_headroom: float = DEFAULT_VRAM_HEADROOM,
+        max_queued_seconds: float = DEFAULT_MAX_QUEUED_SECONDS,
+    ):
+        self.vram_headroom = vram_headroom
+        self.max_queued_seconds = max_queued_seconds
+        self._cond = threading.Condition()
+        self._admitted: Dict[int, WorkflowCost] = {}
+        self._next_ticket = 0
+
+    @property
+    def queued_seconds(self) -> float:
+        with self._cond:
+            return sum(cost.seconds for cost in self._admitted.values())
+
+    def _blocker(self, cost: WorkflowCost) -> Optional[str]:
+        """Why a job cannot be admitted right now, if it cannot."""
+        if not self._admitted:
+            # An idle container always takes the job
+            return None
+        queued = sum(admitted.seconds for admitted in self._admitted.values())
+        if queued + cost.seconds > self.max_queued_seconds:
+            return f"{queued:.0f}s of work already admitted"
+        return None
+
+    @contextmanager
+    def admitted(self, cost: WorkflowCost, health, wait: float = DEFAULT_ADMISSION_WAIT):
+        """Hold a place for a job while it runs, waiting up to `wait` seconds for one.
+
+        `health` is the container's `HealthMonitor`, whose cached state gives
+        the GPU's total VRAM. Raises AdmissionRejected if the job does not fit.
+        """
+        vram_total = health.state.vram_total
+        if vram_total and cost.activation_bytes > vram_total * self.vram_headroom:
+            raise AdmissionRejected(
+                f"Workflow needs {cost.activation_bytes / 1024 ** 3:.1f} GB of activations, "
+                f"more than this GPU's {vram_total / 1024 ** 3:.1f} GB allows",
+                permanent=True,
+            )
+
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while True:
+                blocker = self._blocker(cost)
+                if blocker is None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise AdmissionRejected(f"Container is at capacity: {blocker}")
+                # Finished jobs notify the waiters
+                self._cond.wait(remaining)
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._admitted[ticket] = cost
+        try:
+            yield
+        finally:
+            with self._cond:
+                del self._admitted[ticket]
+                self._cond.notify_all()
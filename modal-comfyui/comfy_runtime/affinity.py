@@ -0,0 +1,115 @@
+"""
+Model-affinity routing of jobs to worker pools.
+
+Workers are split into a fixed number of pools (parameterizations of the
+worker class, each with its own containers). Every worker container
+advertises, in a shared store, the loader signatures (see `batching.py`) of
+the models it recently ran, and so likely still holds in VRAM, together with
+how many jobs it is running.
+
+The dispatcher routes a job to the pool with the least busy container that
+already holds the job's models. If no container does, it picks the least
+loaded pool with a container that has room, and failing that the pool the
+signature hashes to, so that jobs needing the same models still end up
+together.
+"""
+
+import hashlib
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOLS = 4
+
+# Advertisements older than this belong to containers that are gone
+DEFAULT_TTL = 90.0
+
+# How often a container refreshes its advertisement
+HEARTBEAT_INTERVAL = 20.0
+
+# Loader signatures a container counts as resident, most recent first
+RESIDENT_SIGNATURES = 2
+
+# Jobs a container runs before it no longer counts as having room
+DEFAULT_CAPACITY = 5
+
+
+def pool_name(index: int) -> str:
+    return f"pool-{index}"
+
+
+class ResidencyBoard:
+    """Container advertisements and pool selection through a `modal.Dict`-like store."""
+
+    def __init__(
+        self,
+        store,
+        pools: int = DEFAULT_POOLS,
+        ttl: float = DEFAULT_TTL,
+        capacity: int = DEFAULT_CAPACITY,
+    ):
+        self.store = store
+        self.pools = [pool_name(i) for i in range(max(1, pools))]
+        self.ttl = ttl
+        self.capacity = capacity
+
+    def advertise(self, container_id: str, pool: str, signatures: List[str], active: int):
+        """Publish what a container holds and how busy it is."""
+        self.store[container_id] = {
+            "pool": pool,
+            "signatures": signatures[:RESIDENT_SIGNATURES],
+            "active": active,
+            "updated_at": time.time(),
+        }
+
+    def withdraw(self, container_id: str):
+        try:
+            self.store.pop(container_id)
+        except KeyError:
+            pass
+
+    def live(self) -> Dict[str, Dict]:
+        """Advertisements of the containers that are still around."""
+        now = time.time()
+        return {
+            container_id: ad
+            for container_id, ad in self.store.items()
+            if now - ad.get("updated_at", 0) <= self.ttl and ad.get("pool") in self.pools
+        }
+
+    def hashed_pool(self, signature: str) -> str:
+        digest = int(hashlib.sha256(signature.encode("utf-8")).hexdigest(), 16)
+        return self.pools[digest % len(self.pools)]
+
+    def choose_pool(self, signature: str, avoid: Optional[str] = None) -> Tuple[str, str]:
+        """Return the pool to run a job with this loader signature on, and why it was chosen."""
+        candidates = [ad for ad in self.live().values() if ad["pool"] != avoid or len(self.pools) == 1]
+
+        warm = [ad for ad in candidates if signature in ad["signatures"] and ad["active"] < self.capacity]
+        if warm:
+            return min(warm, key=lambda ad: ad["active"])["pool"], "resident"
+
+        with_room = [ad for ad in candidates if ad["active"] < self.capacity]
+        if with_room:
+            return min(with_room, key=lambda ad: ad["active"])["pool"], "least-loaded"
+
+        pool = self.hashed_pool(signature)
+        if pool == avoid and len(self.pools) > 1:
+            pool = self.pools[(self.pools.index(pool) + 1) % len(self.pools)]
+        return pool, "hashed"
+
+
+class ResidentSet:
+    """Loader signatures a container ran most recently."""
+
+    def __init__(self, size: int = RESIDENT_SIGNATURES):
+        self.size = size
+        self.signatures: List[str] = []
+
+    def touch(self, signature: str):
+        if signature in self.signatures:
+            self.signatures.remove(signature)
+        self.signatures.insert(0, signature)
+        del self.signatures[self.size:]
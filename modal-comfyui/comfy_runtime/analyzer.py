@@ -0,0 +1,81 @@
+"""
+Deployed workflow analysis.
+
+Works out what the deployed workflows actually need: the custom node pack
+of every `class_type` (from the node index, see `custom_nodes.py`) and the
+`MODELS_TO_DOWNLOAD` entry of every model file they load. The report lists
+the minimal node packs and model manifest, the installed packs and
+downloaded models nothing uses, and the models or node types that are
+referenced but not available.
+"""
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from .custom_nodes import ALWAYS_LOADED, required_packs
+from .loaders import required_models
+from .models import ModelSpec
+
+logger = logging.getLogger(__name__)
+
+
+def match_models(
+    models: List[Tuple[str, str]], specs: List[ModelSpec]
+) -> Tuple[Dict[Tuple[str, str], ModelSpec], List[Tuple[str, str]]]:
+    """Map `(subfolder, filename)` pairs to the specs that provide them. Returns (matched, missing)."""
+    by_path = {(spec.subfolder, spec.link_name): spec for spec in specs}
+    matched, missing = {}, []
+    for model in models:
+        if model in by_path:
+            matched[model] = by_path[model]
+        else:
+            missing.append(model)
+    return matched, missing
+
+
+def analyze_workflows(
+    workflows: Dict[str, Dict],
+    specs: List[ModelSpec],
+    node_index: Optional[Dict[str, str]] = None,
+    installed_packs: Optional[List[str]] = None,
+) -> Dict:
+    """Return the packs and models each workflow needs, and what is unused or missing overall."""
+    report = {"workflows": {}}
+    used_packs, used_models, missing_models, unknown_nodes = set(), set(), set(), set()
+    for name, workflow in workflows.items():
+        matched, missing = match_models(required_models(workflow), specs)
+        packs, unknown = required_packs(node_index or {}, workflow) if node_index else (set(), set())
+        report["workflows"][name] = {
+            "packs": sorted(packs),
+            "models": sorted(spec.key for spec in matched.values()),
+            "missing_models": [f"{subfolder}/{filename}" for subfolder, filename in missing],
+            "unknown_nodes": sorted(unknown),
+        }
+        used_packs |= packs
+        used_models |= {spec.key for spec in matched.values()}
+        missing_models |= {f"{subfolder}/{filename}" for subfolder, filename in missing}
+        unknown_nodes |= unknown
+
+    report["packs"] = sorted(used_packs)
+    report["models"] = sorted(used_models)
+    report["missing_models"] = sorted(missing_models)
+    report["unknown_nodes"] = sorted(unknown_nodes)
+    report["unused_models"] = sorted({spec.key for spec in specs} - used_models)
+    if installed_packs is not None and node_index:
+        report["unused_packs"] = sorted(set(installed_packs) - used_packs - set(ALWAYS_LOADED))
+    return report
+
+
+def log_report(report: Dict):
+    """Log the analysis, warning about missing models and node types."""
+    logger.info(f"Deployed workflows use node packs: {', '.join(report['packs']) or 'core only'}")
+    logger.info(f"Deployed workflows use models: {', '.join(report['models']) or 'none'}")
+    for name, workflow in report["workflows"].items():
+        for model in workflow["missing_models"]:
+            logger.warning(f"Workflow {name} loads {model}, which is not in MODELS_TO_DOWNLOAD")
+        for class_type in workflow["unknown_nodes"]:
+            logger.warning(f"Workflow {name} uses node type {class_type}, which no installed pack provides")
+    if report.get("unused_packs"):
+        logger.info(f"Installed node packs no deployed workflow uses: {', '.join(report['unused_packs'])}")
+    if report["unused_models"]:
+        logger.info(f"Downloaded models no deployed workflow uses: {', '.join(report['unused_models'])}")
@@ -0,0 +1,84 @@
+"""
+Batch planning.
+
+Items of a batch are grouped by the models their loader nodes load, and each
+group is split into chunks that a single worker call runs back to back, so
+the models are loaded once per chunk instead of once per item.
+
+Batch items are addressed as `<chunk call id>:<index in chunk>`.
+"""
+
+import copy
+import hashlib
+import json
+from typing import Dict, List, Tuple
+
+# Nodes whose literal inputs decide which models a workflow keeps in memory
+LOADER_NODE_TYPES = (
+    "UNETLoader",
+    "CheckpointLoaderSimple",
+    "VAELoader",
+    "DualCLIPLoader",
+    "UpscaleModelLoader",
+    "LoraLoader",
+    "LoraLoaderModelOnly",
+)
+
+# Default number of items a single worker call runs back to back
+DEFAULT_CHUNK_SIZE = 4
+
+
+def loader_signature(workflow: Dict) -> str:
+    """Return a short hash of the models loaded by a workflow's loader nodes."""
+    loaders = []
+    for node in workflow.values():
+        if not isinstance(node, dict) or node.get("class_type") not in LOADER_NODE_TYPES:
+            continue
+        # Links ([node_id, slot]) do not name a model, only literal inputs do
+        inputs = {k: v for k, v in node.get("inputs", {}).items() if not isinstance(v, list)}
+        loaders.append([node["class_type"], inputs])
+    loaders.sort(key=lambda loader: json.dumps(loader, sort_keys=True))
+    return hashlib.sha256(json.dumps(loaders, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def apply_inputs(workflow: Dict, overrides: Dict) -> Dict:
+    """Return a copy of a workflow with `{node_id: {input: value}}` overrides applied."""
+    if not isinstance(overrides, dict):
+        raise ValueError("Batch inputs must be objects mapping node ids to input values")
+    result = copy.deepcopy(workflow)
+    for node_id, inputs in overrides.items():
+        if node_id not in result:
+            raise ValueError(f"Batch inputs reference unknown node {node_id}")
+        if not isinstance(inputs, dict):
+            raise ValueError(f"Batch inputs for node {node_id} must be an object")
+        result[node_id].setdefault("inputs", {}).update(inputs)
+    return result
+
+
+def plan_batch(workflows: List[Dict], chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[Tuple[str, List[int]]]:
+    """Group item indexes by loader signature and split each group into chunks.
+
+    Returns `(signature, indexes)` pairs; groups keep the order in which they
+    first appear in the batch so chunks of one group are dispatched together.
+    """
+    groups: Dict[str, List[int]] = {}
+    for index, workflow in enumerate(workflows):
+        groups.setdefault(loader_signature(workflow), []).append(index)
+
+    chunks = []
+    for signature, indexes in groups.items():
+        for start in range(0, len(indexes), chunk_size):
+            chunks.append((signature, indexes[start:start + chunk_size]))
+    return chunks
+
+
+def item_id(call_id: str, index: int) -> str:
+    return f"{call_id}:{index}"
+
+
+def parse_item_id(value: str) -> Tuple[str, int]:
+    """Split a batch item id into its chunk call id and index. Raises ValueError."""
+    call_id, _, index = value.rpartition(":")
+    if not call_id or not index.isdigit():
+        raise ValueError(f"Invalid batch item id: {value}")
+    return call_id, int(index)
@@ -0,0 +1,181 @@
+"""
+Content-addressed result cache.
+
+Outputs of a finished workflow are stored under the canonical workflow hash
+(see `canonical.py`), so re-submitting the same graph with the same input
+image and seed returns the stored images instead of running on a GPU again.
+
+Each entry is a directory `<root>/<key>/` holding the output files and a
+`meta.json` with its size and last access time. Entries are evicted least
+recently used first once the cache grows past `max_bytes`.
+
+Volume syncs are kept off the request path: a miss reloads the volume at
+most every `reload_interval` seconds, access times of hits are written in
+batches every `flush_interval` seconds, and eviction is left to `evict`,
+which the app runs on a schedule.
+"""
+
+import json
+import logging
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Where the result cache Volume is mounted in the containers
+RESULT_CACHE_DIR = "/result-cache"
+
+# Default size bound of the cache
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+
+# Shortest time between two volume reloads caused by cache misses
+DEFAULT_RELOAD_INTERVAL = 10.0
+
+# How long access times of cache hits are held before they are written back
+DEFAULT_FLUSH_INTERVAL = 60.0
+
+META_FILENAME = "meta.json"
+
+
+class ResultCache:
+    """Size-bounded LRU cache of workflow outputs, backed by a directory or Modal Volume."""
+
+    def __init__(
+        self,
+        root: str = RESULT_CACHE_DIR,
+        volume=None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        reload_interval: float = DEFAULT_RELOAD_INTERVAL,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+    ):
+        self.root = Path(root)
+        self.volume = volume
+        self.max_bytes = max_bytes
+        self.reload_interval = reload_interval
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._last_reload = 0.0
+        self._last_flush = time.monotonic()
+        # Access times of hits not written back yet, by key
+        self._accessed: Dict[str, float] = {}
+
+    def _commit(self):
+        if self.volume is not None:
+            self.volume.commit()
+
+    def _reload(self):
+        if self.volume is None:
+            return
+        with self._lock:
+            if time.monotonic() - self._last_reload < self.reload_interval:
+                return
+            self._last_reload = time.monotonic()
+        try:
+            self.volume.reload()
+        except Exception as e:
+            # Reloading fails while files of the volume are open in this container
+            logger.warning(f"Failed to reload result cache volume: {str(e)}")
+
+    def _read_meta(self, key: str) -> Optional[Dict]:
+        try:
+            return json.loads((self.root / key / META_FILENAME).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def contains(self, key: str) -> bool:
+        """Check whether a key is cached, reloading the volume on a local miss."""
+        if self._read_meta(key) is None:
+            self._reload()
+        return self._read_meta(key) is not None
+
+    def get(self, key: str) -> Optional[List[Path]]:
+        """Return the cached output files of a key and mark it as recently used."""
+        meta = self._read_meta(key)
+        if meta is None:
+            self._reload()
+            meta = self._read_meta(key)
+        if meta is None:
+            return None
+
+        files = [self.root / key / name for name in meta["files"]]
+        if not all(f.is_file() for f in files):
+            logger.warning(f"Result cache entry {key} is incomplete, ignoring it")
+            return None
+
+        with self._lock:
+            self._accessed[key] = time.time()
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+        return files
+
+    def flush(self):
+        """Write the access times of recent hits back to their entries."""
+        with self._lock:
+            accessed, self._accessed = self._accessed, {}
+            self._last_flush = time.monotonic()
+        written = 0
+        for key, last_access in accessed.items():
+            meta = self._read_meta(key)
+            if meta is None or meta.get("last_access", 0) >= last_access:
+                continue
+            meta["last_access"] = last_access
+            try:
+                (self.root / key / META_FILENAME).write_text(json.dumps(meta))
+                written += 1
+            except OSError:
+                # The entry was evicted in the meantime
+                pass
+        if written:
+            self._commit()
+
+    def put(self, key: str, files: List[Path]):
+        """Store the output files of a run under a key."""
+        # Write into a temporary directory first so readers never see a partial entry
+        tmp_dir = self.root / f".tmp-{uuid.uuid4().hex}"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        size = 0
+        for f in files:
+            shutil.copyfile(f, tmp_dir / f.name)
+            size += f.stat().st_size
+        now = time.time()
+        meta = {"files": [f.name for f in files], "size": size, "created": now, "last_access": now}
+        (tmp_dir / META_FILENAME).write_text(json.dumps(meta))
+
+        entry_dir = self.root / key
+        if entry_dir.exists():
+            # Another run stored the same key first, keep that entry
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        tmp_dir.rename(entry_dir)
+        logger.info(f"Stored {len(files)} files ({size} bytes) in result cache entry {key}")
+        self._commit()
+
+    def evict(self) -> int:
+        """Delete least recently used entries until the cache fits in max_bytes. Returns the entries deleted."""
+        if not self.root.is_dir():
+            return 0
+        entries = []
+        for entry_dir in self.root.iterdir():
+            if entry_dir.name.startswith("."):
+                continue
+            meta = self._read_meta(entry_dir.name)
+            if meta is not None:
+                entries.append((meta.get("last_access", 0), meta.get("size", 0), entry_dir))
+
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, entry_dir in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            logger.info(f"Evicting result cache entry {entry_dir.name} ({size} bytes)")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            evicted += 1
+        if evicted:
+            self._commit()
+        return evicted
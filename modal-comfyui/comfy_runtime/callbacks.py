@@ -0,0 +1,128 @@
+"""
+Completion webhooks.
+
+Clients can register a `callback_url` for a call id. When the call finishes,
+the worker takes the registered URLs out of a shared store and each one is
+POSTed a compact summary of the result. Failed deliveries are retried with
+exponential backoff.
+
+Callback hosts must resolve to public addresses only, so that webhooks
+cannot be pointed at the ComfyUI server, cloud metadata endpoints or other
+private services. The check runs when the URL is registered and again
+before every delivery attempt, and redirects are not followed.
+"""
+
+import ipaddress
+import logging
+import random
+import socket
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# Retry policy for webhook deliveries
+MAX_ATTEMPTS = 6
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+REQUEST_TIMEOUT = 10.0
+
+
+class CallbackRegistry:
+    """Maps call ids to callback URLs through a `modal.Dict`-like store."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def register(self, call_id: str, url: str):
+        """Add a callback URL for a call id."""
+        urls = self.store.get(call_id) or []
+        if url not in urls:
+            self.store[call_id] = urls + [url]
+
+    def take(self, call_id: str) -> List[str]:
+        """Remove and return the callback URLs of a call id (each URL is taken only once)."""
+        try:
+            return self.store.pop(call_id)
+        except KeyError:
+            return []
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    # Loopback, private, link-local, shared, reserved and unspecified addresses are not global
+    return ip.is_global and not ip.is_multicast
+
+
+def blocked_reason(url: str) -> Optional[str]:
+    """Why a callback URL may not be called, or None if its host only resolves to public addresses."""
+    parsed = urlparse(url)
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    except ValueError:
+        return "invalid port"
+    if not parsed.hostname:
+        return "missing host"
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        return f"host {parsed.hostname} cannot be resolved"
+    for info in infos:
+        address = info[4][0]
+        if not _is_public(address):
+            return f"host {parsed.hostname} resolves to non-public address {address}"
+    return None
+
+
+def validate_callback_url(url: str) -> bool:
+    """Accept only absolute http(s) URLs whose host resolves to public addresses. Resolves the host."""
+    if not isinstance(url, str) or len(url) > 2048:
+        return False
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        return False
+    reason = blocked_reason(url)
+    if reason:
+        logger.warning(f"Rejected callback URL {url}: {reason}")
+        return False
+    return True
+
+
+def post_with_retry(
+    url: str,
+    payload: Dict,
+    max_attempts: int = MAX_ATTEMPTS,
+    base_delay: float = BASE_DELAY,
+    max_delay: float = MAX_DELAY,
+) -> bool:
+    """POST a JSON payload, retrying connection errors, 429 and 5xx with backoff."""
+    import requests
+
+    for attempt in range(1, max_attempts + 1):
+        # The host may resolve differently than when the URL was registered
+        reason = blocked_reason(url)
+        if reason:
+            logger.error(f"Not delivering callback to {url}: {reason}")
+            return False
+        try:
+            response = requests.post(url, json=payload, timeout=REQUEST_TIMEOUT, allow_redirects=False)
+            if response.status_code < 300:
+                logger.info(f"Delivered callback for {payload.get('id')} to {url}")
+                return True
+            if response.status_code != 429 and response.status_code < 500:
+                # Other client errors will not get better by retrying
+                logger.error(f"Callback to {url} rejected with status {response.status_code}")
+                return False
+            logger.warning(f"Callback to {url} failed with status {response.status_code} (attempt {attempt})")
+        except requests.RequestException as e:
+            logger.warning(f"Callback to {url} failed: {str(e)} (attempt {attempt})")
+
+        if attempt < max_attempts:
+            # Exponential backoff with full jitter
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1))))
+
+    logger.error(f"Giving up on callback to {url} after {max_attempts} attempts")
+    return False
@@ -0,0 +1,61 @@
+"""
+Canonical form and content hash of ComfyUI API workflows.
+
+Two workflows that would produce the same images must hash the same, so the
+canonical form drops UI-only data (`_meta`), sorts keys, normalizes numeric
+literals and replaces large embedded payloads (base64 input images) with
+their sha256 digest.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict
+
+# Strings longer than this are treated as embedded payloads and hashed
+PAYLOAD_MIN_LENGTH = 256
+
+# Significant digits kept when normalizing floats (0.10000000000000002 -> 0.1)
+FLOAT_DIGITS = 12
+
+
+def _sha256(data: str) -> str:
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, (bool, int)) or value is None:
+        # Integers (seeds in particular) are kept exact
+        return value
+    if isinstance(value, float):
+        if value.is_integer():
+            return int(value)
+        return float(f"{value:.{FLOAT_DIGITS}g}")
+    if isinstance(value, str):
+        if len(value) >= PAYLOAD_MIN_LENGTH:
+            return f"sha256:{_sha256(value)}"
+        return value
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items() if k != "_meta"}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def canonicalize_workflow(workflow: Dict) -> Dict:
+    """Return the canonical form of an API-format workflow."""
+    return _normalize(workflow)
+
+
+def canonicalize_value(value: Any) -> Any:
+    """Return the canonical form of a single node input value."""
+    return _normalize(value)
+
+
+def canonical_hash(canonical: Dict) -> str:
+    """Return the sha256 of an already canonical workflow."""
+    return _sha256(json.dumps(canonical, sort_keys=True, separators=(",", ":")))
+
+
+def workflow_hash(workflow: Dict) -> str:
+    """Return the sha256 of the canonical JSON encoding of a workflow."""
+    return canonical_hash(canonicalize_workflow(workflow))
@@ -0,0 +1,109 @@
+"""
+Custom node packs: which pack provides which node, and lazy loading.
+
+The node index maps every `class_type` to the custom node pack (directory
+under `custom_nodes`) that provides it, or to "core" for ComfyUI's own
+nodes. It is built from the `/object_info` of a running server, once, when
+the image is built.
+
+In lazy mode, the packs that no deployed workflow uses are renamed to
+`<pack>.disabled` before the server starts, which ComfyUI skips on startup.
+
+`memory_snapshot_helper` profiles the import of every pack and writes the
+result to `IMPORT_PROFILE_PATH`.
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+CUSTOM_NODES_DIR = "/root/comfy/ComfyUI/custom_nodes"
+
+NODE_INDEX_PATH = "/root/node_pack_index.json"
+
+# Written by memory_snapshot_helper/prestartup_script.py
+IMPORT_PROFILE_PATH = "/tmp/custom_node_import_profile.json"
+
+CORE_PACK = "core"
+
+# Packs that are loaded whatever the workflows use
+ALWAYS_LOADED = ("memory_snapshot_helper",)
+
+# "all" loads every installed pack, "lazy" only those the deployed workflows use
+CUSTOM_NODE_MODES = ("all", "lazy")
+
+
+def build_node_index(object_info: Dict) -> Dict[str, str]:
+    """Map class types to pack names from a server's `/object_info` response."""
+    index = {}
+    for class_type, info in object_info.items():
+        module = info.get("python_module", "")
+        if module.startswith("custom_nodes."):
+            index[class_type] = module.split(".")[1]
+        else:
+            index[class_type] = CORE_PACK
+    return index
+
+
+def write_node_index(index: Dict[str, str], path: str = NODE_INDEX_PATH):
+    Path(path).write_text(json.dumps(index, indent=2, sort_keys=True))
+
+
+def load_node_index(path: str = NODE_INDEX_PATH) -> Dict[str, str]:
+    try:
+        return json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def required_packs(index: Dict[str, str], *workflows: Dict) -> Tuple[Set[str], Set[str]]:
+    """Return the custom node packs the workflows use, and the class types missing from the index."""
+    packs, unknown = set(), set()
+    for workflow in workflows:
+        for node in workflow.values():
+            if not isinstance(node, dict) or "class_type" not in node:
+                continue
+            pack = index.get(node["class_type"])
+            if pack is None:
+                unknown.add(node["class_type"])
+            elif pack != CORE_PACK:
+                packs.add(pack)
+    return packs, unknown
+
+
+def enable_only(packs: Set[str], custom_nodes_dir: str = CUSTOM_NODES_DIR) -> List[str]:
+    """Disable every pack not in `packs` (re-enabling the ones that are). Returns the disabled packs."""
+    keep = set(packs) | set(ALWAYS_LOADED)
+    disabled = []
+    for path in sorted(Path(custom_nodes_dir).iterdir()):
+        if not path.is_dir() or path.name.startswith((".", "__")):
+            continue
+        name = path.name[: -len(".disabled")] if path.name.endswith(".disabled") else path.name
+        if name in keep and path.name != name:
+            path.rename(path.with_name(name))
+        elif name not in keep:
+            if path.name == name:
+                path.rename(path.with_name(f"{name}.disabled"))
+            disabled.append(name)
+    return disabled
+
+
+def enabled_packs(custom_nodes_dir: str = CUSTOM_NODES_DIR) -> Set[str]:
+    """Packs the server loads, i.e. the installed packs that are not disabled."""
+    return {
+        path.name
+        for path in Path(custom_nodes_dir).iterdir()
+        if path.is_dir() and not path.name.startswith((".", "__")) and not path.name.endswith(".disabled")
+    }
+
+
+def load_import_profile(path: str = IMPORT_PROFILE_PATH) -> List[Dict]:
+    """Return the per-pack import profile of the running server, slowest first."""
+    try:
+        profile = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return []
+    return sorted(profile, key=lambda entry: entry["seconds"], reverse=True)
@@ -0,0 +1,214 @@
+"""
+In-process ComfyUI execution engine.
+
+Talks to an already-running ComfyUI server over its HTTP and websocket API
+instead of shelling out to `comfy run` for every job:
+
+1. Open a websocket on `/ws?clientId=...` so no progress message is missed
+2. POST the graph to `/prompt` and remember the returned `prompt_id`
+3. Follow `executing` / `progress` / `execution_error` messages until the prompt finishes
+4. Read the recorded outputs from `/history/{prompt_id}`
+"""
+
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Default time budget for a single prompt, matches the old `comfy run --timeout 1200`
+DEFAULT_TIMEOUT = 1200
+
+
+class ComfyExecutionError(RuntimeError):
+    """Raised when ComfyUI rejects or fails to execute a prompt."""
+
+    def __init__(self, message: str, details: Optional[Dict] = None):
+        super().__init__(message)
+        self.details = details or {}
+
+
+@dataclass
+class ExecutionResult:
+    """Outcome of a finished prompt as recorded in `/history/{prompt_id}`."""
+
+    prompt_id: str
+    outputs: Dict = field(default_factory=dict)
+    status: Dict = field(default_factory=dict)
+    elapsed: float = 0.0
+    # Seconds spent executing each node, when the run was followed over the websocket
+    node_timings: Dict[str, float] = field(default_factory=dict)
+
+    def images(self) -> List[Dict]:
+        """Flatten the per-node image records (`filename`, `subfolder`, `type`)."""
+        images = []
+        for node_id, node_output in self.outputs.items():
+            for image in node_output.get("images", []):
+                images.append({**image, "node_id": node_id})
+        return images
+
+
+class ComfyEngine:
+    """Submit prompts to a local ComfyUI server and wait for their outputs."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8000):
+        self.host = host
+        self.port = port
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _request(self, method: str, path: str, payload: Optional[Dict] = None, timeout: float = 30) -> Dict:
+        """Send a JSON request to the ComfyUI server and decode the JSON response."""
+        import requests
+
+        response = requests.request(method, f"{self.base_url}{path}", json=payload, timeout=timeout)
+        if response.status_code == 400 and path == "/prompt":
+            # Validation failures come back as 400 with per-node errors
+            body = response.json()
+            error = body.get("error", {})
+            raise ComfyExecutionError(
+                f"ComfyUI rejected the workflow: {error.get('message', response.text)}",
+                details={"error": error, "node_errors": body.get("node_errors", {})},
+            )
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+    def queue_prompt(self, workflow: Dict, client_id: str) -> str:
+        """POST a graph to `/prompt` and return its prompt_id."""
+        body = self._request("POST", "/prompt", {"prompt": workflow, "client_id": client_id})
+        prompt_id = body["prompt_id"]
+        logger.info(f"Queued prompt {prompt_id} (queue number {body.get('number')})")
+        return prompt_id
+
+    def get_history(self, prompt_id: str) -> Optional[Dict]:
+        """Return the history entry of a prompt, or None if it has not finished yet."""
+        return self._request("GET", f"/history/{prompt_id}").get(prompt_id)
+
+    def cancel(self, prompt_id: str):
+        """Remove a prompt from the pending queue (a running prompt is left alone)."""
+        try:
+            self._request("POST", "/queue", {"delete": [prompt_id]})
+        except Exception as e:
+            logger.warning(f"Failed to remove prompt {prompt_id} from queue: {str(e)}")
+
+    def _open_websocket(self, client_id: str):
+        import websocket
+
+        ws = websocket.WebSocket()
+        ws.connect(f"ws://{self.host}:{self.port}/ws?clientId={client_id}", timeout=10)
+        return ws
+
+    def _follow_websocket(self, ws, prompt_id: str, deadline: float) -> Dict[str, float]:
+        """Consume websocket messages until the prompt finishes or fails. Returns per-node timings."""
+        import websocket
+
+        timings: Dict[str, float] = {}
+        current, current_started = None, 0.0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Prompt {prompt_id} did not finish in time")
+            ws.settimeout(remaining)
+            try:
+                message = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                raise TimeoutError(f"Prompt {prompt_id} did not finish in time")
+
+            # Binary frames are latent previews, we only care about JSON events
+            if not isinstance(message, str):
+                continue
+
+            event = json.loads(message)
+            event_type = event.get("type")
+            data = event.get("data", {})
+            if data.get("prompt_id") not in (None, prompt_id):
+                continue
+
+            if event_type == "progress":
+                logger.debug(f"Prompt {prompt_id} node {data.get('node')}: {data.get('value')}/{data.get('max')}")
+            elif event_type == "executing":
+                # A node runs until the next one starts
+                now = time.monotonic()
+                if current is not None:
+                    timings[current] = timings.get(current, 0.0) + now - current_started
+                current, current_started = data.get("node"), now
+                if data.get("node") is None and data.get("prompt_id") == prompt_id:
+                    return timings
+                logger.debug(f"Prompt {prompt_id} executing node {data.get('node')}")
+            elif event_type == "execution_success":
+                if current is not None:
+                    timings[current] = timings.get(current, 0.0) + time.monotonic() - current_started
+                return timings
+            elif event_type == "execution_error":
+                raise ComfyExecutionError(
+                    f"Node {data.get('node_id')} ({data.get('node_type')}) failed: {data.get('exception_message', '').strip()}",
+                    details={
+                        "node_id": data.get("node_id"),
+                        "node_type": data.get("node_type"),
+                        "exception_type": data.get("exception_type"),
+                        "exception_message": data.get("exception_message"),
+                        "traceback": data.get("traceback"),
+                    },
+                )
+            elif event_type == "execution_interrupted":
+                raise ComfyExecutionError(f"Prompt {prompt_id} was interrupted", details=data)
+
+    def _poll_history(self, prompt_id: str, deadline: float, interval: float = 0.5) -> Dict:
+        """Fallback used when the websocket drops: poll `/history` until the prompt shows up."""
+        while time.monotonic() < deadline:
+            entry = self.get_history(prompt_id)
+            if entry is not None:
+                return entry
+            time.sleep(interval)
+        raise TimeoutError(f"Prompt {prompt_id} did not finish in time")
+
+    def run(self, workflow: Dict, timeout: float = DEFAULT_TIMEOUT) -> ExecutionResult:
+        """Execute a workflow on the server and return its recorded outputs."""
+        client_id = uuid.uuid4().hex
+        started = time.monotonic()
+        deadline = started + timeout
+
+        # Connect first so that no event for our prompt is emitted before we listen
+        ws = None
+        node_timings: Dict[str, float] = {}
+        try:
+            ws = self._open_websocket(client_id)
+        except Exception as e:
+            logger.warning(f"Websocket unavailable, falling back to history polling: {str(e)}")
+
+        try:
+            prompt_id = self.queue_prompt(workflow, client_id)
+            try:
+                if ws is not None:
+                    try:
+                        node_timings = self._follow_websocket(ws, prompt_id, deadline)
+                    except (ComfyExecutionError, TimeoutError):
+                        raise
+                    except Exception as e:
+                        logger.warning(f"Websocket dropped for prompt {prompt_id}, polling history: {str(e)}")
+                entry = self._poll_history(prompt_id, deadline)
+            except TimeoutError:
+                self.cancel(prompt_id)
+                raise
+        finally:
+            if ws is not None:
+                ws.close()
+
+        status = entry.get("status", {})
+        if status.get("status_str") == "error":
+            raise ComfyExecutionError(f"Prompt {prompt_id} failed", details={"messages": status.get("messages", [])})
+
+        elapsed = time.monotonic() - started
+        logger.info(f"Prompt {prompt_id} finished in {elapsed:.2f}s")
+        return ExecutionResult(
+            prompt_id=prompt_id,
+            outputs=entry.get("outputs", {}),
+            status=status,
+            elapsed=elapsed,
+            node_timings=node_timings,
+        )
@@ -0,0 +1,181 @@
+"""
+Background health monitoring of the local ComfyUI server.
+
+A daemon thread polls `/system_stats` and `/queue` every few seconds and
+keeps the latest result, so request handlers read the cached state instead
+of probing the server themselves. When the server stops answering for
+`failure_threshold` polls in a row, `on_unhealthy` is called once, which lets
+the container drain before a request runs into the dead server.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 5.0
+
+DEFAULT_TIMEOUT = 5.0
+
+# Failed polls in a row before the server counts as unhealthy
+DEFAULT_FAILURE_THRESHOLD = 2
+
+
+@dataclass
+class HealthState:
+    """Latest view of the server, as of `checked_at`."""
+
+    healthy: bool = True
+    checked_at: Optional[float] = None
+    consecutive_failures: int = 0
+    error: Optional[str] = None
+    vram_total: Optional[int] = None
+    vram_free: Optional[int] = None
+    ram_total: Optional[int] = None
+    ram_free: Optional[int] = None
+    queue_running: int = 0
+    queue_pending: int = 0
+
+    def to_dict(self) -> Dict:
+        state = asdict(self)
+        if self.checked_at is not None:
+            state["age_seconds"] = round(time.time() - self.checked_at, 3)
+        return state
+
+
+class HealthMonitor:
+    """Poll a ComfyUI server in a background thread and cache its health."""
+
+    def __init__(
+        self,
+        port: int,
+        host: str = "127.0.0.1",
+        interval: float = DEFAULT_INTERVAL,
+        timeout: float = DEFAULT_TIMEOUT,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        on_unhealthy: Optional[Callable[[HealthState], None]] = None,
+    ):
+        self.base_url = f"http://{host}:{port}"
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.on_unhealthy = on_unhealthy
+        self._state = HealthState()
+        self._lock = threading.Lock()
+        # Polls from the monitor thread and from jobs share the session and the state transitions
+        self._check_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._paused = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._session = None
+
+    @property
+    def state(self) -> HealthState:
+        with self._lock:
+            return self._state
+
+    def start(self):
+        """Poll once, then keep polling in a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.check()
+        self._thread = threading.Thread(target=self._run, name="comfy-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.timeout + self.interval)
+            self._thread = None
+
+    @contextmanager
+    def paused(self):
+        """Stop polling while the server is restarted on purpose, then poll it right away."""
+        self._paused.set()
+        try:
+            yield
+        finally:
+            self._paused.clear()
+            self.check()
+
+    def check(self) -> HealthState:
+        """Poll the server once and update the cached state."""
+        with self._check_lock:
+            previous, state = self._poll()
+
+        if previous.healthy and not state.healthy:
+            logger.error(f"ComfyUI server is unhealthy: {state.error}")
+            if self.on_unhealthy is not None:
+                try:
+                    self.on_unhealthy(state)
+                except Exception as e:
+                    logger.error(f"Unhealthy handler failed: {str(e)}")
+        elif not previous.healthy and state.healthy:
+            logger.info("ComfyUI server is healthy again")
+        return state
+
+    def _poll(self) -> Tuple[HealthState, HealthState]:
+        """Query the server and store the new state. Returns the previous and the new state."""
+        import requests
+
+        if self._session is None:
+            # Reuse one keep-alive connection for every poll
+            self._session = requests.Session()
+
+        previous = self.state
+        try:
+            stats = self._session.get(f"{self.base_url}/system_stats", timeout=self.timeout)
+            stats.raise_for_status()
+            queue = self._session.get(f"{self.base_url}/queue", timeout=self.timeout)
+            queue.raise_for_status()
+            state = self._parse(stats.json(), queue.json())
+        except (requests.RequestException, ValueError) as e:
+            failures = previous.consecutive_failures + 1
+            state = HealthState(
+                healthy=previous.healthy and failures < self.failure_threshold,
+                checked_at=time.time(),
+                consecutive_failures=failures,
+                error=str(e),
+                # Keep the last known resource usage
+                vram_total=previous.vram_total,
+                vram_free=previous.vram_free,
+                ram_total=previous.ram_total,
+                ram_free=previous.ram_free,
+                queue_running=previous.queue_running,
+                queue_pending=previous.queue_pending,
+            )
+            logger.warning(f"ComfyUI health check failed ({failures} in a row): {str(e)}")
+
+        with self._lock:
+            self._state = state
+        return previous, state
+
+    def _parse(self, stats: Dict, queue: Dict) -> HealthState:
+        system = stats.get("system", {})
+        # The first device is the one ComfyUI runs on
+        device = (stats.get("devices") or [{}])[0]
+        return HealthState(
+            healthy=True,
+            checked_at=time.time(),
+            vram_total=device.get("vram_total"),
+            vram_free=device.get("vram_free"),
+            ram_total=system.get("ram_total"),
+            ram_free=system.get("ram_free"),
+            queue_running=len(queue.get("queue_running", [])),
+            queue_pending=len(queue.get("queue_pending", [])),
+        )
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self._paused.is_set():
+                continue
+            try:
+                self.check()
+            except Exception as e:
+                # The monitor must outlive unexpected errors
+                logger.error(f"Health monitor error: {str(e)}")
@@ -0,0 +1,176 @@
+"""
+Content-addressed input images.
+
+Input images are stored once, under the sha256 of their bytes, in an input
+store (a directory, normally a mounted Modal Volume). Workflows then carry
+the short key (`<sha256>.<ext>`) in the `image` input of their
+`ETN_LoadImageBase64` nodes instead of the base64 data, which keeps request
+bodies, spawn arguments and result cache keys small.
+
+Right before a prompt is queued, the worker copies the file into ComfyUI's
+input directory (once per container and image) and rewrites those nodes to
+the file-based `LoadImage`, which has the same outputs. ComfyUI then reads
+the file from local disk instead of decoding base64 from the prompt.
+"""
+
+import base64
+import binascii
+import hashlib
+import logging
+import re
+import shutil
+import uuid
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Where the input store Volume is mounted in the containers
+INPUTS_DIR = "/inputs"
+
+# Files here can be loaded by `LoadImage`
+COMFY_INPUT_DIR = "/root/comfy/ComfyUI/input"
+
+BASE64_LOADER = "ETN_LoadImageBase64"
+FILE_LOADER = "LoadImage"
+
+# Largest accepted input image
+MAX_INPUT_BYTES = 64 * 1024 ** 2
+
+# File signatures of the accepted image formats
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF8", "gif"),
+    (b"BM", "bmp"),
+)
+
+_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}\.(png|jpg|webp|gif|bmp)$")
+
+
+def image_extension(data: bytes) -> Optional[str]:
+    """File extension of an image from its first bytes, None if it is not a known format."""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    for signature, extension in _SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    return None
+
+
+def is_input_key(value) -> bool:
+    return isinstance(value, str) and bool(_KEY_PATTERN.match(value))
+
+
+def base64_image_paths(workflow: Dict) -> Set[str]:
+    """`"<node_id>.image"` paths of the nodes that load base64 images."""
+    return {
+        f"{node_id}.image"
+        for node_id, node in workflow.items()
+        if isinstance(node, dict) and node.get("class_type") == BASE64_LOADER
+    }
+
+
+class InputStore:
+    """Stores input images under their content hash.
+
+    When backed by a Modal Volume, writers commit after storing an image and
+    readers reload the volume when a key is not visible yet, like `ResultStore`.
+    """
+
+    def __init__(self, root: str = INPUTS_DIR, volume=None):
+        self.root = Path(root)
+        self.volume = volume
+
+    def put(self, data: bytes) -> Tuple[str, bool]:
+        """Store an image. Returns its key and whether it was new. Raises ValueError for non-images."""
+        if len(data) > MAX_INPUT_BYTES:
+            raise ValueError(f"Input image is larger than {MAX_INPUT_BYTES // 1024 ** 2} MB")
+        extension = image_extension(data)
+        if extension is None:
+            raise ValueError("Input is not a PNG, JPEG, WebP, GIF or BMP image")
+
+        key = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+        dest = self.root / key
+        if dest.is_file():
+            return key, False
+
+        # Write under a temporary name first so readers never see a partial image
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".tmp-{uuid.uuid4().hex}"
+        tmp.write_bytes(data)
+        tmp.rename(dest)
+        if self.volume is not None:
+            self.volume.commit()
+        logger.info(f"Stored input image {key} ({len(data)} bytes)")
+        return key, True
+
+    def put_base64(self, data: str) -> str:
+        """Store a base64 image (optionally a data URL) and return its key. Raises ValueError."""
+        if data.startswith("data:") and "," in data:
+            data = data.split(",", 1)[1]
+        try:
+            decoded = base64.b64decode(data, validate=True)
+        except (binascii.Error, ValueError):
+            raise ValueError("Input image is not valid base64")
+        return self.put(decoded)[0]
+
+    def resolve(self, key: str) -> Optional[Path]:
+        """Return the path of a stored key, or None if it is invalid or missing."""
+        if not is_input_key(key):
+            return None
+        path = self.root / key
+        if not path.is_file() and self.volume is not None:
+            try:
+                self.volume.reload()
+            except Exception as e:
+                # Reloading fails while files of the volume are open in this container
+                logger.warning(f"Failed to reload inputs volume: {str(e)}")
+        return path if path.is_file() else None
+
+    def ingest(self, workflow: Dict) -> Dict:
+        """Move the base64 images of a workflow into the store, replacing them with their keys.
+
+        Only the nodes that change are copied. Raises ValueError for payloads
+        that are not images.
+        """
+        result = workflow
+        for path in base64_image_paths(workflow):
+            node_id = path.split(".", 1)[0]
+            node = workflow[node_id]
+            data = node.get("inputs", {}).get("image")
+            if not isinstance(data, str) or not data or is_input_key(data):
+                continue
+            if result is workflow:
+                result = dict(workflow)
+            result[node_id] = {**node, "inputs": {**node["inputs"], "image": self.put_base64(data)}}
+        return result
+
+    def place(self, key: str, input_dir: str = COMFY_INPUT_DIR) -> Path:
+        """Copy a stored image into ComfyUI's input directory, unless it is already there."""
+        dest = Path(input_dir) / key
+        if dest.is_file():
+            return dest
+        src = self.resolve(key)
+        if src is None:
+            raise FileNotFoundError(f"Input image {key} is not in the input store")
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.parent / f".tmp-{uuid.uuid4().hex}"
+        shutil.copyfile(src, tmp)
+        tmp.rename(dest)
+        return dest
+
+    def use_input_files(self, workflow: Dict, input_dir: str = COMFY_INPUT_DIR) -> Dict:
+        """Place the stored images a workflow references and load them with `LoadImage`."""
+        result = workflow
+        for path in base64_image_paths(workflow):
+            node_id = path.split(".", 1)[0]
+            node = workflow[node_id]
+            key = node.get("inputs", {}).get("image")
+            if not is_input_key(key):
+                continue
+            self.place(key, input_dir)
+            if result is workflow:
+                result = dict(workflow)
+            result[node_id] = {**node, "class_type": FILE_LOADER, "inputs": {"image": key}}
+        return result
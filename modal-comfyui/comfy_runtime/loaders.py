@@ -0,0 +1,53 @@
+"""
+Model files referenced by workflows.
+
+Maps the loader nodes of API-format workflows to the files they load from
+the ComfyUI models directory, so the models a deployment needs can be
+worked out from its workflow files.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# Loader class_type -> {input name: models subfolder}, in the order models are prioritized
+MODEL_LOADER_INPUTS: Dict[str, Dict[str, str]] = {
+    "UNETLoader": {"unet_name": "unet"},
+    "CheckpointLoaderSimple": {"ckpt_name": "checkpoints"},
+    "DualCLIPLoader": {"clip_name1": "clip", "clip_name2": "clip"},
+    "CLIPLoader": {"clip_name": "clip"},
+    "VAELoader": {"vae_name": "vae"},
+    "UpscaleModelLoader": {"model_name": "upscale_models"},
+    "LoraLoader": {"lora_name": "loras"},
+    "LoraLoaderModelOnly": {"lora_name": "loras"},
+}
+
+
+def load_workflow_file(path) -> Dict:
+    """Read an API-format workflow, unwrapping `{"input": {"workflow": ...}}` request bodies."""
+    data = json.loads(Path(path).read_text())
+    if isinstance(data.get("input"), dict) and "workflow" in data["input"]:
+        return data["input"]["workflow"]
+    return data
+
+
+def required_models(*workflows: Dict) -> List[Tuple[str, str]]:
+    """Return the `(subfolder, filename)` pairs the workflows load, highest priority first."""
+    priority = list(MODEL_LOADER_INPUTS)
+    found = []
+    nodes = [node for workflow in workflows for node in workflow.values()]
+    for node in nodes:
+        if not isinstance(node, dict):
+            continue
+        class_type = node.get("class_type")
+        for input_name, subfolder in MODEL_LOADER_INPUTS.get(class_type, {}).items():
+            value = node.get("inputs", {}).get(input_name)
+            # Links ([node_id, slot]) are resolved at run time and cannot be known here
+            if isinstance(value, str) and value:
+                found.append((priority.index(class_type), subfolder, value))
+
+    models = []
+    for _, subfolder, filename in sorted(found, key=lambda f: f[0]):
+        if (subfolder, filename) not in models:
+            models.append((subfolder, filename))
+    return models
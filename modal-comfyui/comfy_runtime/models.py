@@ -0,0 +1,391 @@
+"""
+Lockfile-driven model downloads.
+
+Models are declared as `(repo_id, filename_or_filename|custom_name,
+destination_subfolder)` tuples. A lockfile (`models.lock.json`) pins each of
+them to a Hugging Face revision with its size and sha256 digest. It is
+written by `lock_models`, or from the command line without building any image:
+
+    python -m comfy_runtime.models modal_comfyui_api.py comfyapp.py
+
+`ModelDownloader` downloads the models into the cache volume concurrently,
+verifies sizes and digests, links them into the ComfyUI models directory,
+and fails loudly if any model is missing. With `HF_HUB_ENABLE_HF_TRANSFER`
+set, each file is downloaded in ranges over parallel connections with
+hf_transfer; otherwise it is streamed over one connection and partial files
+are resumed. Files that were already verified against the same lock entry
+are not read again, so rebuilding the image only downloads the entries that
+changed.
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ComfyUI looks up models in subfolders of this directory
+COMFY_MODELS_DIR = "/root/comfy/ComfyUI/models"
+
+LOCKFILE_NAME = "models.lock.json"
+
+# Records which cached files were verified against which lock entry
+STATE_FILENAME = ".verified.json"
+
+# Files downloaded at the same time, and attempts per file before giving up
+DEFAULT_CONCURRENCY = 4
+MAX_ATTEMPTS = 3
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Connections per file and size of the ranges they download, when hf_transfer is enabled
+PARALLEL_CONNECTIONS = 16
+PARALLEL_CHUNK_SIZE = 10 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """A model file of a Hugging Face repo and where ComfyUI expects it."""
+
+    repo_id: str
+    filename: str
+    subfolder: str
+    link_name: str
+
+    @classmethod
+    def from_tuple(cls, details: Tuple[str, str, str]) -> "ModelSpec":
+        repo_id, filename, subfolder = details
+        custom_filename = None
+        if "|" in filename:
+            filename, custom_filename = filename.split("|")
+        return cls(repo_id, filename, subfolder, custom_filename or filename.split("/")[-1])
+
+    @property
+    def key(self) -> str:
+        return f"{self.repo_id}/{self.filename}"
+
+    def cache_path(self, cache_dir: str) -> Path:
+        return Path(cache_dir) / "hf" / self.repo_id / self.filename
+
+    def link_path(self, models_dir: str = COMFY_MODELS_DIR) -> Path:
+        return Path(models_dir) / self.subfolder / self.link_name
+
+
+class RateLimiter:
+    """Token bucket shared by download threads; `None` means unlimited."""
+
+    def __init__(self, bytes_per_second: Optional[int] = None):
+        self.rate = bytes_per_second
+        self._allowance = float(bytes_per_second or 0)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n: int):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(float(self.rate), self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= n
+            delay = -self._allowance / self.rate if self._allowance < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+def _hf_transfer():
+    """The hf_transfer module if it is enabled with HF_HUB_ENABLE_HF_TRANSFER, else None."""
+    if os.environ.get("HF_HUB_ENABLE_HF_TRANSFER", "").lower() not in ("1", "true", "yes", "on"):
+        return None
+    try:
+        import hf_transfer
+    except ImportError:
+        logger.warning("HF_HUB_ENABLE_HF_TRANSFER is set but hf_transfer is not installed")
+        return None
+    return hf_transfer
+
+
+def load_lockfile(path) -> Dict[str, Dict]:
+    """Return the lock entries keyed by `repo_id/filename` (empty if there is no lockfile)."""
+    path = Path(path)
+    if not path.is_file():
+        return {}
+    return json.loads(path.read_text()).get("models", {})
+
+
+def write_lockfile(path, entries: Dict[str, Dict]):
+    path = Path(path)
+    path.write_text(json.dumps({"version": 1, "models": dict(sorted(entries.items()))}, indent=2) + "\n")
+
+
+def lock_models(specs: List[ModelSpec], path, token: Optional[str] = None) -> Dict[str, Dict]:
+    """Pin models to their current revision, size and sha256, merging into the lockfile."""
+    from huggingface_hub import HfApi
+
+    api = HfApi(token=token)
+    entries = load_lockfile(path)
+    revisions: Dict[str, str] = {}
+    for spec in specs:
+        if spec.repo_id not in revisions:
+            revisions[spec.repo_id] = api.model_info(spec.repo_id).sha
+        revision = revisions[spec.repo_id]
+        (info,) = api.get_paths_info(spec.repo_id, [spec.filename], revision=revision, expand=True)
+        entry = {"revision": revision, "size": info.size, "sha256": info.lfs.sha256 if info.lfs else None}
+        if entries.get(spec.key) != entry:
+            logger.info(f"Locked {spec.key} at {revision} ({info.size} bytes)")
+        entries[spec.key] = entry
+    write_lockfile(path, entries)
+    return entries
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelDownloader:
+    """Downloads, verifies and links models into a cache directory."""
+
+    def __init__(
+        self,
+        cache_dir: str,
+        lock: Optional[Dict[str, Dict]] = None,
+        token: Optional[str] = None,
+        models_dir: str = COMFY_MODELS_DIR,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_bytes_per_second: Optional[int] = None,
+        require_lock: bool = False,
+    ):
+        self.cache_dir = cache_dir
+        self.lock = lock or {}
+        self.token = token
+        self.models_dir = models_dir
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(max_bytes_per_second)
+        self.require_lock = require_lock
+        self._state_path = Path(cache_dir) / "hf" / STATE_FILENAME
+        self._state_lock = threading.Lock()
+        self._state = self._load_state()
+
+    def _load_state(self) -> Dict[str, Dict]:
+        try:
+            return json.loads(self._state_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        with self._state_lock:
+            self._state_path.parent.mkdir(parents=True, exist_ok=True)
+            self._state_path.write_text(json.dumps(self._state, indent=2))
+
+    def _is_current(self, spec: ModelSpec, entry: Dict) -> bool:
+        """Whether the cached file was verified against this lock entry and is unchanged."""
+        path = spec.cache_path(self.cache_dir)
+        record = self._state.get(spec.key)
+        if not path.is_file() or record is None:
+            return False
+        stat = path.stat()
+        return (
+            record.get("entry") == entry
+            and record.get("size") == stat.st_size
+            and record.get("mtime") == stat.st_mtime
+        )
+
+    def _verify(self, spec: ModelSpec, entry: Dict, path: Path, digest: Optional[str] = None):
+        """Check the size and digest of a file against its lock entry. Raises ValueError."""
+        size = path.stat().st_size
+        if entry.get("size") is not None and size != entry["size"]:
+            raise ValueError(f"{spec.key} has {size} bytes, expected {entry['size']}")
+        if entry.get("sha256"):
+            digest = digest or sha256_file(path)
+            if digest != entry["sha256"]:
+                raise ValueError(f"{spec.key} has sha256 {digest}, expected {entry['sha256']}")
+
+    def _fetch(self, spec: ModelSpec, entry: Dict, dest: Path) -> str:
+        """Download a file into `dest`, in parallel ranges or resuming a `.part` file. Returns its sha256."""
+        from huggingface_hub import hf_hub_url
+        from huggingface_hub.utils import build_hf_headers
+
+        part = dest.with_name(dest.name + ".part")
+        part.parent.mkdir(parents=True, exist_ok=True)
+        offset = part.stat().st_size if part.exists() else 0
+        if entry.get("size") is not None and offset > entry["size"]:
+            offset = 0
+
+        url = hf_hub_url(spec.repo_id, spec.filename, revision=entry.get("revision"))
+        headers = build_hf_headers(token=self.token)
+        # hf_transfer cannot be rate limited, and a streamed partial file is resumed instead
+        hf_transfer = _hf_transfer() if not offset and not self.limiter.rate else None
+        if hf_transfer is not None:
+            self._fetch_parallel(hf_transfer, url, headers, part)
+        else:
+            self._fetch_stream(spec, url, headers, part, offset)
+
+        digest = sha256_file(part)
+        os.replace(part, dest)
+        return digest
+
+    def _fetch_parallel(self, hf_transfer, url: str, headers: Dict, part: Path):
+        """Download a file in ranges over parallel connections."""
+        from huggingface_hub import get_hf_file_metadata
+
+        # Ranges go straight to the storage the Hub redirects to
+        location = get_hf_file_metadata(url, token=self.token).location
+        try:
+            hf_transfer.download(
+                url=location,
+                filename=str(part),
+                max_files=PARALLEL_CONNECTIONS,
+                chunk_size=PARALLEL_CHUNK_SIZE,
+                headers=headers,
+                parallel_failures=3,
+                max_retries=5,
+            )
+        except Exception:
+            # Ranges are written out of order, so a partial file cannot be resumed
+            part.unlink(missing_ok=True)
+            raise
+
+    def _fetch_stream(self, spec: ModelSpec, url: str, headers: Dict, part: Path, offset: int):
+        """Stream a file over one connection, appending to a partial file from `offset`."""
+        import requests
+
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+
+        with requests.get(url, headers=headers, stream=True, timeout=60) as response:
+            if response.status_code == 416:
+                # The partial file already holds every byte
+                response.close()
+            else:
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # The server ignored the range, start over
+                    offset = 0
+                if offset:
+                    logger.info(f"Resuming {spec.key} at byte {offset}")
+                with open(part, "ab" if offset else "wb") as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        self.limiter.consume(len(chunk))
+                        f.write(chunk)
+
+    def _link(self, spec: ModelSpec):
+        """Point the ComfyUI model path at the cached file."""
+        link = spec.link_path(self.models_dir)
+        target = spec.cache_path(self.cache_dir)
+        link.parent.mkdir(parents=True, exist_ok=True)
+        if link.is_symlink() or link.exists():
+            if link.is_symlink() and os.readlink(link) == str(target):
+                return
+            link.unlink()
+        link.symlink_to(target)
+
+    def ensure(self, spec: ModelSpec) -> Path:
+        """Make one model available, downloading it only if it is missing or changed."""
+        entry = self.lock.get(spec.key)
+        if entry is None:
+            if self.require_lock:
+                raise ValueError(f"{spec.key} is not in the lockfile")
+            logger.warning(f"{spec.key} is not in the lockfile, downloading it unpinned")
+            entry = {}
+        path = spec.cache_path(self.cache_dir)
+
+        if not self._is_current(spec, entry):
+            if path.is_file():
+                try:
+                    # The file may be from an older download, keep it if it still matches
+                    self._verify(spec, entry, path)
+                    logger.info(f"Verified existing {spec.key}")
+                except ValueError as e:
+                    logger.warning(f"Re-downloading {spec.key}: {str(e)}")
+                    path.unlink()
+
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                if path.is_file():
+                    break
+                try:
+                    start = time.monotonic()
+                    logger.info(f"Downloading {spec.key} (attempt {attempt})")
+                    digest = self._fetch(spec, entry, path)
+                    self._verify(spec, entry, path, digest)
+                    size = path.stat().st_size
+                    elapsed = time.monotonic() - start
+                    logger.info(f"Downloaded {spec.key}: {size} bytes in {elapsed:.1f}s")
+                except ValueError:
+                    # A corrupt download is not resumable
+                    path.unlink(missing_ok=True)
+                    if attempt == MAX_ATTEMPTS:
+                        raise
+                except Exception as e:
+                    logger.warning(f"Download of {spec.key} failed: {str(e)}")
+                    if attempt == MAX_ATTEMPTS:
+                        raise
+
+            stat = path.stat()
+            with self._state_lock:
+                self._state[spec.key] = {"entry": entry, "size": stat.st_size, "mtime": stat.st_mtime}
+
+        self._link(spec)
+        return path
+
+    def sync(self, specs: List[ModelSpec]):
+        """Ensure every model concurrently. Raises RuntimeError listing the failures."""
+        failures = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = {pool.submit(self.ensure, spec): spec for spec in specs}
+            for future in as_completed(futures):
+                spec = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Failed to download {spec.key}: {str(e)}")
+                    failures[spec.key] = str(e)
+        self._save_state()
+
+        if failures:
+            raise RuntimeError(f"Failed to download {len(failures)} models: {', '.join(sorted(failures))}")
+        logger.info(f"All {len(specs)} models are present and verified")
+
+
+def read_model_list(path) -> List[ModelSpec]:
+    """Read the `MODELS_TO_DOWNLOAD` literal of an app file without importing it (and Modal)."""
+    tree = ast.parse(Path(path).read_text())
+    for node in tree.body:
+        if isinstance(node, ast.AnnAssign):
+            targets = [node.target]
+        elif isinstance(node, ast.Assign):
+            targets = node.targets
+        else:
+            continue
+        if any(isinstance(target, ast.Name) and target.id == "MODELS_TO_DOWNLOAD" for target in targets):
+            return [ModelSpec.from_tuple(details) for details in ast.literal_eval(node.value)]
+    raise ValueError(f"{path} does not define MODELS_TO_DOWNLOAD")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Pin the models of app files in the lockfile next to them.")
+    parser.add_argument("apps", nargs="+", help="App files that define MODELS_TO_DOWNLOAD")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    for app in args.apps:
+        specs = read_model_list(app)
+        path = Path(app).parent / LOCKFILE_NAME
+        lock_models(specs, path, token=os.environ.get("HF_TOKEN"))
+        print(f"Locked {len(specs)} models of {app} in {path}")
+
+
+if __name__ == "__main__":
+    main()
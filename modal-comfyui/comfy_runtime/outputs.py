@@ -0,0 +1,85 @@
+"""
+Per-run output isolation and lookup.
+
+Every run writes its images into its own subdirectory of the ComfyUI output
+directory (by rewriting the `filename_prefix` of its save nodes), and the files
+of a run are resolved from the prompt's `/history` record rather than by
+scanning the whole output directory.
+"""
+
+import copy
+import logging
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .engine import ExecutionResult
+
+logger = logging.getLogger(__name__)
+
+# Completed workflows write output images to this directory
+COMFY_OUTPUT_DIR = "/root/comfy/ComfyUI/output"
+
+# Nodes whose `filename_prefix` input decides where images are written
+SAVE_NODE_TYPES = ("SaveImage",)
+
+
+def find_save_nodes(workflow: Dict) -> Dict[str, Dict]:
+    """Return the save nodes of a workflow keyed by node id."""
+    return {
+        node_id: node for node_id, node in workflow.items()
+        if isinstance(node, dict) and node.get("class_type") in SAVE_NODE_TYPES
+    }
+
+
+def isolate_outputs(workflow: Dict, run_id: str) -> Dict:
+    """Return a copy of the workflow whose save nodes write into a per-run subdirectory.
+
+    Save nodes whose prefix is linked from another node are left alone; their
+    files are still found through the prompt's recorded outputs.
+    """
+    isolated = copy.copy(workflow)
+    for node_id, node in find_save_nodes(workflow).items():
+        inputs = dict(node.get("inputs", {}))
+        prefix = inputs.get("filename_prefix") or "ComfyUI"
+        if not isinstance(prefix, str):
+            logger.warning(f"Save node {node_id} has a linked filename_prefix, its outputs are not isolated")
+            continue
+        inputs["filename_prefix"] = f"{run_id}/{prefix}"
+        isolated[node_id] = {**node, "inputs": inputs}
+    return isolated
+
+
+def collect_output_files(
+    execution: ExecutionResult,
+    run_id: Optional[str] = None,
+    output_dir: str = COMFY_OUTPUT_DIR,
+) -> List[Path]:
+    """Resolve the files written by one prompt.
+
+    Uses the prompt's recorded outputs; if the history holds none (e.g. a custom
+    save node that does not report its images) falls back to the run's subdirectory.
+    """
+    files = []
+    for image in execution.images():
+        # "temp" images come from preview nodes and are not part of the result
+        if image.get("type") != "output":
+            continue
+        path = Path(output_dir) / image.get("subfolder", "") / image["filename"]
+        if path.is_file():
+            files.append(path)
+        else:
+            logger.warning(f"Recorded output {path} for prompt {execution.prompt_id} does not exist")
+
+    if not files and run_id:
+        run_dir = Path(output_dir) / run_id
+        if run_dir.is_dir():
+            logger.info(f"No recorded outputs for prompt {execution.prompt_id}, using {run_dir}")
+            files = sorted(f for f in run_dir.rglob("*") if f.is_file())
+
+    return files
+
+
+def cleanup_outputs(run_id: str, output_dir: str = COMFY_OUTPUT_DIR):
+    """Delete the per-run output subdirectory once its files have been consumed."""
+    shutil.rmtree(Path(output_dir) / run_id, ignore_errors=True)
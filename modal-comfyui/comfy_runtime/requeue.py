@@ -0,0 +1,72 @@
+"""
+Requeueing of jobs lost to a drained or crashed container.
+
+Every spawned job is recorded under the call id the client was given (the
+job id) together with the arguments needed to run it again. When the call
+running a job is lost, either because its worker found the ComfyUI server
+unhealthy or because the container died, the job is spawned again on
+another container and the new call id is appended to the record, up to
+`max_requeues` times. Status lookups follow the record to the latest call,
+so clients keep polling the id they were given.
+"""
+
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_REQUEUES = 2
+
+# How long an observer that lost the race to requeue a job waits for the winner's call id
+PUBLISH_WAIT = 5.0
+
+
+class JobTracker:
+    """Maps job ids to their run arguments and calls through a `modal.Dict`-like store."""
+
+    def __init__(self, store, max_requeues: int = DEFAULT_MAX_REQUEUES, publish_wait: float = PUBLISH_WAIT):
+        self.store = store
+        self.max_requeues = max_requeues
+        self.publish_wait = publish_wait
+
+    def record(self, job_id: str, spec: Dict):
+        """Remember how to run a job again. `spec` holds the keyword arguments of the spawn."""
+        self.store.put(job_id, {"spec": spec, "calls": [job_id]}, skip_if_exists=True)
+
+    @staticmethod
+    def current_call(entry: Optional[Dict], job_id: str) -> str:
+        """The call currently running a job, given its record."""
+        return entry["calls"][-1] if entry else job_id
+
+    def requeue(self, job_id: str, lost_call_id: str, spawn: Callable[[Dict], str], reason: str) -> Optional[str]:
+        """Run a job again after `lost_call_id` was lost. Returns the new call id.
+
+        Returns None when the job is not tracked or has no requeues left. If
+        another container already requeued the same call, its call id is
+        returned instead of spawning a second one.
+        """
+        entry = self.store.get(job_id)
+        if entry is None:
+            return None
+        if entry["calls"][-1] != lost_call_id:
+            return entry["calls"][-1]
+        if len(entry["calls"]) > self.max_requeues:
+            logger.error(f"Job {job_id} was lost {len(entry['calls'])} times, giving up: {reason}")
+            return None
+
+        # Only one observer of a lost call may requeue it
+        if not self.store.put(f"requeue:{lost_call_id}", time.time(), skip_if_exists=True):
+            deadline = time.monotonic() + self.publish_wait
+            while time.monotonic() < deadline:
+                time.sleep(0.1)
+                entry = self.store.get(job_id)
+                if entry["calls"][-1] != lost_call_id:
+                    return entry["calls"][-1]
+            return None
+
+        call_id = spawn(entry["spec"])
+        entry["calls"].append(call_id)
+        self.store[job_id] = entry
+        logger.warning(f"Requeued job {job_id} as call {call_id} (attempt {len(entry['calls'])}): {reason}")
+        return call_id
@@ -0,0 +1,165 @@
+"""
+Out-of-band result delivery.
+
+Instead of embedding base64 images in JSON, finished outputs can be copied
+into a result store (a directory, normally a mounted Modal Volume) and
+returned as compact references. The bytes are then served by a streaming
+download endpoint that understands HTTP `Range` requests.
+"""
+
+import logging
+import mimetypes
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Where the results Volume is mounted in the containers
+RESULTS_DIR = "/results"
+
+# "inline" embeds base64 data in the response, "reference" returns result store keys
+RESULT_MODES = ("inline", "reference")
+
+# Chunk size used when streaming result files
+CHUNK_SIZE = 1024 * 1024
+
+# Keys are "<run_id>/<filename>", nothing else may be read from the store
+_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_-]+/[A-Za-z0-9_.-]+$")
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class ResultStore:
+    """Stores result files under a root directory.
+
+    When backed by a Modal Volume, writers commit after storing a run and
+    readers reload the volume when a key is not visible yet. Without a volume
+    it is a plain local directory, which is what tests and local runs use.
+    """
+
+    def __init__(self, root: str = RESULTS_DIR, volume=None):
+        self.root = Path(root)
+        self.volume = volume
+
+    def put(self, run_id: str, src: Path) -> Dict:
+        """Copy one output file into the store and return its reference."""
+        key = f"{run_id}/{src.name}"
+        dest = self.root / key
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        # copyfile streams the data, the image is never held in memory as a whole
+        shutil.copyfile(src, dest)
+        return {
+            "filename": src.name,
+            "type": "ref",
+            "key": key,
+            "size": dest.stat().st_size,
+            "content_type": mimetypes.guess_type(src.name)[0] or "application/octet-stream",
+        }
+
+    def commit(self):
+        """Make stored files visible to other containers."""
+        if self.volume is not None:
+            self.volume.commit()
+
+    def resolve(self, key: str) -> Optional[Path]:
+        """Return the path of a stored key, or None if it is invalid or missing."""
+        if not _KEY_PATTERN.match(key) or ".." in key:
+            return None
+        path = self.root / key
+        if not path.is_file() and self.volume is not None:
+            try:
+                self.volume.reload()
+            except Exception as e:
+                # Reloading fails while files of the volume are open in this container
+                logger.warning(f"Failed to reload results volume: {str(e)}")
+        return path if path.is_file() else None
+
+
+def compact_result(call_id: str, result: Dict) -> Dict:
+    """Summarize a workflow result without inline image data (references are kept)."""
+    payload = {"id": call_id, "status": result.get("status")}
+    if "error" in result:
+        payload["error"] = result["error"]
+    if result.get("cached"):
+        payload["cached"] = True
+    images = result.get("output", {}).get("images")
+    if images is not None:
+        payload["output"] = {
+            "images": [{k: v for k, v in image.items() if k != "data"} for image in images]
+        }
+    return payload
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range `Range` header into an inclusive (start, end) pair.
+
+    Returns None when the whole file should be served and raises ValueError
+    when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        # Multi-range or malformed headers are ignored, as allowed by RFC 9110
+        return None
+
+    start, end = match.groups()
+    if start == "":
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = size - 1 if end == "" else min(int(end), size - 1)
+    if start >= size or start > end:
+        raise ValueError(f"Range {header} not satisfiable for size {size}")
+    return start, end
+
+
+def iter_file(path: Path, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """Yield the bytes of a file between start and end (inclusive) in chunks."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = (end if end is not None else path.stat().st_size - 1) - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def download_response(store: ResultStore, key: str, range_header: Optional[str] = None):
+    """Build a streaming FastAPI response for a stored result, honouring `Range`."""
+    from fastapi import HTTPException
+    from fastapi.responses import StreamingResponse
+
+    path = store.resolve(key)
+    if path is None:
+        logger.error(f"Result not found for key: {key}")
+        raise HTTPException(status_code=404, detail="Result not found")
+
+    size = path.stat().st_size
+    media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f'attachment; filename="{path.name}"',
+    }
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError as e:
+        logger.error(f"Unsatisfiable range for key {key}: {str(e)}")
+        raise HTTPException(status_code=416, detail=str(e), headers={"Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_file(path), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_file(path, start, end), status_code=206, media_type=media_type, headers=headers)
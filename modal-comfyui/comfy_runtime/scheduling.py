@@ -0,0 +1,84 @@
+"""
+Grouping of a container's pending jobs by the model they switch to.
+
+ComfyUI runs one prompt at a time, and switching a LoRA means re-patching
+the base model's weights. `GroupingScheduler` hands the server one job at a
+time and, when it picks the next one, prefers a waiting job with the same
+key (e.g. the LoRA name) as the job that just ran over older jobs that
+would force a switch. A job is passed over at most `max_bypass` times, so
+no key starves.
+"""
+
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Times a waiting job may be passed over before it runs next regardless of its key
+DEFAULT_MAX_BYPASS = 3
+
+
+class _Waiter:
+    def __init__(self, seq: int, key: Optional[str]):
+        self.seq = seq
+        self.key = key
+        self.bypassed = 0
+
+
+class GroupingScheduler:
+    """Run jobs one at a time, grouping consecutive jobs with the same key."""
+
+    def __init__(self, max_bypass: int = DEFAULT_MAX_BYPASS):
+        self.max_bypass = max_bypass
+        self._cond = threading.Condition()
+        self._waiting: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._running = False
+        self._next: Optional[_Waiter] = None
+        self.current_key: Optional[str] = None
+        self.stats = {"jobs": 0, "switches": 0, "bypassed": 0}
+
+    def _pick(self) -> Optional[_Waiter]:
+        if not self._waiting:
+            return None
+        oldest = self._waiting[0]
+        if oldest.bypassed >= self.max_bypass:
+            return oldest
+        for waiter in self._waiting:
+            if waiter.key == self.current_key:
+                return waiter
+        return oldest
+
+    @contextmanager
+    def slot(self, key: Optional[str]):
+        """Wait until it is this job's turn to use the server, and hold it while the job runs."""
+        with self._cond:
+            waiter = _Waiter(next(self._seq), key)
+            self._waiting.append(waiter)
+            if not self._running and self._next is None:
+                self._next = self._pick()
+            while self._next is not waiter:
+                self._cond.wait()
+            self._waiting.remove(waiter)
+            for older in self._waiting:
+                if older.seq < waiter.seq:
+                    older.bypassed += 1
+                    self.stats["bypassed"] += 1
+            self._next = None
+            self._running = True
+            self.stats["jobs"] += 1
+            if key != self.current_key:
+                self.stats["switches"] += 1
+                self.current_key = key
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running = False
+                self._next = self._pick()
+                self._cond.notify_all()
+
+    def snapshot(self) -> Dict:
+        """Counters and queue state, for monitoring."""
+        with self._cond:
+            return {**self.stats, "waiting": len(self._waiting), "current_key": self.current_key}
@@ -0,0 +1,58 @@
+"""
+Shared key-value state across containers.
+
+In production the stores are `modal.Dict` objects, which every web and
+worker container sees. `LocalDict` implements the subset of the
+`modal.Dict` interface used here, for local runs and tests.
+"""
+
+import threading
+from typing import Any, Dict, Optional
+
+
+class LocalDict:
+    """Thread-safe in-memory stand-in for `modal.Dict`."""
+
+    def __init__(self, data: Optional[Dict] = None):
+        self._data = dict(data or {})
+        self._lock = threading.Lock()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            return self._data.get(key, default)
+
+    def put(self, key: Any, value: Any, skip_if_exists: bool = False) -> bool:
+        """Set a key; with `skip_if_exists` only if it is absent. Returns whether it was written."""
+        with self._lock:
+            if skip_if_exists and key in self._data:
+                return False
+            self._data[key] = value
+            return True
+
+    def pop(self, key: Any) -> Any:
+        with self._lock:
+            return self._data.pop(key)
+
+    def __getitem__(self, key: Any) -> Any:
+        with self._lock:
+            return self._data[key]
+
+    def __setitem__(self, key: Any, value: Any):
+        with self._lock:
+            self._data[key] = value
+
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def __contains__(self, key: Any) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
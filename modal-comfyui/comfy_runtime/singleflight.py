@@ -0,0 +1,154 @@
+"""
+Single-flight deduplication of identical in-flight submissions.
+
+The first submission of a workflow claims its canonical hash in a shared
+store and publishes the call id it spawned. Identical submissions that
+arrive while that call is running get the same call id back instead of
+spawning a second GPU job. The worker releases the key when it finishes,
+and claims expire after `ttl` seconds in case a worker dies without
+releasing.
+
+Every claim carries a random token. `modal.Dict` has no compare-and-swap,
+so claims are taken over by popping the stale entry (atomic) and writing the
+new one with `skip_if_exists`, and released by popping the entry and putting
+it back if it turned out to be someone else's. Of several submitters taking
+over the same claim exactly one wins, and a leader checks its token before
+publishing or releasing, so it leaves a claim that was taken over alone.
+
+The same claim/publish protocol backs idempotency keys: there the entries
+are never released, only expire, and carry a fingerprint of the request so
+that a key reused for a different request is rejected.
+
+`submit` is a coroutine, since it is awaited by the web endpoints: store
+calls go through `.aio` when the store provides it (`modal.Dict` does) and
+run in a worker thread otherwise, and followers wait with `asyncio.sleep`.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Claims older than this are considered abandoned (matches the worker timeout)
+DEFAULT_TTL = 600
+
+# How long a follower waits for the leader to publish its call id
+PUBLISH_WAIT = 5.0
+
+
+class KeyConflictError(ValueError):
+    """Raised when a key is already claimed by a request with another fingerprint."""
+
+
+async def _call(method: Callable, *args, **kwargs) -> Any:
+    """Call a store method without blocking the event loop."""
+    aio = getattr(method, "aio", None)
+    if aio is not None:
+        return await aio(*args, **kwargs)
+    return await asyncio.to_thread(method, *args, **kwargs)
+
+
+class SingleFlight:
+    """Coordinates identical submissions through a `modal.Dict`-like store."""
+
+    def __init__(self, store, ttl: float = DEFAULT_TTL, publish_wait: float = PUBLISH_WAIT):
+        self.store = store
+        self.ttl = ttl
+        self.publish_wait = publish_wait
+
+    def _expired(self, entry: Optional[dict]) -> bool:
+        return entry is None or time.time() - entry.get("claimed_at", 0) > self.ttl
+
+    @staticmethod
+    def _entry(token: str, fingerprint: Optional[str], call_id: Optional[str] = None) -> dict:
+        return {"call_id": call_id, "claimed_at": time.time(), "fingerprint": fingerprint, "token": token}
+
+    @staticmethod
+    def _owns(entry: Optional[dict], call_id: Optional[str], token: Optional[str]) -> bool:
+        return (
+            entry is not None
+            and (call_id is None or entry.get("call_id") == call_id)
+            and (token is None or entry.get("token") == token)
+        )
+
+    async def _claim(self, key: str, token: str, fingerprint: Optional[str] = None) -> Optional[dict]:
+        """Try to claim a key. Returns None on success, otherwise the current entry."""
+        if await _call(self.store.put, key, self._entry(token, fingerprint), skip_if_exists=True):
+            return None
+        existing = await _call(self.store.get, key)
+        if self._expired(existing):
+            # The previous leader never released its claim, take it over
+            return await self._take_over(key, existing, token, fingerprint)
+        return existing
+
+    async def _take_over(self, key: str, stale: Optional[dict], token: str, fingerprint: Optional[str]) -> Optional[dict]:
+        """Replace the `stale` claim with ours. Returns None on success, otherwise the current entry."""
+        try:
+            popped = await _call(self.store.pop, key)
+        except KeyError:
+            popped = None
+        if popped is not None and popped != stale:
+            # The claim changed since it was read (published, or taken over first), put it back
+            await _call(self.store.put, key, popped, skip_if_exists=True)
+        if await _call(self.store.put, key, self._entry(token, fingerprint), skip_if_exists=True):
+            return None
+        return await self._claim(key, token, fingerprint)
+
+    async def submit(
+        self, key: str, spawn: Callable[[], Awaitable[str]], fingerprint: Optional[str] = None
+    ) -> Tuple[str, bool]:
+        """Return the call id for a submission and whether it attached to an existing call.
+
+        `spawn` is a coroutine function, only awaited when no identical call is
+        in flight. If the key is held with a different `fingerprint`,
+        KeyConflictError is raised.
+        """
+        token = uuid.uuid4().hex
+        existing = await self._claim(key, token, fingerprint)
+        if existing is not None and existing.get("fingerprint") != fingerprint:
+            raise KeyConflictError(f"Key {key} is already used by a different request")
+        deadline = time.monotonic() + self.publish_wait
+        while existing is not None and existing.get("call_id") is None:
+            # The leader has claimed the key but not published its call id yet
+            if time.monotonic() > deadline:
+                logger.warning(f"Leader for {key} never published a call id, taking over")
+                existing = await self._take_over(key, existing, token, fingerprint)
+                # If another submitter took over first, give it the full wait too
+                deadline = time.monotonic() + self.publish_wait
+                continue
+            await asyncio.sleep(0.1)
+            existing = await _call(self.store.get, key)
+            if existing is None:
+                existing = await self._claim(key, token, fingerprint)
+
+        if existing is not None:
+            logger.info(f"Attaching submission to in-flight call {existing['call_id']}")
+            return existing["call_id"], True
+
+        try:
+            call_id = await spawn()
+        except Exception:
+            await asyncio.to_thread(self.release, key, token=token)
+            raise
+        current = await _call(self.store.get, key)
+        if current is not None and current.get("token") != token:
+            # Spawning outlasted the publish wait and another submitter took the claim over
+            logger.warning(f"Claim on {key} was taken over, not publishing call {call_id}")
+            return call_id, False
+        await _call(self.store.put, key, self._entry(token, fingerprint, call_id))
+        return call_id, False
+
+    def release(self, key: str, call_id: Optional[str] = None, token: Optional[str] = None):
+        """Forget a key once its call has finished (only if it still belongs to call_id and token)."""
+        if not self._owns(self.store.get(key), call_id, token):
+            return
+        try:
+            entry = self.store.pop(key)
+        except KeyError:
+            return
+        if not self._owns(entry, call_id, token):
+            # The key was claimed again between the get and the pop
+            self.store.put(key, entry, skip_if_exists=True)
@@ -0,0 +1,178 @@
+"""
+Local staging of model files.
+
+Models live on the cache Volume and are symlinked into the ComfyUI models
+directory, so the first load of a large model streams it from network
+storage. Staging copies the models a deployment needs onto the container's
+local disk (or only reads them ahead, to warm the Volume cache) in parallel
+and in priority order, and repoints the symlinks at the local copies.
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .models import COMFY_MODELS_DIR
+
+logger = logging.getLogger(__name__)
+
+# Local disk directory the models are copied to
+STAGING_DIR = "/root/staged-models"
+
+# "copy" stages files on local disk, "readahead" only reads them, "off" disables staging
+STAGING_MODES = ("copy", "readahead", "off")
+
+DEFAULT_CONCURRENCY = 4
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+@dataclass
+class StagedModel:
+    """A model linked from the ComfyUI models directory and where it was staged."""
+
+    link: Path
+    source: Path
+    local: Optional[Path]
+    size: int
+    seconds: float
+
+
+class _Progress:
+    def __init__(self, total_files: int, total_bytes: int):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def done(self, size: int) -> str:
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            return (
+                f"{self.files}/{self.total_files} files, "
+                f"{self.bytes / 1024 ** 3:.1f}/{self.total_bytes / 1024 ** 3:.1f} GB"
+            )
+
+
+def _read_ahead(path: Path):
+    with open(path, "rb", buffering=0) as f:
+        while f.read(CHUNK_SIZE):
+            pass
+
+
+def _copy(source: Path, dest: Path):
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + ".tmp")
+    shutil.copyfile(source, tmp)
+    os.replace(tmp, dest)
+
+
+def _relink(link: Path, target: Path):
+    tmp = link.with_name(link.name + ".relink")
+    tmp.unlink(missing_ok=True)
+    tmp.symlink_to(target)
+    os.replace(tmp, link)
+
+
+def stage_models(
+    models: List[Tuple[str, str]],
+    mode: str = "copy",
+    models_dir: str = COMFY_MODELS_DIR,
+    staging_dir: str = STAGING_DIR,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> List[StagedModel]:
+    """Stage `(subfolder, filename)` models, given highest priority first.
+
+    Files that are missing or do not fit on the local disk are left on the
+    Volume. Returns what was staged, with per-file timings.
+    """
+    if mode == "off" or not models:
+        return []
+
+    entries = []
+    for subfolder, filename in models:
+        link = Path(models_dir) / subfolder / filename
+        if not link.exists():
+            logger.warning(f"Not staging {subfolder}/{filename}: it is not in the models directory")
+            continue
+        source = link.resolve()
+        entries.append((link, source, Path(subfolder) / filename, source.stat().st_size))
+
+    total_bytes = sum(entry[-1] for entry in entries)
+    progress = _Progress(len(entries), total_bytes)
+    logger.info(f"Staging {len(entries)} models ({total_bytes / 1024 ** 3:.1f} GB) in {mode} mode")
+
+    # Reserve local disk space in priority order, so the most important models get staged
+    if mode == "copy":
+        Path(staging_dir).mkdir(parents=True, exist_ok=True)
+        free = shutil.disk_usage(staging_dir).free
+    plan = []
+    for link, source, relative, size in entries:
+        local = None
+        if mode == "copy":
+            if size < free:
+                local = Path(staging_dir) / relative
+                free -= size
+            else:
+                logger.warning(f"Not enough local disk to stage {link.name}, reading it ahead instead")
+        plan.append((link, source, local, size))
+
+    def stage(link: Path, source: Path, local: Optional[Path], size: int) -> StagedModel:
+        start = time.monotonic()
+        if local is not None:
+            _copy(source, local)
+            _relink(link, local)
+        else:
+            _read_ahead(source)
+        seconds = time.monotonic() - start
+        rate = size / 1024 ** 2 / seconds if seconds else 0
+        logger.info(f"Staged {link.name} in {seconds:.1f}s ({rate:.0f} MB/s), {progress.done(size)}")
+        return StagedModel(link, source, local, size, seconds)
+
+    start = time.monotonic()
+    staged = []
+    # Tasks start in submission order, which is priority order
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(stage, *item) for item in plan]
+        for future in futures:
+            try:
+                staged.append(future.result())
+            except Exception as e:
+                # The symlink still points at the Volume, so the model stays usable
+                logger.error(f"Failed to stage a model: {str(e)}")
+    logger.info(f"Staged {len(staged)} models in {time.monotonic() - start:.1f}s")
+    return staged
+
+
+def verify_staged(staged: List[StagedModel]):
+    """Point links back at the Volume for local copies that no longer exist."""
+    for model in staged:
+        if model.local is not None and not model.local.is_file():
+            logger.warning(f"Staged copy of {model.link.name} is gone, using the Volume copy")
+            _relink(model.link, model.source)
+
+
+def stage_from_env(models: List[Tuple[str, str]]) -> List[StagedModel]:
+    """Stage models as configured by MODEL_STAGING and MODEL_STAGING_CONCURRENCY.
+
+    Never raises: an unknown mode disables staging, and models that could not
+    be staged are still loaded from the Volume.
+    """
+    mode = os.environ.get("MODEL_STAGING", "copy")
+    if mode not in STAGING_MODES:
+        logger.warning(f"Unknown MODEL_STAGING mode {mode}, staging disabled")
+        return []
+    try:
+        concurrency = int(os.environ.get("MODEL_STAGING_CONCURRENCY", DEFAULT_CONCURRENCY))
+        return stage_models(models, mode=mode, concurrency=concurrency)
+    except Exception as e:
+        logger.error(f"Model staging failed: {str(e)}")
+        return []
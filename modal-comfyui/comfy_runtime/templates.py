@@ -0,0 +1,239 @@
+"""
+Compiled workflow templates.
+
+A template is an API-format workflow parsed once, plus named parameters
+bound to `"<node_id>.<input>"` paths. Binding values produces a per-request
+graph through a structural copy: only the nodes whose inputs change are
+copied, all other nodes are shared with the template, which must therefore
+never be mutated (copy the graph before editing it in place).
+
+Parameter types come from the template's own values: numeric inputs accept
+any number (exported workflows write `2` for a float input set to 2.0, and
+ComfyUI validates integer inputs itself) and string inputs only strings.
+
+Templates are versioned. Built-in templates are registered in memory, while
+published ones are kept in a `modal.Dict`-like store shared by all
+containers, under `<name>@<version>`. A version never changes once
+published, so every container compiles it, and canonicalizes its graph for
+the result cache key, once. Versions are published without gaps, so the
+latest one is found from the `latest:<name>` hint, which may lag behind
+concurrent publishes, by probing the versions after it.
+"""
+
+import copy
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from .canonical import canonical_hash, canonicalize_value, canonicalize_workflow, workflow_hash
+from .loaders import load_workflow_file
+
+
+class TemplateConflictError(ValueError):
+    """Raised when a template version is already published with other contents."""
+
+
+@dataclass
+class Parameter:
+    """A named template input and the node inputs it sets."""
+
+    name: str
+    paths: List[str]
+    default: Any
+
+    def coerce(self, value: Any) -> Any:
+        """Check a value against the type of the default. Raises ValueError."""
+        expected = type(self.default)
+        if isinstance(value, bool) and expected is not bool:
+            raise ValueError(f"Parameter {self.name} must be {expected.__name__}, got a boolean")
+        if expected in (int, float) and isinstance(value, (int, float)):
+            if isinstance(value, float) and value.is_integer() and expected is int:
+                return int(value)
+            return value
+        if not isinstance(value, expected):
+            raise ValueError(f"Parameter {self.name} must be {expected.__name__}, got {type(value).__name__}")
+        return value
+
+
+@dataclass
+class WorkflowTemplate:
+    """A workflow parsed once, with named parameters bound to node inputs."""
+
+    name: str
+    workflow: Dict
+    parameters: Dict[str, Parameter] = field(default_factory=dict)
+    version: int = 1
+    # Canonical form of the workflow (see `canonical.py`), computed once per version
+    canonical: Dict = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.canonical = canonicalize_workflow(self.workflow)
+
+    @classmethod
+    def compile(
+        cls, name: str, workflow: Dict, bindings: Dict[str, Union[str, List[str]]], version: int = 1
+    ) -> "WorkflowTemplate":
+        """Build a template from a workflow and `{parameter: path or paths}`. Raises ValueError for bad paths."""
+        parameters = {}
+        for param, paths in bindings.items():
+            paths = [paths] if isinstance(paths, str) else list(paths)
+            defaults = [_resolve(workflow, path, name) for path in paths]
+            parameters[param] = Parameter(param, paths, defaults[0])
+        # Deep copy once, so the template never shares state with the caller's workflow
+        return cls(name, copy.deepcopy(workflow), parameters, version)
+
+    @classmethod
+    def from_file(cls, name: str, path: Union[str, Path], bindings: Dict[str, Union[str, List[str]]]) -> "WorkflowTemplate":
+        return cls.compile(name, load_workflow_file(path), bindings)
+
+    def defaults(self) -> Dict[str, Any]:
+        return {name: param.default for name, param in self.parameters.items()}
+
+    def _coerce(self, values: Dict[str, Any]) -> List[Tuple[str, Any]]:
+        unknown = set(values) - set(self.parameters)
+        if unknown:
+            raise ValueError(f"Unknown parameters for template {self.name}: {', '.join(sorted(unknown))}")
+        updates = []
+        for name, value in values.items():
+            param = self.parameters[name]
+            value = param.coerce(value)
+            updates.extend((path, value) for path in param.paths)
+        return updates
+
+    def bind(self, values: Dict[str, Any]) -> Dict:
+        """Return the graph with parameter values applied. Raises ValueError for unknown or mistyped values."""
+        return _apply(self.workflow, self._coerce(values))
+
+    def bind_keyed(self, values: Dict[str, Any]) -> Tuple[Dict, str]:
+        """Return the bound graph and its `workflow_hash`, without canonicalizing the whole graph again."""
+        updates = self._coerce(values)
+        canonical = _apply(self.canonical, [(path, canonicalize_value(value)) for path, value in updates])
+        return _apply(self.workflow, updates), canonical_hash(canonical)
+
+
+def _apply(workflow: Dict, updates: List[Tuple[str, Any]]) -> Dict:
+    # Structural copy: only the nodes (and their inputs) that change are copied
+    graph = dict(workflow)
+    copied = set()
+    for path, value in updates:
+        node_id, input_name = path.split(".", 1)
+        if node_id not in copied:
+            node = graph[node_id]
+            graph[node_id] = {**node, "inputs": dict(node["inputs"])}
+            copied.add(node_id)
+        graph[node_id]["inputs"][input_name] = value
+    return graph
+
+
+def _resolve(workflow: Dict, path: str, template: str) -> Any:
+    node_id, _, input_name = path.partition(".")
+    node = workflow.get(node_id)
+    if not isinstance(node, dict) or input_name not in node.get("inputs", {}):
+        raise ValueError(f"Template {template} binds {path}, which is not a node input")
+    value = node["inputs"][input_name]
+    if isinstance(value, list):
+        raise ValueError(f"Template {template} binds {path}, which is a link")
+    return value
+
+
+def template_digest(workflow: Dict, bindings: Dict) -> str:
+    """Content hash of a template, to tell a re-publish of a version from a conflicting one."""
+    return workflow_hash({"workflow": workflow, "bindings": bindings})
+
+
+class TemplateRegistry:
+    """Templates by name and version.
+
+    Built-in templates are added with `register`. With a store, templates
+    added with `publish` are shared with every container, which compiles
+    each version on first use and keeps it.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self._templates: Dict[Tuple[str, int], WorkflowTemplate] = {}
+
+    def register(self, template: WorkflowTemplate) -> WorkflowTemplate:
+        self._templates[(template.name, template.version)] = template
+        return template
+
+    def latest_version(self, name: str) -> int:
+        """Highest known version of a template, 0 if there is none."""
+        version = max((version for n, version in self._templates if n == name), default=0)
+        if self.store is None:
+            return version
+        version = max(version, self.store.get(f"latest:{name}", 0))
+        while f"{name}@{version + 1}" in self.store:
+            version += 1
+        return version
+
+    def get(self, name: str, version: Optional[int] = None) -> WorkflowTemplate:
+        """Return a template version, the latest one by default. Raises KeyError for unknown templates."""
+        if version is None:
+            version = self.latest_version(name)
+        template = self._templates.get((name, version))
+        if template is not None:
+            return template
+        entry = self.store.get(f"{name}@{version}") if self.store is not None else None
+        if entry is None:
+            raise KeyError(f"{name}@{version}")
+        return self.register(WorkflowTemplate.compile(name, entry["workflow"], entry["bindings"], version))
+
+    def publish(
+        self,
+        name: str,
+        workflow: Dict,
+        bindings: Dict[str, Union[str, List[str]]],
+        version: Optional[int] = None,
+        validate: Optional[Callable[[WorkflowTemplate], None]] = None,
+    ) -> WorkflowTemplate:
+        """Validate a template and store it as a new version (the next one by default).
+
+        `validate` may raise ValueError to reject the template. Publishing the
+        same contents under an existing version is a no-op; other contents
+        raise TemplateConflictError, since published versions never change.
+        An explicit `version` may not skip versions.
+        """
+        template = WorkflowTemplate.compile(name, workflow, bindings, version or 1)
+        if validate is not None:
+            validate(template)
+        digest = template_digest(workflow, bindings)
+
+        while True:
+            latest = self.latest_version(name)
+            if version is not None and version > latest + 1:
+                raise ValueError(f"Template {name} is at version {latest}, the next version is {latest + 1}")
+            template.version = version or latest + 1
+            entry = {
+                "workflow": workflow,
+                "bindings": bindings,
+                "digest": digest,
+                "published_at": time.time(),
+            }
+            if (name, template.version) not in self._templates and self.store.put(
+                f"{name}@{template.version}", entry, skip_if_exists=True
+            ):
+                break
+            existing = self.store.get(f"{name}@{template.version}")
+            if existing is not None and existing["digest"] == digest:
+                return self.get(name, template.version)
+            if version is not None:
+                raise TemplateConflictError(f"Template {name} version {version} is already published with other contents")
+            # Another container took the next version first, try the one after it
+
+        # Only a hint: a concurrent publish may overwrite it with a lower version
+        if template.version > self.store.get(f"latest:{name}", 0):
+            self.store[f"latest:{name}"] = template.version
+        return self.register(template)
+
+    def catalog(self) -> Dict[str, int]:
+        """Latest version of every template."""
+        names = {name for name, _ in self._templates}
+        if self.store is not None:
+            # Only the keys are listed, not the stored workflows
+            names |= {key.rsplit("@", 1)[0] for key in self.store.keys() if "@" in key and not key.startswith("latest:")}
+        return {name: self.latest_version(name) for name in sorted(names)}
+
+    def __contains__(self, name: str) -> bool:
+        return self.latest_version(name) > 0
@@ -0,0 +1,142 @@
+"""
+Per-container cold-start timeline.
+
+Records the startup of a container as a sequence of events: process start,
+model staging, ComfyUI launch, weight preloading, snapshot capture and
+restore, `/cuda/set_device`, and the model loads and completion of the
+first prompt. Every event is logged as one JSON line (and appended to
+`TIMELINE_FILE` when set), and a `cold_start` line summarizes the phase
+durations once the first prompt is done.
+
+Wall-clock timestamps are used throughout because events recorded before a
+memory snapshot are restored with the container's memory. The image pull
+happens before the container exists and is not visible from inside it.
+"""
+
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .engine import ExecutionResult
+from .loaders import MODEL_LOADER_INPUTS
+
+logger = logging.getLogger(__name__)
+
+
+def container_uptime() -> Optional[float]:
+    """Seconds since the container's init process started, read from /proc."""
+    try:
+        ticks = os.sysconf("SC_CLK_TCK")
+        # Field 22 of /proc/<pid>/stat is the start time in clock ticks after boot
+        init_start = int(Path("/proc/1/stat").read_text().rsplit(")", 1)[1].split()[19]) / ticks
+        uptime = float(Path("/proc/uptime").read_text().split()[0])
+        return round(uptime - init_start, 3)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Timeline:
+    """Startup events and phase durations of one container."""
+
+    def __init__(self, component: str, path: Optional[str] = None):
+        self.component = component
+        self.container_id = os.environ.get("MODAL_TASK_ID", "local")
+        self.path = path or os.environ.get("TIMELINE_FILE")
+        self.started = time.time()
+        self.restored_at: Optional[float] = None
+        self.durations: Dict[str, float] = {}
+        self.events: List[Dict] = []
+        self.first_request_at: Optional[float] = None
+        self.first_prompt_done = False
+        self.mark("process_start", container_uptime=container_uptime())
+
+    def mark(self, event: str, **fields) -> Dict:
+        """Record a point event."""
+        now = time.time()
+        record = {
+            "event": event,
+            "component": self.component,
+            "container_id": self.container_id,
+            "ts": round(now, 3),
+            "since_start": round(now - self.started, 3),
+            "restored": self.restored_at is not None,
+            **fields,
+        }
+        if self.restored_at is not None:
+            record["since_restore"] = round(now - self.restored_at, 3)
+        self.events.append(record)
+        self._emit(record)
+        return record
+
+    @contextmanager
+    def span(self, phase: str, **fields):
+        """Record the duration of a phase as an event when it ends."""
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.durations[phase] = time.monotonic() - start
+            self.mark(phase, seconds=round(self.durations[phase], 3), error=str(e), **fields)
+            raise
+        self.durations[phase] = time.monotonic() - start
+        self.mark(phase, seconds=round(self.durations[phase], 3), **fields)
+
+    def restored(self):
+        """Record that the container was restored from a memory snapshot."""
+        self.restored_at = time.time()
+        # The task id captured in the snapshot belongs to the container that took it
+        self.container_id = os.environ.get("MODAL_TASK_ID", self.container_id)
+        self.mark("snapshot_restored", container_uptime=container_uptime())
+
+    def first_request(self):
+        """Record when the container received its first job."""
+        if self.first_request_at is None:
+            self.first_request_at = time.time()
+            self.mark("first_request")
+
+    def record_prompt(self, execution: ExecutionResult, workflow: Dict):
+        """Record model load and completion times of the first prompt, then the summary."""
+        if self.first_prompt_done:
+            return
+        self.first_prompt_done = True
+        loader_nodes = [
+            node_id for node_id, node in workflow.items()
+            if isinstance(node, dict) and node.get("class_type") in MODEL_LOADER_INPUTS
+        ]
+        model_load = sum(execution.node_timings.get(node_id, 0.0) for node_id in loader_nodes)
+        self.durations["model_load"] = model_load
+        self.durations["first_prompt"] = execution.elapsed
+        self.mark(
+            "first_prompt",
+            seconds=round(execution.elapsed, 3),
+            model_load_seconds=round(model_load, 3),
+            loader_nodes={node_id: round(execution.node_timings.get(node_id, 0.0), 3) for node_id in loader_nodes},
+        )
+        self.mark("cold_start", metrics=self.metrics())
+
+    def metrics(self) -> Dict:
+        """Phase durations and the time from container start (or restore) to now."""
+        origin = self.restored_at or self.started
+        metrics = {
+            "phases": {phase: round(seconds, 3) for phase, seconds in self.durations.items()},
+            "restored_from_snapshot": self.restored_at is not None,
+            "ready_seconds": round(time.time() - origin, 3),
+        }
+        if self.first_request_at is not None:
+            # Time the container sat idle before its first job is not part of the cold start
+            metrics["idle_before_first_request_seconds"] = round(self.first_request_at - origin, 3)
+        return metrics
+
+    def _emit(self, record: Dict):
+        line = json.dumps(record)
+        logger.info(line)
+        if self.path:
+            try:
+                with open(self.path, "a") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logger.warning(f"Failed to write timeline to {self.path}: {str(e)}")
@@ -0,0 +1,162 @@
+"""
+Memory-leak watchdog and in-place recycling of the ComfyUI server.
+
+Long-lived servers slowly grow their resident and GPU memory until they stop
+responding. After each job, `LeakWatchdog` samples the server's RSS and VRAM
+use. Loading other models legitimately changes both, so samples are only
+compared with a baseline taken since the set of models loaded since the
+server (re)started last changed, and only growth past the thresholds over
+several jobs in a row asks for a recycle: `ServerGate` lets the running
+prompts finish, holds new ones, restarts the server and then lets the held
+jobs through, so nothing queued on the container fails.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Default growth over the baseline that triggers a recycle, 0 disables a check
+DEFAULT_MAX_RSS_GROWTH = 8 * 1024 ** 3
+DEFAULT_MAX_VRAM_GROWTH = 4 * 1024 ** 3
+
+# Jobs in a row whose samples must have grown past a threshold
+DEFAULT_SUSTAINED_JOBS = 3
+
+
+def find_server_pid(port: int) -> Optional[int]:
+    """Find the ComfyUI server process listening on `port` from its command line."""
+    for proc in Path("/proc").iterdir():
+        if not proc.name.isdigit():
+            continue
+        try:
+            args = (proc / "cmdline").read_bytes().split(b"\0")
+        except OSError:
+            continue
+        if any(arg.endswith(b"main.py") for arg in args) and str(port).encode() in args:
+            return int(proc.name)
+    return None
+
+
+def process_rss(pid: int) -> Optional[int]:
+    """Resident memory of a process in bytes, from /proc."""
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class LeakWatchdog:
+    """Decide from memory samples whether the server has leaked enough to be recycled.
+
+    The baseline is the lowest sample since the server started or since a job
+    loaded a model no earlier job had loaded, so a model swap starts a new
+    baseline instead of counting as growth. Jobs may sample concurrently.
+    """
+
+    def __init__(
+        self,
+        max_rss_growth: int = DEFAULT_MAX_RSS_GROWTH,
+        max_vram_growth: int = DEFAULT_MAX_VRAM_GROWTH,
+        sustained_jobs: int = DEFAULT_SUSTAINED_JOBS,
+    ):
+        self.max_rss_growth = max_rss_growth
+        self.max_vram_growth = max_vram_growth
+        self.sustained_jobs = max(sustained_jobs, 1)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the baseline and the loaded models, after the server restarted."""
+        with self._lock:
+            self.models: Set = set()
+            self._new_baseline()
+
+    def _new_baseline(self):
+        self.baseline_rss: Optional[int] = None
+        self.baseline_vram: Optional[int] = None
+        # Samples in a row that grew past a threshold
+        self.grown = 0
+
+    def sample(self, rss: Optional[int], vram_used: Optional[int], models: Iterable = ()) -> Optional[str]:
+        """Record a sample taken after a job that loaded `models`.
+
+        Returns why the server should be recycled, if it should.
+        """
+        with self._lock:
+            models = set(models)
+            if not models <= self.models:
+                self.models |= models
+                self._new_baseline()
+            if rss is not None:
+                self.baseline_rss = rss if self.baseline_rss is None else min(self.baseline_rss, rss)
+            if vram_used is not None:
+                self.baseline_vram = vram_used if self.baseline_vram is None else min(self.baseline_vram, vram_used)
+
+            reason = None
+            if self.max_rss_growth and rss is not None and rss - self.baseline_rss > self.max_rss_growth:
+                reason = f"RSS grew from {self.baseline_rss / 1024 ** 3:.1f} GB to {rss / 1024 ** 3:.1f} GB"
+            elif self.max_vram_growth and vram_used is not None and vram_used - self.baseline_vram > self.max_vram_growth:
+                reason = f"VRAM use grew from {self.baseline_vram / 1024 ** 3:.1f} GB to {vram_used / 1024 ** 3:.1f} GB"
+
+            if reason is None:
+                self.grown = 0
+                return None
+            self.grown += 1
+            if self.grown < self.sustained_jobs:
+                return None
+            return f"{reason} ({self.grown} jobs in a row)"
+
+
+class ServerGate:
+    """Track the jobs using the server, and hold new ones while it is recycled."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._active = 0
+        self._recycling = False
+        # Incremented by every recycle, so stale requests for one are ignored
+        self.generation = 0
+
+    @contextmanager
+    def job(self):
+        """Run a job on the server, waiting for a recycle in progress to finish first."""
+        with self._cond:
+            while self._recycling:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield self.generation
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def recycle(self, restart: Callable[[], None], generation: int) -> bool:
+        """Wait for the running jobs, then restart the server while new jobs wait.
+
+        Returns False without restarting when the server was already recycled
+        since `generation` was observed.
+        """
+        with self._cond:
+            if self._recycling or generation != self.generation:
+                return False
+            self._recycling = True
+            if self._active:
+                logger.info(f"Waiting for {self._active} running jobs before recycling the server")
+            while self._active:
+                self._cond.wait()
+        try:
+            restart()
+        finally:
+            with self._cond:
+                self.generation += 1
+                self._recycling = False
+                self._cond.notify_all()
+        return True
@@ -37,11 +37,24 @@ import uuid
 import os 
 import base64 
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import random
+import threading
 
 import modal
 
+from comfy_runtime import ComfyEngine
+from comfy_runtime.health import HealthMonitor, HealthState
+from comfy_runtime.loaders import load_workflow_file, required_models
+from comfy_runtime.models import COMFY_MODELS_DIR, LOCKFILE_NAME, ModelDownloader, ModelSpec, load_lockfile
+from comfy_runtime.outputs import cleanup_outputs, collect_output_files, isolate_outputs
+from comfy_runtime.results import RESULTS_DIR, ResultStore, download_response
+from comfy_runtime.scheduling import GroupingScheduler
+from comfy_runtime.templates import WorkflowTemplate
+from comfy_runtime.staging import stage_from_env, verify_staged
+from comfy_runtime.timeline import Timeline
+from comfy_runtime.watchdog import LeakWatchdog, ServerGate, find_server_pid, process_rss
+
 image = ( 
     modal.Image.debian_slim( 
         python_version="3.11"
@@ -90,66 +103,17 @@ image = image.add_local_dir(
 
 # ## Downloading models
 
-# `comfy-cli` also supports downloading models, but we've found it's faster to use
-# [`hf_hub_download`](https://huggingface.co/docs/huggingface_hub/en/guides/download#download-a-single-file)
-# directly by:
-
-# 1. Enabling [faster downloads](https://huggingface.co/docs/huggingface_hub/en/guides/download#faster-downloads)
-# 2. Mounting the cache directory to a [Volume](https://modal.com/docs/guide/volumes)
+# `comfy-cli` also supports downloading models, but we download them from the Hugging Face Hub
+# ourselves (see `comfy_runtime/models.py`) into a cache directory mounted as a [Volume](https://modal.com/docs/guide/volumes).
 
 # By persisting the cache to a Volume, you avoid re-downloading the models every time you rebuild your image.
 
-
-# --- Helper function to download models ---
-def download_model(
-    download_details: Tuple[str, str, str], cache_dir: str, token: str
-):
-    """Downloads a model using hf_hub_download and creates a symlink."""
-    from huggingface_hub import hf_hub_download
-
-    repo_id, filename, dest_subfolder = download_details
-    custom_filename = None
-    if "|" in filename:
-        filename, custom_filename = filename.split("|")
-
-    # Determine the actual filename on disk (could be custom or from URL)
-    dl_filename = custom_filename if custom_filename else filename.split("/")[-1]
-    # Construct the destination path within ComfyUI models directory
-    dest_path = f"/root/comfy/ComfyUI/models/{dest_subfolder}/{dl_filename}"
-    # Construct the symlink source path within the cache
-    symlink_src_path = Path(cache_dir) / "hf" / repo_id / filename # Simplified path assumption
-
-    # Check if symlink already exists
-    if Path(dest_path).exists():
-        print(f"Symlink already exists for {dl_filename}, skipping download.")
-        return
-
-    print(f"Downloading {repo_id}/{filename}...")
-    try:
-        downloaded_path_obj = hf_hub_download(
-            repo_id=repo_id,
-            filename=filename,
-            local_dir=Path(cache_dir) / "hf" / repo_id, # Download to specific repo folder
-            local_dir_use_symlinks=False, # Avoid symlinks within cache
-            token=token,
-            cache_dir=cache_dir, # Use the main cache dir for HF logic
-        )
-        downloaded_path = str(downloaded_path_obj) # Convert Path object to string
-        print(f"Downloaded to: {downloaded_path}")
-
-        # Ensure the destination directory exists
-        Path(dest_path).parent.mkdir(parents=True, exist_ok=True)
-
-        # Create the symlink - Use the actual downloaded path as source
-        print(f"Creating symlink from {downloaded_path} to {dest_path}")
-        subprocess.run(
-            f"ln -sfn {downloaded_path} {dest_path}", # Use -f to overwrite if broken, -n to treat symlink dest as normal file if it is a symlink to dir
-            shell=True,
-            check=True,
-        )
-        print(f"Symlink created for {dl_filename}")
-    except Exception as e:
-        print(f"Error downloading/linking {repo_id}/{filename}: {e}")
+# Downloads are pinned by `models.lock.json` (revision, size and sha256 per file), run concurrently,
+# fetch each file over parallel connections with [hf_transfer](https://huggingface.co/docs/huggingface_hub/en/guides/download#faster-downloads)
+# and are verified before they are linked into ComfyUI's models directory.
+# A model that fails to download fails the image build instead of the first inference.
+# Regenerate the lockfile after changing `MODELS_TO_DOWNLOAD` with `python -m comfy_runtime.models comfyapp.py`
+# (it only needs `huggingface_hub` locally, no image is built).
 
 
 # --- Model definitions ---
@@ -199,25 +163,36 @@ MODELS_TO_DOWNLOAD: List[Tuple[str, str, str]] = [
 
 CACHE_DIR = "/cache"
 vol = modal.Volume.from_name("hf-hub-cache", create_if_missing=True)
+MODELS_LOCKFILE = Path(__file__).parent / LOCKFILE_NAME
 
 # --- Function to run during image build ---
 def download_all_models_during_build():
-    """Iterates through MODELS_TO_DOWNLOAD and calls download_model."""
+    """Downloads, verifies and links MODELS_TO_DOWNLOAD, failing the build if any is missing."""
     token = os.environ.get("HF_TOKEN")
     if not token:
         print("Warning: HF_TOKEN secret not found. Downloads might fail for private models.")
     # Ensure the main cache directory exists before downloads start
     Path(CACHE_DIR).mkdir(parents=True, exist_ok=True)
-    for model_details in MODELS_TO_DOWNLOAD:
-        download_model(model_details, CACHE_DIR, token)
+    downloader = ModelDownloader(CACHE_DIR, lock=load_lockfile(f"/root/{LOCKFILE_NAME}"), token=token)
+    downloader.sync([ModelSpec.from_tuple(details) for details in MODELS_TO_DOWNLOAD])
 
 # --- Updated Image Build ---
+# the download step imports this file, so our runtime package and the lockfile go into the image first
 image = (
     # install huggingface_hub with hf_transfer support to speed up downloads
     image.pip_install("huggingface_hub[hf_transfer]==0.30.0")
     .env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})
+    .add_local_python_source("comfy_runtime", copy=True)
+)
+if MODELS_LOCKFILE.exists():
+    image = image.add_local_file(MODELS_LOCKFILE, f"/root/{LOCKFILE_NAME}", copy=True)
+elif modal.is_local():
+    # without a lockfile the models are downloaded but not verified
+    print(f"Warning: {MODELS_LOCKFILE} not found, run `python -m comfy_runtime.models comfyapp.py` to pin the models.")
+
+image = (
     # Run the download function during the image build
-    .run_function(
+    image.run_function(
         download_all_models_during_build, # Pass the regular function here
         # Pass secrets and volumes to the build function
         secrets=[modal.Secret.from_name("huggingface-secret")],
@@ -226,6 +201,10 @@ image = (
     )
 )
 
+# The API runs prompts in-process over ComfyUI's websocket (see `comfy_runtime/engine.py`),
+# so we need a websocket client in the image.
+image = image.pip_install("websocket-client==1.8.0")
+
 # Lastly, copy the ComfyUI workflow JSON to the container.
 image = image.add_local_file(
     Path(__file__).parent / "workflow_api1.json", "/root/workflow_api1.json"
@@ -264,19 +243,49 @@ def ui():
 
 # 1. Stand up a "headless" ComfyUI server in the background when the app starts.
 
-# 2. Define an `infer` method that takes in a workflow path and runs the workflow on the ComfyUI server.
+# 2. Define an `infer` method that takes in a workflow path and queues the workflow on the ComfyUI server through its HTTP and websocket API.
 
 # 3. Create a web handler `api` as a web endpoint, so that we can run our workflow as a service and accept inputs from clients.
 
 # We group all these steps into a single Modal `cls` object, which we'll call `ComfyUI`.
 
+# Large images don't have to travel back as base64 inside JSON: with `"result_mode": "reference"`
+# the API stores the image in a Volume and returns a small reference, and the `download` endpoint
+# streams the bytes back (with HTTP Range support).
+
+results_vol = modal.Volume.from_name("comfyui-results", create_if_missing=True)
+result_store = ResultStore(RESULTS_DIR, results_vol)
+
+with image.imports():
+    from fastapi import Request
+
+
+# Model folders of `workflow_api1.json` whose weights are captured in the memory snapshot
+# (the Flux checkpoint dominates cold starts; drop it if the snapshot gets too large)
+PRELOAD_MODEL_FOLDERS: List[str] = ["checkpoints"]
+
+# Request fields of `api` and the `workflow_api1.json` inputs they set ("<node id>.<input>")
+TEXT_TO_IMAGE_PARAMETERS: Dict[str, str] = {
+    "prompt": "6.text",
+    "seed": "25.noise_seed",
+    "numberOfImagesOutput": "5.batch_size",
+    "width": "5.width",
+    "height": "5.height",
+    "loraName": "60.lora_name",
+    "guidance": "67.guidance",
+    "sampler_name": "16.sampler_name",
+    "sgm_uniform": "17.scheduler",
+    "steps": "17.steps",
+    "filename_prefix": "9.filename_prefix",
+}
+
 
 @app.cls(
     scaledown_window=5,  # 5 seconds container keep alive after it processes an input
     gpu="L40S",
     #cpu=8,
     #memory=24576, # 24 GB
-    volumes={"/cache": vol},
+    volumes={"/cache": vol, RESULTS_DIR: results_vol},
     enable_memory_snapshot=True,  # snapshot container state for faster cold starts
 )
 @modal.concurrent(max_inputs=5)  # run 5 inputs per container
@@ -285,8 +294,45 @@ class ComfyUI:
 
     @modal.enter(snap=True)
     def launch_comfy_background(self):
+        # copy the models our workflow loads from the Volume to local disk, so the first
+        # load reads them from local disk instead of network storage
+        # every startup phase is logged as a JSON line, see `comfy_runtime/timeline.py`
+        self.timeline = Timeline("ComfyUI")
+        workflow = load_workflow_file("/root/workflow_api1.json")
+        # parse the workflow once and name the inputs `api` requests may set; each request
+        # then only copies the nodes it changes instead of re-reading and re-writing the JSON
+        self.text_to_image = WorkflowTemplate.compile("workflow_api1", workflow, TEXT_TO_IMAGE_PARAMETERS)
+        with self.timeline.span("stage_models"):
+            # staging is configured with MODEL_STAGING, and models it can't stage still load from the Volume
+            self.staged_models = stage_from_env(required_models(workflow))
+
         cmd = f"comfy launch --background -- --port {self.port}"
-        subprocess.run(cmd, shell=True, check=True)
+        with self.timeline.span("launch_comfy"):
+            subprocess.run(cmd, shell=True, check=True)
+        self.engine = ComfyEngine(port=self.port)
+
+        # load the weights of the selected model folders into host RAM, so they're part of the
+        # memory snapshot and only need to be copied to the GPU after a restore
+        import requests
+
+        paths = [
+            f"{COMFY_MODELS_DIR}/{subfolder}/{filename}"
+            for subfolder, filename in required_models(workflow)
+            if subfolder in PRELOAD_MODEL_FOLDERS
+        ]
+        if paths:
+            with self.timeline.span("preload_weights"):
+                try:
+                    response = requests.post(
+                        f"http://127.0.0.1:{self.port}/snapshot/preload", json={"paths": paths}, timeout=1200
+                    )
+                    response.raise_for_status()
+                    result = response.json()
+                    print(f"Preloaded {len(result['loaded'])} model files in {result['seconds']:.1f}s, failed: {result['failed']}")
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    # the models are loaded from disk on first use instead
+                    print(f"Error preloading model weights: {e}")
+        self.timeline.mark("snapshot_ready")
 
     @modal.enter(snap=False)
     def restore_snapshot(self):
@@ -294,108 +340,145 @@ class ComfyUI:
         # note: requires patching core ComfyUI, see the memory_snapshot_helper directory for more details
         import requests
 
-        response = requests.post(f"http://127.0.0.1:{self.port}/cuda/set_device")
+        self.timeline.restored()
+
+        # use the Volume copy of any staged model the restored container doesn't have
+        verify_staged(self.staged_models)
+
+        with self.timeline.span("set_device"):
+            response = requests.post(f"http://127.0.0.1:{self.port}/cuda/set_device")
         if response.status_code != 200:
             print("Failed to set CUDA device")
         else:
             print("Successfully set CUDA device")
 
+        # a background thread polls `/system_stats` and `/queue` and drains the container when the server stops answering
+        self.health = HealthMonitor(self.port, on_unhealthy=self.drain)
+        self.health.start()
+
+        # the server's memory use is sampled after every job; once it has grown too much for several jobs in a row
+        # (compared with earlier jobs, since the server loaded its current models), the server is restarted in place
+        # while new jobs wait, instead of degrading until it stops responding
+        self.watchdog = LeakWatchdog()
+        self.server_gate = ServerGate()
+
+        # requests are sent to the server one at a time, grouping those that use the same LoRA,
+        # since every LoRA switch re-patches the Flux weights. the `memory_snapshot_helper` node also keeps
+        # the `LORA_CACHE_SIZE` (default 4) most recently used LoRAs in host RAM, see the `lora_stats` endpoint
+        self.lora_scheduler = GroupingScheduler()
+
+    def run_workflow(self, workflow: Dict, run_id: str, group: Optional[str] = None) -> Path:
+        self.timeline.first_request()
+
+        # waits for this request's turn (see `lora_scheduler`), then while the server is being recycled
+        with self.lora_scheduler.slot(group), self.server_gate.job() as generation:
+            # sometimes the ComfyUI server stops responding (we think because of memory leaks), so this makes sure it's still up
+            if not self.health.state.healthy:
+                # all queued inputs will be marked "Failed", so you need to catch these errors in your client and then retry
+                raise Exception(f"ComfyUI server is not healthy: {self.health.state.error}")
+
+            # queues the workflow on the running ComfyUI server and follows it over the websocket,
+            # writing its images into their own `run_id` subdirectory of the output folder
+            execution = self.engine.run(isolate_outputs(workflow, run_id))
+            self.timeline.record_prompt(execution, workflow)
+
+        pid = find_server_pid(self.port)
+        state = self.health.check()
+        vram_used = state.vram_total - state.vram_free if state.vram_total is not None and state.vram_free is not None else None
+        reason = self.watchdog.sample(process_rss(pid) if pid else None, vram_used, required_models(workflow))
+        if reason:
+            threading.Thread(target=self.recycle_server, args=(reason, generation), daemon=True).start()
+
+        # looks up the output image recorded for this prompt
+        files = collect_output_files(execution, run_id)
+        if not files:
+            cleanup_outputs(run_id)
+            raise RuntimeError(f"ComfyUI prompt {execution.prompt_id} produced no output images")
+        return files[0]
+
     @modal.method()
     def infer(self, workflow_path: str = "/root/workflow_api1.json"):
-        # sometimes the ComfyUI server stops responding (we think because of memory leaks), so this makes sure it's still up
-        self.poll_server_health()
-
-        # runs the comfy run --workflow command as a subprocess
-        cmd = f"comfy run --workflow {workflow_path} --wait --timeout 1200 --verbose"
-        subprocess.run(cmd, shell=True, check=True)
-
-        # completed workflows write output images to this directory
-        output_dir = "/root/comfy/ComfyUI/output"
-
-        # looks up the name of the output image file based on the workflow
-        workflow = json.loads(Path(workflow_path).read_text())
-        file_prefix = [
-            node.get("inputs")
-            for node in workflow.values()
-            if node.get("class_type") == "SaveImage"
-        ][0]["filename_prefix"]
-
-        # returns the image as bytes
-        for f in Path(output_dir).iterdir():
-            if f.name.startswith(file_prefix):
-                return f.read_bytes()
+        # returns the image as bytes, then deletes the run's output folder
+        run_id = uuid.uuid4().hex
+        try:
+            return self.run_workflow(load_workflow_file(workflow_path), run_id).read_bytes()
+        finally:
+            cleanup_outputs(run_id)
 
     @modal.fastapi_endpoint(method="POST")
     def api(self, item: Dict):
         from fastapi.responses import JSONResponse # Thay đổi import
 
-        workflow_data = json.loads(
-            (Path(__file__).parent / "workflow_api1.json").read_text()
-        )
-
-        # Define default values by reading from the loaded workflow
-        defaults = {
-            "prompt": workflow_data["6"]["inputs"]["text"],
-            "seed": workflow_data["25"]["inputs"]["noise_seed"], # Node 25 for seed
-            "numberOfImagesOutput": workflow_data["5"]["inputs"]["batch_size"],
-            "width": workflow_data["5"]["inputs"]["width"],
-            "height": workflow_data["5"]["inputs"]["height"],
-            "loraName": workflow_data["60"]["inputs"]["lora_name"],
-            "guidance": workflow_data["67"]["inputs"]["guidance"],
-            "sampler_name": workflow_data["16"]["inputs"]["sampler_name"],
-            "sgm_uniform": workflow_data["17"]["inputs"]["scheduler"], # Node 17 for scheduler
-            "steps": workflow_data["17"]["inputs"]["steps"],
-        }
-
-        # Update workflow with values from the request, using defaults if not provided
-        workflow_data["6"]["inputs"]["text"] = item.get("prompt", defaults["prompt"])
-        workflow_data["25"]["inputs"]["noise_seed"] = item.get("seed", defaults["seed"]) # Update seed in node 25
-        workflow_data["5"]["inputs"]["batch_size"] = item.get("numberOfImagesOutput", defaults["numberOfImagesOutput"])
-        workflow_data["5"]["inputs"]["width"] = item.get("width", defaults["width"])
-        workflow_data["5"]["inputs"]["height"] = item.get("height", defaults["height"])
-        workflow_data["60"]["inputs"]["lora_name"] = item.get("loraName", defaults["loraName"])
-        workflow_data["67"]["inputs"]["guidance"] = item.get("guidance", defaults["guidance"])
-        workflow_data["16"]["inputs"]["sampler_name"] = item.get("sampler_name", defaults["sampler_name"])
-        workflow_data["17"]["inputs"]["scheduler"] = item.get("sgm_uniform", defaults["sgm_uniform"]) # Update scheduler in node 17
-        workflow_data["17"]["inputs"]["steps"] = item.get("steps", defaults["steps"])
+        from fastapi import HTTPException
+
+        # request fields that match a template parameter override the workflow's own values
+        values = {name: item[name] for name in self.text_to_image.parameters if name in item}
 
         # give the output image a unique id per client request
         client_id = uuid.uuid4().hex
-        workflow_data["9"]["inputs"]["filename_prefix"] = client_id
+        values["filename_prefix"] = client_id
 
-        # save this updated workflow to a new file
-        new_workflow_file = f"{client_id}.json"
-        # Ensure the directory for the new workflow file exists (writing to root in this case)
-        Path(new_workflow_file).parent.mkdir(parents=True, exist_ok=True)
-        json.dump(workflow_data, Path(new_workflow_file).open("w"))
+        try:
+            workflow = self.text_to_image.bind(values)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-        # run inference on the currently running container
-        img_bytes = self.infer.local(new_workflow_file)
+        # run inference on the currently running container, next to other requests for the same LoRA
+        lora_name = values.get("loraName", self.text_to_image.parameters["loraName"].default)
+        img_path = self.run_workflow(workflow, client_id, group=lora_name)
 
-        # Mã hóa ảnh thành base64
-        img_base64 = base64.b64encode(img_bytes).decode('utf-8')
+        try:
+            if item.get("result_mode") == "reference":
+                # store the image in the results volume and return a reference instead of the bytes
+                output_ref = result_store.put(client_id, img_path)
+                result_store.commit()
+                return JSONResponse(content={"output_ref": output_ref})
+
+            # Mã hóa ảnh thành base64
+            img_base64 = base64.b64encode(img_path.read_bytes()).decode('utf-8')
+        finally:
+            # the image is copied or encoded by now, so the run's output folder can go
+            cleanup_outputs(client_id)
         # Tạo dữ liệu response
         response_data = {"output_url": img_base64}
         # Trả về JSON response
         return JSONResponse(content=response_data)
 
-    def poll_server_health(self) -> Dict:
-        import socket
-        import urllib
+    @modal.fastapi_endpoint(method="GET")
+    def lora_stats(self):
+        # LoRA cache hits, misses and load time of this container's server, and how requests were grouped
+        import requests
+
+        cache = requests.get(f"http://127.0.0.1:{self.port}/snapshot/lora_cache", timeout=5).json()
+        return {"cache": cache, "scheduler": self.lora_scheduler.snapshot()}
 
-        try:
-            # check if the server is up (response should be immediate)
-            req = urllib.request.Request(f"http://127.0.0.1:{self.port}/system_stats")
-            urllib.request.urlopen(req, timeout=5)
-            print("ComfyUI server is healthy")
-        except (socket.timeout, urllib.error.URLError) as e:
-            # if no response in 5 seconds, stop the container
-            print(f"Server health check failed: {str(e)}")
-            modal.experimental.stop_fetching_inputs()
-
-            # all queued inputs will be marked "Failed", so you need to catch these errors in your client and then retry
-            raise Exception("ComfyUI server is not healthy, stopping container")
+    @modal.fastapi_endpoint(method="GET")
+    def download(self, key: str, request: "Request"):
+        # streams a stored result, honouring the Range header for partial downloads
+        return download_response(result_store, key, request.headers.get("range"))
 
+    def recycle_server(self, reason: str, generation: int):
+        # lets the running prompts finish, then restarts the server and re-applies the GPU setup
+        import requests
+
+        def restart():
+            print(f"Recycling ComfyUI server: {reason}")
+            with self.timeline.span("recycle_server", reason=reason), self.health.paused():
+                subprocess.run("comfy stop", shell=True, check=True)
+                subprocess.run(f"comfy launch --background -- --port {self.port}", shell=True, check=True)
+                requests.post(f"http://127.0.0.1:{self.port}/cuda/set_device", timeout=30).raise_for_status()
+            self.watchdog.reset()
+
+        try:
+            self.server_gate.recycle(restart, generation)
+        except Exception as e:
+            # if the server didn't come back, the health monitor drains the container
+            print(f"Failed to recycle ComfyUI server: {str(e)}")
+
+    def drain(self, state: HealthState):
+        # stop taking inputs once the server stops answering, so new requests go to a healthy container
+        print(f"ComfyUI server is unhealthy, stopping container: {state.error}")
+        modal.experimental.stop_fetching_inputs()
 
 # This serves the `workflow_api1.json` in this repo. When deploying your own workflows, make sure you select the "Export (API)" option in the ComfyUI menu:
 
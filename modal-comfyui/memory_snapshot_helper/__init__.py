@@ -1,8 +1,102 @@
+import asyncio
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
 
+import comfy.utils
+import folder_paths
 from aiohttp import web
 from server import PromptServer
 
+# ------- Weight preloading -------
+
+# State dicts loaded into host RAM before the memory snapshot, keyed by file path
+_preloaded = {}
+_original_load_torch_file = comfy.utils.load_torch_file
+
+
+# ------- LoRA cache -------
+
+# Most recently used LoRA state dicts kept in host RAM, keyed by file path and whether metadata was asked for
+_lora_cache = OrderedDict()
+_lora_cache_size = int(os.environ.get("LORA_CACHE_SIZE", 4))
+_lora_lock = threading.Lock()
+_lora_stats = {"hits": 0, "misses": 0, "evictions": 0, "load_seconds": 0.0}
+
+
+def _is_lora(path):
+    return any(path.startswith(os.path.abspath(d) + os.sep) for d in folder_paths.get_folder_paths("loras"))
+
+
+def _load_lora(path, return_metadata, args, kwargs):
+    """Serve a LoRA from the LRU cache, loading and caching it on a miss"""
+    key = (path, bool(return_metadata))
+    with _lora_lock:
+        cached = _lora_cache.get(key)
+        if cached is not None:
+            _lora_cache.move_to_end(key)
+            _lora_stats["hits"] += 1
+    if cached is None:
+        start = time.monotonic()
+        cached = _original_load_torch_file(path, *args, **kwargs)
+        with _lora_lock:
+            _lora_stats["misses"] += 1
+            _lora_stats["load_seconds"] += time.monotonic() - start
+            _lora_cache[key] = cached
+            while len(_lora_cache) > _lora_cache_size:
+                _lora_cache.popitem(last=False)
+                _lora_stats["evictions"] += 1
+    if return_metadata:
+        return dict(cached[0]), cached[1]
+    return dict(cached)
+
+
+def _load_torch_file(ckpt, *args, **kwargs):
+    """Serve preloaded weights and cached LoRAs from RAM, falling back to reading the file"""
+    device = kwargs.get("device", args[1] if len(args) > 1 else None)
+    return_metadata = kwargs.get("return_metadata", args[2] if len(args) > 2 else False)
+    path = os.path.abspath(ckpt)
+    on_cpu = device is None or str(device) == "cpu"
+    cached = _preloaded.get(path)
+    if cached is None and on_cpu and _lora_cache_size > 0 and _is_lora(path):
+        return _load_lora(path, return_metadata, args, kwargs)
+    if cached is None or not on_cpu:
+        return _original_load_torch_file(ckpt, *args, **kwargs)
+
+    sd, metadata = cached
+    # Loaders pop and rename keys, so hand out a new dict over the same tensors
+    if return_metadata:
+        return dict(sd), metadata
+    return dict(sd)
+
+
+comfy.utils.load_torch_file = _load_torch_file
+
+
+def _preload(paths):
+    start = time.monotonic()
+    loaded, failed, total = [], {}, 0
+    for path in paths:
+        path = os.path.abspath(path)
+        if path in _preloaded:
+            continue
+        try:
+            try:
+                sd, metadata = _original_load_torch_file(path, safe_load=True, return_metadata=True)
+            except TypeError:
+                # Older ComfyUI versions cannot return the metadata
+                sd, metadata = _original_load_torch_file(path, safe_load=True), None
+            _preloaded[path] = (sd, metadata)
+            total += sum(t.nbytes for t in sd.values() if hasattr(t, "nbytes"))
+            loaded.append(path)
+        except Exception as e:
+            logging.error(f"[memory_snapshot_helper] Failed to preload {path}: {e}")
+            failed[path] = str(e)
+    return {"loaded": loaded, "failed": failed, "bytes": total, "seconds": time.monotonic() - start}
+
+
 # ------- API Endpoints -------
 
 
@@ -12,5 +106,23 @@ async def set_current_device(request):
     return web.json_response({"status": "success"})
 
 
+@PromptServer.instance.routes.post("/snapshot/preload")
+async def preload_weights(request):
+    # Load model files into host RAM so the memory snapshot captures them
+    paths = (await request.json()).get("paths", [])
+    result = await asyncio.get_running_loop().run_in_executor(None, _preload, paths)
+    return web.json_response(result)
+
+
+@PromptServer.instance.routes.get("/snapshot/lora_cache")
+async def lora_cache_stats(request):
+    with _lora_lock:
+        stats = dict(_lora_stats)
+        cached = [os.path.basename(path) for path, _ in _lora_cache]
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else None
+    return web.json_response({**stats, "size": _lora_cache_size, "cached": cached})
+
+
 # Empty for ComfyUI node registration
 NODE_CLASS_MAPPINGS = {}
\ No newline at end of file
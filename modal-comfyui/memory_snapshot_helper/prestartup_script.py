@@ -1,5 +1,8 @@
+import importlib.util
+import json
 import os
 import shutil
+import time
 from pathlib import Path
 
 comfy_dir = Path(__file__).parent.parent.parent / "comfy"
@@ -49,4 +52,52 @@ def _apply_cuda_safe_patch():
 
 
 if not is_patched:
-    _apply_cuda_safe_patch()
\ No newline at end of file
+    _apply_cuda_safe_patch()
+
+# ------- Custom node import profiler -------
+
+custom_nodes_dir = str(Path(__file__).parent.parent)
+profile_path = "/tmp/custom_node_import_profile.json"
+_profile = []
+_original_spec_from_file_location = importlib.util.spec_from_file_location
+
+
+def _rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _profiled_exec_module(pack, exec_module):
+    def wrapper(module):
+        start, rss = time.monotonic(), _rss_bytes()
+        try:
+            return exec_module(module)
+        finally:
+            _profile.append({
+                "pack": pack,
+                "seconds": round(time.monotonic() - start, 3),
+                "rss_bytes": _rss_bytes() - rss,
+            })
+            with open(profile_path, "w") as f:
+                json.dump(_profile, f)
+
+    return wrapper
+
+
+def _spec_from_file_location(name, location=None, *args, **kwargs):
+    """Time the import of every custom node pack ComfyUI loads"""
+    spec = _original_spec_from_file_location(name, location, *args, **kwargs)
+    if spec is not None and spec.loader is not None and location is not None:
+        relative = os.path.relpath(str(location), custom_nodes_dir)
+        # Only the top-level module of a pack, e.g. "<pack>/__init__.py" or "<pack>.py"
+        parts = Path(relative).parts
+        if not relative.startswith("..") and (len(parts) == 1 or parts[1:] == ("__init__.py",)):
+            pack = Path(parts[0]).stem if len(parts) == 1 else parts[0]
+            spec.loader.exec_module = _profiled_exec_module(pack, spec.loader.exec_module)
+    return spec
+
+
+if os.path.exists("/proc/self/statm"):
+    if os.path.exists(profile_path):
+        os.remove(profile_path)
+    importlib.util.spec_from_file_location = _spec_from_file_location
@@ -14,18 +14,70 @@ It allows users to submit ComfyUI workflows dynamically and retrieve results via
 # L40S $1.95/ h
 # H100 $3.95/ h
 
+import asyncio
 import json
 import subprocess
 import uuid
 import os
+import re
 import base64
 import logging
+import threading
+import time
 import traceback
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Union
 
 import modal
 
+from comfy_runtime import ComfyEngine, ComfyExecutionError
+from comfy_runtime.custom_nodes import (
+    CUSTOM_NODE_MODES,
+    CUSTOM_NODES_DIR,
+    NODE_INDEX_PATH,
+    build_node_index,
+    enable_only,
+    enabled_packs,
+    load_import_profile,
+    load_node_index,
+    required_packs,
+    write_node_index,
+)
+from comfy_runtime.health import DEFAULT_INTERVAL as HEALTH_INTERVAL, HealthMonitor, HealthState
+from comfy_runtime.loaders import load_workflow_file, required_models
+from comfy_runtime.models import COMFY_MODELS_DIR, DEFAULT_CONCURRENCY, LOCKFILE_NAME, ModelDownloader, ModelSpec, load_lockfile
+from comfy_runtime.outputs import cleanup_outputs, collect_output_files, find_save_nodes, isolate_outputs
+from comfy_runtime.admission import (
+    DEFAULT_ADMISSION_WAIT,
+    DEFAULT_MAX_QUEUED_SECONDS,
+    AdmissionController,
+    AdmissionRejected,
+    estimate_cost,
+)
+from comfy_runtime.affinity import DEFAULT_POOLS, HEARTBEAT_INTERVAL, ResidencyBoard, ResidentSet, pool_name
+from comfy_runtime.analyzer import analyze_workflows, log_report, match_models
+from comfy_runtime.batching import DEFAULT_CHUNK_SIZE, apply_inputs, item_id, loader_signature, parse_item_id, plan_batch
+from comfy_runtime.callbacks import CallbackRegistry, post_with_retry, validate_callback_url
+from comfy_runtime.cache import DEFAULT_MAX_BYTES, RESULT_CACHE_DIR, ResultCache
+from comfy_runtime.canonical import workflow_hash
+from comfy_runtime.inputs import INPUTS_DIR, MAX_INPUT_BYTES, InputStore, base64_image_paths, is_input_key
+from comfy_runtime.requeue import DEFAULT_MAX_REQUEUES, JobTracker
+from comfy_runtime.results import RESULT_MODES, RESULTS_DIR, ResultStore, compact_result, download_response
+from comfy_runtime.singleflight import KeyConflictError, SingleFlight
+from comfy_runtime.templates import TemplateConflictError, TemplateRegistry, WorkflowTemplate
+from comfy_runtime.timeline import Timeline
+from comfy_runtime.watchdog import (
+    DEFAULT_MAX_RSS_GROWTH,
+    DEFAULT_MAX_VRAM_GROWTH,
+    DEFAULT_SUSTAINED_JOBS,
+    LeakWatchdog,
+    ServerGate,
+    find_server_pid,
+    process_rss,
+)
+from comfy_runtime.staging import stage_from_env, verify_staged
+
 # Define the Modal Image
 image = (
     modal.Image.debian_slim(
@@ -64,6 +116,71 @@ image = image.run_commands(
 CACHE_DIR = "/cache"
 vol = modal.Volume.from_name("comfyui-models-cache", create_if_missing=True)
 
+# Setup volume for out-of-band result delivery
+results_vol = modal.Volume.from_name("comfyui-results", create_if_missing=True)
+result_store = ResultStore(RESULTS_DIR, results_vol)
+
+# Setup volume for the content-addressed input images
+inputs_vol = modal.Volume.from_name("comfyui-inputs", create_if_missing=True)
+input_store = InputStore(INPUTS_DIR, inputs_vol)
+
+# Setup volume for the content-addressed result cache
+cache_vol = modal.Volume.from_name("comfyui-result-cache", create_if_missing=True)
+result_cache = ResultCache(
+    RESULT_CACHE_DIR,
+    cache_vol,
+    max_bytes=int(os.environ.get("RESULT_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+)
+
+# Shared record of in-flight workflows, used to deduplicate identical submissions
+inflight_dict = modal.Dict.from_name("comfyui-inflight", create_if_missing=True)
+single_flight = SingleFlight(inflight_dict)
+
+# Shared idempotency key to call id mapping, so client retries never spawn a second job
+idempotency_dict = modal.Dict.from_name("comfyui-idempotency-keys", create_if_missing=True)
+idempotency_keys = SingleFlight(
+    idempotency_dict,
+    ttl=int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 24 * 60 * 60)),
+)
+
+# Shared call id to callback URLs mapping, used to push completion webhooks
+callback_dict = modal.Dict.from_name("comfyui-callbacks", create_if_missing=True)
+callback_registry = CallbackRegistry(callback_dict)
+
+# Compact status (state, error, image references) of finished jobs, read by get_status_bulk
+status_dict = modal.Dict.from_name("comfyui-job-status", create_if_missing=True)
+
+# Longest time get_status may hold a request open waiting for a result
+MAX_STATUS_WAIT = 55
+
+# Limits of get_status_bulk: ids per request and calls resolved at the same time
+MAX_BULK_IDS = 500
+BULK_CONCURRENCY = 32
+
+# Shared store of batch manifests and of batch item results published as they finish
+batch_dict = modal.Dict.from_name("comfyui-batch-results", create_if_missing=True)
+
+# Items per batch request, and items a single worker call runs back to back
+MAX_BATCH_ITEMS = 200
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+
+# How often a waiting status request checks for a published batch item
+BATCH_POLL_INTERVAL = 1.0
+
+# Shared record of spawned jobs, used to requeue the ones lost to a drained or crashed container
+job_dict = modal.Dict.from_name("comfyui-jobs", create_if_missing=True)
+job_tracker = JobTracker(job_dict, max_requeues=int(os.environ.get("JOB_MAX_REQUEUES", DEFAULT_MAX_REQUEUES)))
+
+# Shared advertisements of the models each worker container holds, used to route jobs to warm containers
+residency_dict = modal.Dict.from_name("comfyui-residency", create_if_missing=True)
+residency_board = ResidencyBoard(residency_dict, pools=int(os.environ.get("WORKER_POOLS", DEFAULT_POOLS)))
+
+# Shared store of published workflow templates, by name and version
+template_dict = modal.Dict.from_name("comfyui-templates", create_if_missing=True)
+
+# Template names are used in store keys and URLs
+TEMPLATE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
 # Define models to download
 MODELS_TO_DOWNLOAD: List[Tuple[str, str, str]] = [
     # VAE models
@@ -86,88 +203,112 @@ MODELS_TO_DOWNLOAD: List[Tuple[str, str, str]] = [
     
 ]
 
-# Helper function to download models
-def download_model(
-    download_details: Tuple[str, str, str], cache_dir: str, token: str
-):
-    """Downloads a model using hf_hub_download and creates a symlink."""
-    from huggingface_hub import hf_hub_download
-
-    repo_id, filename, dest_subfolder = download_details
-    custom_filename = None
-    if "|" in filename:
-        filename, custom_filename = filename.split("|")
-
-    # Determine the actual filename on disk
-    dl_filename = custom_filename if custom_filename else filename.split("/")[-1]
-    # Construct the destination path within ComfyUI models directory
-    dest_path = f"/root/comfy/ComfyUI/models/{dest_subfolder}/{dl_filename}"
-    # Construct the symlink source path within the cache
-    symlink_src_path = Path(cache_dir) / "hf" / repo_id / filename
-
-    # Check if symlink already exists
-    if Path(dest_path).exists():
-        print(f"Symlink already exists for {dl_filename}, skipping download.")
-        return
-
-    print(f"Downloading {repo_id}/{filename}...")
-    try:
-        downloaded_path_obj = hf_hub_download(
-            repo_id=repo_id,
-            filename=filename,
-            local_dir=Path(cache_dir) / "hf" / repo_id,
-            local_dir_use_symlinks=False,
-            token=token,
-            cache_dir=cache_dir,
-        )
-        downloaded_path = str(downloaded_path_obj)
-        print(f"Downloaded to: {downloaded_path}")
-
-        # Ensure the destination directory exists
-        Path(dest_path).parent.mkdir(parents=True, exist_ok=True)
-
-        # Create the symlink
-        print(f"Creating symlink from {downloaded_path} to {dest_path}")
-        subprocess.run(
-            f"ln -sfn {downloaded_path} {dest_path}",
-            shell=True,
-            check=True,
-        )
-        print(f"Symlink created for {dl_filename}")
-    except Exception as e:
-        logger.error(f"Error downloading/linking {repo_id}/{filename}: {str(e)}")
-        logger.debug(f"Detailed error: {traceback.format_exc()}")
+# Add the deployed workflows, whose models are staged on local disk at startup. Each maps to
+# the model folders whose weights are loaded into host RAM before the memory snapshot
+# (add "unet" when the containers have enough memory for the UNet as well)
+DEPLOYED_WORKFLOWS_DIR = "/root/workflows"
+DEPLOYED_WORKFLOWS: Dict[str, List[str]] = {
+    "upscale_workflow1.json": ["clip", "vae", "upscale_models"],
+    "upscale_workflow2_API.json": ["clip", "vae", "upscale_models"],
+}
+
+# Named parameters of the deployed workflows, bound to "<node id>.<input>" paths. Clients can submit
+# `{"template": "<workflow file stem>", "params": {...}}` instead of a whole workflow.
+DEPLOYED_TEMPLATES: Dict[str, Dict[str, Union[str, List[str]]]] = {
+    "upscale_workflow1.json": {
+        "image": "55.image",
+        "seed": "26.seed",
+        "upscale_by": "1.upscale_by",
+        "denoise": "1.denoise",
+        "steps": "1.steps",
+        "tile_width": "1.tile_width",
+        "tile_height": "1.tile_height",
+    },
+    "upscale_workflow2_API.json": {
+        "image": "97.image",
+        "seed": "79.seed",
+        "denoise": "79.denoise",
+        "steps": "79.steps",
+        "downscale_by": "77.scale_by",
+        "scale_by": "85.scale_by",
+    },
+}
+
+# Only download the models the deployed workflows load. Submitted workflows can then only use those.
+SLIM_MODELS = False
+
+# Fail the build for models missing from `models.lock.json` instead of downloading them unverified
+REQUIRE_MODEL_LOCK = True
+
+# Where the build writes the packs and models the deployed workflows use
+WORKFLOW_MANIFEST_PATH = "/root/workflow_manifest.json"
+
+def load_deployed_workflows() -> Dict[str, Dict]:
+    """Read the deployed workflows from the image."""
+    return {name: load_workflow_file(Path(DEPLOYED_WORKFLOWS_DIR) / name) for name in DEPLOYED_WORKFLOWS}
+
+def load_deployed_templates(store=None) -> TemplateRegistry:
+    """Compile the deployed workflows into templates named after their file stems (version 1)."""
+    registry = TemplateRegistry(store)
+    for name, workflow in load_deployed_workflows().items():
+        registry.register(WorkflowTemplate.compile(Path(name).stem, workflow, DEPLOYED_TEMPLATES.get(name, {})))
+    return registry
+
+# Lockfile pinning every model to a revision, size and sha256, written by
+# `python -m comfy_runtime.models modal_comfyui_api.py`
+MODELS_LOCKFILE = Path(__file__).parent / LOCKFILE_NAME
 
 # Function to download all models during build
 def download_all_models_during_build():
-    """Iterates through MODELS_TO_DOWNLOAD and calls download_model."""
+    """Download, verify and link MODELS_TO_DOWNLOAD, failing the build if any is missing."""
     token = os.environ.get("HF_TOKEN")
     if not token:
         logger.warning("HF_TOKEN secret not found. Downloads might fail for private models.")
-    
-    # Ensure the main cache directory exists before downloads start
-    try:
-        Path(CACHE_DIR).mkdir(parents=True, exist_ok=True)
-        logger.info(f"Cache directory created/verified at {CACHE_DIR}")
-        
-        for model_details in MODELS_TO_DOWNLOAD:
-            try:
-                download_model(model_details, CACHE_DIR, token)
-            except Exception as e:
-                logger.error(f"Failed to download model {model_details}: {str(e)}")
-                logger.debug(f"Detailed error: {traceback.format_exc()}")
-                # Continue with other models even if one fails
-    except Exception as e:
-        logger.error(f"Failed to create cache directory: {str(e)}")
-        logger.debug(f"Detailed error: {traceback.format_exc()}")
-        raise
 
-# Update image to download models
+    lock = load_lockfile(f"/root/{LOCKFILE_NAME}")
+    if not lock:
+        if REQUIRE_MODEL_LOCK:
+            raise RuntimeError(f"{LOCKFILE_NAME} is missing, run `python -m comfy_runtime.models modal_comfyui_api.py comfyapp.py`")
+        logger.warning("No model lockfile found, downloads will not be verified")
+
+    specs = [ModelSpec.from_tuple(details) for details in MODELS_TO_DOWNLOAD]
+    if SLIM_MODELS:
+        matched, missing = match_models(required_models(*load_deployed_workflows().values()), specs)
+        specs = list(dict.fromkeys(matched.values()))
+        for subfolder, filename in missing:
+            logger.warning(f"Deployed workflows load {subfolder}/{filename}, which is not in MODELS_TO_DOWNLOAD")
+        logger.info(f"Downloading the {len(specs)} models the deployed workflows load")
+
+    Path(CACHE_DIR).mkdir(parents=True, exist_ok=True)
+    downloader = ModelDownloader(
+        CACHE_DIR,
+        lock=lock,
+        token=token,
+        concurrency=int(os.environ.get("MODEL_DOWNLOAD_CONCURRENCY", DEFAULT_CONCURRENCY)),
+        max_bytes_per_second=int(os.environ.get("MODEL_DOWNLOAD_MAX_BPS", 0)) or None,
+        require_lock=REQUIRE_MODEL_LOCK,
+    )
+    downloader.sync(specs)
+
+# The download step imports this module, so the runtime package, the lockfile and the deployed
+# workflows must be in the image first
 image = (
-    # Install huggingface_hub with hf_transfer support to speed up downloads
+    # Install huggingface_hub with hf_transfer support to download each file over parallel connections
     image.pip_install("huggingface_hub[hf_transfer]")
     .env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})
+    .add_local_python_source("comfy_runtime", copy=True)
+)
+if MODELS_LOCKFILE.exists():
+    image = image.add_local_file(MODELS_LOCKFILE, f"/root/{LOCKFILE_NAME}", copy=True)
+for workflow_file in DEPLOYED_WORKFLOWS:
+    image = image.add_local_file(
+        Path(__file__).parent / workflow_file, f"{DEPLOYED_WORKFLOWS_DIR}/{workflow_file}", copy=True
+    )
+
+# Update image to download models
+image = (
     # Run the download function during the image build
+    image
     .run_function(
         download_all_models_during_build,
         # Pass secrets and volumes to the build function
@@ -177,6 +318,9 @@ image = (
     )
 )
 
+# Install the websocket client used to follow prompt progress in-process
+image = image.pip_install("websocket-client")
+
 # Add memory snapshot helper for faster cold starts
 image = image.add_local_dir(
     local_path=Path(__file__).parent / "memory_snapshot_helper",
@@ -184,6 +328,39 @@ image = image.add_local_dir(
     copy=True,
 )
 
+# Record which custom node pack provides each node type, from the object_info of a CPU-only server
+def index_custom_nodes_during_build():
+    """Write the class_type to node pack index used by the lazy custom node mode."""
+    import requests
+
+    subprocess.run("comfy launch --background -- --cpu --port 8188", shell=True, check=True)
+    try:
+        object_info = requests.get("http://127.0.0.1:8188/object_info", timeout=120).json()
+        index = build_node_index(object_info)
+        write_node_index(index, NODE_INDEX_PATH)
+        logger.info(f"Indexed {len(index)} node types from {len(set(index.values()))} packs")
+    finally:
+        subprocess.run("comfy stop", shell=True)
+
+image = image.run_function(index_custom_nodes_during_build)
+
+# Report which node packs and models the deployed workflows use, and what they are missing
+def analyze_workflows_during_build():
+    """Write the workflow manifest and warn about models or node types the workflows cannot load."""
+    report = analyze_workflows(
+        load_deployed_workflows(),
+        [ModelSpec.from_tuple(details) for details in MODELS_TO_DOWNLOAD],
+        node_index=load_node_index(NODE_INDEX_PATH),
+        installed_packs=[
+            path.name for path in Path(CUSTOM_NODES_DIR).iterdir()
+            if path.is_dir() and not path.name.startswith(("__", "."))
+        ],
+    )
+    log_report(report)
+    Path(WORKFLOW_MANIFEST_PATH).write_text(json.dumps(report, indent=2))
+
+image = image.run_function(analyze_workflows_during_build)
+
 # Configure logging with more detailed format
 logging.basicConfig(
     level=logging.INFO,
@@ -191,25 +368,62 @@ logging.basicConfig(
 )
 logger = logging.getLogger("comfyui-api")
 
+# Say so at deploy time, before the image build gets to the model download step
+if not MODELS_LOCKFILE.exists() and modal.is_local():
+    logger.warning(
+        f"{MODELS_LOCKFILE} not found, the model download step will "
+        f"{'fail' if REQUIRE_MODEL_LOCK else 'not verify the models'}. "
+        f"Run `python -m comfy_runtime.models modal_comfyui_api.py comfyapp.py` and commit the lockfile."
+    )
+
 # Define the Modal App
 app = modal.App(name="comfyui-api", image=image)
 
-# Define the standalone function for workflow execution
-@app.function(
-    gpu="L4", 
-    volumes={CACHE_DIR: vol},
-    timeout=600,  # 30 minutes timeout for long workflows
-)
-def execute_comfy_workflow_async(workflow_json: Dict) -> Dict:
-    """Run a ComfyUI workflow and return the results.
-    
-    This is a standalone function that can be spawned asynchronously.
+# FastAPI types used in endpoint signatures, only importable inside the container
+with image.imports():
+    from fastapi import Request
+
+# Turn output files into response entries, inline or as result store references
+def build_result_images(files: List[Path], run_id: str, result_mode: str = "inline") -> List[Dict]:
+    """Encode output files as base64 entries or store them and return references."""
+    images = []
+    for f in files:
+        logger.info(f"Found output image: {f.name} for run_id {run_id}")
+        try:
+            if result_mode == "reference":
+                # Store the file out-of-band and return a compact reference
+                images.append(result_store.put(run_id, f))
+            else:
+                # Read the file and encode it as base64
+                image_data = base64.b64encode(f.read_bytes()).decode("utf-8")
+                images.append({
+                    "filename": f.name,
+                    "type": "base64",
+                    "data": image_data
+                })
+        except (IOError, OSError) as e:
+            logger.warning(f"Failed to read image file {f.name} for run_id {run_id}: {str(e)}")
+            logger.debug(f"Detailed error: {traceback.format_exc()}")
+            # Continue with other images
+    if result_mode == "reference" and images:
+        result_store.commit()
+    return images
+
+# Shared execution logic for the synchronous and asynchronous paths
+def run_comfy_workflow(
+    engine: ComfyEngine,
+    workflow_json: Dict,
+    run_id: str,
+    result_mode: str = "inline",
+    use_cache: bool = True,
+    timeline: Optional[Timeline] = None,
+) -> Dict:
+    """Run a ComfyUI workflow on a live server and return the results.
+
+    With `result_mode="reference"` the images are stored in the results volume
+    and returned as keys for `download_result` instead of inline base64 data.
+    Identical workflows are answered from the result cache unless `use_cache` is False.
     """
-    # Generate a unique ID for this run
-    run_id = str(uuid.uuid4())
-    workflow_path = f"/tmp/{run_id}.json"
-    logger.info(f"Starting workflow execution for run_id: {run_id}")
-    
     try:
         # Validate workflow JSON
         if not isinstance(workflow_json, dict) or not workflow_json:
@@ -220,147 +434,57 @@ def execute_comfy_workflow_async(workflow_json: Dict) -> Dict:
                 "error": error_msg
             }
         
-        # Launch ComfyUI server if not already running
-        try:
-            logger.info(f"Launching ComfyUI server for run_id {run_id}")
-            port = 8000
-            cmd = f"comfy launch --background -- --port {port}"
-            subprocess.run(cmd, shell=True, check=True)
-            logger.info(f"ComfyUI server launched successfully for run_id {run_id}")
-            
-            # Wait a moment for the server to start
-            import time
-            time.sleep(5)
-        except subprocess.SubprocessError as e:
-            error_msg = f"Failed to launch ComfyUI server: {str(e)}"
-            logger.error(f"Error for run_id {run_id}: {error_msg}")
-            logger.debug(f"Detailed error: {traceback.format_exc()}")
-            return {
-                "status": "FAILED",
-                "error": error_msg
-            }
-        
-        # Check server health
-        try:
-            import urllib.request
-            import socket
-            
-            # Check if the server is up
-            req = urllib.request.Request(f"http://127.0.0.1:{port}/system_stats")
-            response = urllib.request.urlopen(req, timeout=5)
-            response_data = response.read().decode('utf-8')
-            logger.info(f"ComfyUI server is healthy for run_id {run_id}")
-            logger.debug(f"Health check response: {response_data}")
-        except (socket.timeout, urllib.error.URLError) as e:
-            error_msg = f"ComfyUI server is not healthy: {str(e)}"
-            logger.error(f"Server health check failed for run_id {run_id}: {str(e)}")
-            logger.debug(f"Detailed error: {traceback.format_exc()}")
-            return {
-                "status": "FAILED",
-                "error": error_msg
-            }
-
-        # Save workflow to a temporary file
-        try:
-            with open(workflow_path, "w") as f:
-                json.dump(workflow_json, f)
-            logger.info(f"Saved workflow to {workflow_path} for run_id {run_id}")
-        except (IOError, OSError) as e:
-            error_msg = f"Failed to save workflow to temporary file: {str(e)}"
+        # Make sure the workflow saves something, otherwise there is nothing to return
+        if not find_save_nodes(workflow_json):
+            error_msg = "No SaveImage nodes found in workflow"
             logger.error(f"Error for run_id {run_id}: {error_msg}")
-            logger.debug(f"Detailed error: {traceback.format_exc()}")
             return {
                 "status": "FAILED",
                 "error": error_msg
             }
 
-        # Run the workflow
-        try:
-            cmd = f"comfy run --workflow {workflow_path} --wait --timeout 1200 --verbose"
-            logger.info(f"Executing command for run_id {run_id}: {cmd}")
-            process = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
-            logger.info(f"Workflow execution completed for run_id: {run_id}")
-            logger.debug(f"Command output: {process.stdout}")
-        except subprocess.CalledProcessError as e:
-            error_msg = f"ComfyUI workflow execution failed with exit code {e.returncode}"
-            logger.error(f"Error for run_id {run_id}: {error_msg}")
-            logger.debug(f"Command output: {e.stdout}")
-            logger.debug(f"Command error: {e.stderr}")
-            logger.debug(f"Detailed error: {traceback.format_exc()}")
-            return {
-                "status": "FAILED",
-                "error": error_msg,
-                "details": {
-                    "stdout": e.stdout,
-                    "stderr": e.stderr,
-                    "exit_code": e.returncode
+        # Reuse the outputs of an identical earlier run if they are cached
+        cache_key = workflow_hash(workflow_json)
+        output_files = result_cache.get(cache_key) if use_cache else None
+        cached = output_files is not None
+        if cached:
+            logger.info(f"Result cache hit for run_id {run_id} (key {cache_key})")
+        else:
+            # Run the workflow on the ComfyUI server, writing outputs into a per-run subdirectory
+            try:
+                logger.info(f"Submitting workflow to ComfyUI for run_id {run_id}")
+                # Stored input images are copied to ComfyUI's input directory and loaded from there
+                execution = engine.run(isolate_outputs(input_store.use_input_files(workflow_json), run_id))
+                logger.info(f"Workflow execution completed for run_id: {run_id} (prompt_id {execution.prompt_id})")
+                if timeline is not None:
+                    timeline.record_prompt(execution, workflow_json)
+            except ComfyExecutionError as e:
+                error_msg = f"ComfyUI workflow execution failed: {str(e)}"
+                logger.error(f"Error for run_id {run_id}: {error_msg}")
+                logger.debug(f"Detailed error: {traceback.format_exc()}")
+                return {
+                    "status": "FAILED",
+                    "error": error_msg,
+                    "details": e.details
                 }
-            }
-        except Exception as e:
-            error_msg = f"Failed to execute ComfyUI workflow: {str(e)}"
-            logger.error(f"Error for run_id {run_id}: {error_msg}")
-            logger.debug(f"Detailed error: {traceback.format_exc()}")
-            return {
-                "status": "FAILED",
-                "error": error_msg
-            }
-
-        # Get output images
-        output_dir = "/root/comfy/ComfyUI/output"
-        images = []
-
-        # Look for any SaveImage nodes in the workflow
-        try:
-            save_image_nodes = [
-                node for node_id, node in workflow_json.items()
-                if node.get("class_type") == "SaveImage"
-            ]
-
-            # If there are no SaveImage nodes, return an error
-            if not save_image_nodes:
-                error_msg = "No SaveImage nodes found in workflow"
+            except Exception as e:
+                error_msg = f"Failed to execute ComfyUI workflow: {str(e)}"
                 logger.error(f"Error for run_id {run_id}: {error_msg}")
+                logger.debug(f"Detailed error: {traceback.format_exc()}")
                 return {
                     "status": "FAILED",
                     "error": error_msg
                 }
 
-            # Process each SaveImage node
-            for node in save_image_nodes:
-                file_prefix = node.get("inputs", {}).get("filename_prefix", "")
-                logger.info(f"Looking for images with prefix: {file_prefix} for run_id {run_id}")
-                
-                # Check if output directory exists
-                if not Path(output_dir).exists():
-                    error_msg = f"Output directory {output_dir} does not exist"
-                    logger.error(f"Error for run_id {run_id}: {error_msg}")
-                    return {
-                        "status": "FAILED",
-                        "error": error_msg
-                    }
-                
-                # Find all files with this prefix
-                found_images = False
-                for f in Path(output_dir).iterdir():
-                    if f.name.startswith(file_prefix):
-                        found_images = True
-                        logger.info(f"Found output image: {f.name} for run_id {run_id}")
-                        try:
-                            # Read the file and encode it as base64
-                            image_data = base64.b64encode(f.read_bytes()).decode("utf-8")
-                            images.append({
-                                "filename": f.name,
-                                "type": "base64",
-                                "data": image_data
-                            })
-                        except (IOError, OSError) as e:
-                            logger.warning(f"Failed to read image file {f.name} for run_id {run_id}: {str(e)}")
-                            logger.debug(f"Detailed error: {traceback.format_exc()}")
-                            # Continue with other images
-                
-                if not found_images:
-                    logger.warning(f"No images found with prefix {file_prefix} for run_id {run_id}")
-        
+        # Get the output images recorded for this prompt
+        try:
+            if not cached:
+                output_files = collect_output_files(execution, run_id)
+                if use_cache and output_files:
+                    result_cache.put(cache_key, output_files)
+            images = build_result_images(output_files, run_id, result_mode)
+            cleanup_outputs(run_id)
+
             # Check if we found any images
             if not images:
                 error_msg = "No output images found after workflow execution"
@@ -382,6 +506,7 @@ def execute_comfy_workflow_async(workflow_json: Dict) -> Dict:
         logger.info(f"Successfully completed workflow for run_id: {run_id} with {len(images)} images")
         return {
             "status": "COMPLETED",
+            "cached": cached,
             "output": {
                 "images": images
             }
@@ -398,38 +523,380 @@ def execute_comfy_workflow_async(workflow_json: Dict) -> Dict:
             "error": error_msg
         }
 
-# Define a class to handle ComfyUI operations
-@app.cls(
-    scaledown_window=5,  # 5 seconds container keep alive after it processes an input
-    cpu=8.0,  
-    volumes={CACHE_DIR: vol},
-    enable_memory_snapshot=True,  # Snapshot container state for faster cold starts
+# Pick the worker pool for a job, preferring containers that already hold its models
+def worker_for(workflow_json: Dict, avoid_pool: Optional[str] = None):
+    """Return the `ComfyUIWorker` of the pool a workflow should run on."""
+    signature = loader_signature(workflow_json)
+    try:
+        pool, reason = residency_board.choose_pool(signature, avoid_pool)
+    except Exception as e:
+        # Routing is an optimization, never a reason to fail a submission
+        logger.error(f"Failed to read worker residency: {str(e)}")
+        pool, reason = residency_board.hashed_pool(signature), "hashed"
+    logger.info(f"Routing models {signature} to worker {pool} ({reason})")
+    worker_cls = modal.Cls.from_name("comfyui-api", "ComfyUIWorker")
+    return worker_cls(pool=pool)
+
+# Spawn a workflow on a worker and return the call id
+def spawn_workflow(
+    workflow_json: Dict,
+    result_mode: str = "inline",
+    use_cache: bool = True,
+    inflight_key: Optional[str] = None,
+    job_id: Optional[str] = None,
+    avoid_pool: Optional[str] = None,
+) -> str:
+    """Spawn a workflow on `ComfyUIWorker` and return the call id.
+
+    New jobs are recorded so they can be requeued; `job_id` is set when an
+    existing job is run again, and `avoid_pool` when its pool was too busy.
+    """
+    logger.info("Spawning asynchronous workflow execution")
+    worker = worker_for(workflow_json, avoid_pool)
+    call = worker.execute_workflow.spawn(workflow_json, result_mode, use_cache, inflight_key, job_id)
+    if job_id is None:
+        job_tracker.record(call.object_id, {
+            "workflow_json": workflow_json,
+            "result_mode": result_mode,
+            "use_cache": use_cache,
+            "inflight_key": inflight_key,
+        })
+    return call.object_id
+
+# Run a job again on another container after the call running it was lost
+def requeue_workflow(job_id: str, lost_call_id: str, reason: str, avoid_pool: Optional[str] = None) -> Optional[str]:
+    """Spawn a lost job again. Returns the new call id, or None if it cannot be requeued."""
+    try:
+        return job_tracker.requeue(
+            job_id, lost_call_id, lambda spec: spawn_workflow(**spec, job_id=job_id, avoid_pool=avoid_pool), reason
+        )
+    except Exception as e:
+        logger.error(f"Failed to requeue job {job_id}: {str(e)}")
+        logger.debug(f"Detailed error: {traceback.format_exc()}")
+        return None
+
+# Spawn a chunk of batch items that share their models on one worker call
+def spawn_batch_chunk(workflows: List[Dict], result_mode: str = "inline", use_cache: bool = True) -> str:
+    """Spawn `ComfyUIWorker.execute_batch` and return the call id."""
+    logger.info(f"Spawning batch chunk of {len(workflows)} workflows")
+    # Items of a chunk share their models, so the first one decides the pool
+    call = worker_for(workflows[0]).execute_batch.spawn(workflows, result_mode, use_cache)
+    return call.object_id
+
+# Deliver a completion webhook from a CPU container, so retries never hold a GPU
+@app.function(timeout=600)
+def deliver_callback(url: str, payload: Dict) -> bool:
+    """POST a compact result to a callback URL, retrying with backoff."""
+    return post_with_retry(url, payload)
+
+# Fire the webhooks registered for a finished call
+def notify_callbacks(call_id: str, result: Dict):
+    """Spawn a delivery for every callback URL registered for a call id."""
+    try:
+        urls = callback_registry.take(call_id)
+        if not urls:
+            return
+        payload = compact_result(call_id, result)
+        deliver = modal.Function.from_name("comfyui-api", "deliver_callback")
+        for url in urls:
+            logger.info(f"Scheduling callback for call_id {call_id} to {url}")
+            deliver.spawn(url, payload)
+    except Exception as e:
+        # A webhook problem must never fail the workflow itself
+        logger.error(f"Failed to schedule callbacks for call_id {call_id}: {str(e)}")
+
+# Record the compact status of a finished job
+def publish_status(job_id: str, result: Dict):
+    """Store a job's status without inline image data, so bulk polls never download the images."""
+    try:
+        status_dict[job_id] = compact_result(job_id, result)
+    except Exception as e:
+        # Bulk polls fall back to the call result
+        logger.error(f"Failed to publish status of job {job_id}: {str(e)}")
+
+# Resolve the state of a spawned call
+async def resolve_call(function_call, call_id: str, timeout: float = 0, raise_lost: bool = False) -> Dict:
+    """Return the result of a call, or a RUNNING/FAILED state, waiting up to `timeout` seconds.
+
+    With `raise_lost`, calls that failed without returning a result raise ExecutionError.
+    """
+    try:
+        # Await the result without blocking the event loop of the web container
+        result = await function_call.get.aio(timeout=timeout)
+    except TimeoutError:
+        return {"id": call_id, "status": "RUNNING"}
+    except modal.exception.ExecutionError as e:
+        if raise_lost:
+            raise
+        # Function execution failed with an exception
+        logger.error(f"Function execution failed for call_id {call_id}: {str(e)}")
+        logger.debug(f"Detailed error: {traceback.format_exc()}")
+        return {"id": call_id, "status": "FAILED", "error": f"Execution error: {str(e)}"}
+    result["id"] = call_id
+    return result
+
+# Resolve the state of one item of a batch
+async def resolve_batch_item(batch_item_id: str, timeout: float = 0) -> Dict:
+    """Return the result or state of a batch item, waiting up to `timeout` seconds.
+
+    Items are published to `batch_dict` as soon as they finish, before the
+    chunk call that runs them returns. Raises ValueError for malformed ids.
+    """
+    call_id, index = parse_item_id(batch_item_id)
+    function_call = modal.functions.FunctionCall.from_id(call_id)
+    deadline = time.monotonic() + timeout
+    while True:
+        result = await batch_dict.get.aio(batch_item_id)
+        if result is not None:
+            return {**result, "id": batch_item_id}
+
+        remaining = max(0.0, deadline - time.monotonic())
+        chunk = await resolve_call(function_call, call_id, min(BATCH_POLL_INTERVAL, remaining))
+        if chunk["status"] == "FAILED":
+            return {"id": batch_item_id, "status": "FAILED", "error": chunk.get("error", "Unknown error")}
+        if chunk["status"] != "RUNNING":
+            items = chunk.get("items", [])
+            if index >= len(items):
+                raise ValueError(f"Invalid batch item id: {batch_item_id}")
+            return {**items[index], "id": batch_item_id}
+        if remaining <= 0:
+            return {"id": batch_item_id, "status": "RUNNING"}
+
+# Resolve the state of a job, following it across requeues
+async def resolve_job(job_id: str, timeout: float = 0) -> Dict:
+    """Return the result or state of a job, waiting up to `timeout` seconds.
+
+    Jobs whose call was lost are requeued here if their worker could not do
+    it, so the job id keeps resolving to the latest call.
+    """
+    entry = await job_dict.get.aio(job_id)
+    call_id = JobTracker.current_call(entry, job_id)
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = max(0.0, deadline - time.monotonic())
+        function_call = modal.functions.FunctionCall.from_id(call_id)
+        try:
+            result = await resolve_call(function_call, job_id, remaining, raise_lost=entry is not None)
+        except modal.exception.ExecutionError as e:
+            # The container running the call crashed or dropped its input
+            new_call_id = await asyncio.to_thread(requeue_workflow, job_id, call_id, f"call {call_id} failed: {str(e)}")
+            if new_call_id is None:
+                logger.error(f"Function execution failed for call_id {job_id}: {str(e)}")
+                return {"id": job_id, "status": "FAILED", "error": f"Execution error: {str(e)}"}
+            call_id = new_call_id
+            continue
+        if result["status"] != "REQUEUED":
+            return result
+        # The worker handed the job to another container
+        call_id = result["requeued_to"]
+
+# Embed the images of a batch item that was submitted with inline results
+def inline_batch_item(result: Dict) -> Dict:
+    """Replace the image references of an inline-mode batch item with base64 data from the results volume."""
+    result = dict(result)
+    if result.pop("result_mode", "reference") != "inline" or "output" not in result:
+        return result
+    images = []
+    for image in result["output"].get("images", []):
+        path = result_store.resolve(image["key"]) if image.get("type") == "ref" else None
+        if path is None:
+            images.append(image)
+            continue
+        images.append({"filename": image["filename"], "type": "base64", "data": base64.b64encode(path.read_bytes()).decode("utf-8")})
+    return {**result, "output": {**result["output"], "images": images}}
+
+# Resolve a call id or batch item id
+async def resolve_status(call_id: str, timeout: float = 0) -> Dict:
+    """Return the result or state of a job. Raises ValueError for malformed batch item ids."""
+    if ":" in call_id:
+        return await resolve_batch_item(call_id, timeout)
+    # Raises for malformed call ids
+    modal.functions.FunctionCall.from_id(call_id)
+    return await resolve_job(call_id, timeout)
+
+def validate_template(template: WorkflowTemplate):
+    """Check a template before it is published. Raises ValueError."""
+    if not find_save_nodes(template.workflow):
+        raise ValueError("Workflow has no SaveImage node")
+    missing = [
+        f"{subfolder}/{filename}"
+        for subfolder, filename in required_models(template.workflow)
+        if not (Path(COMFY_MODELS_DIR) / subfolder / filename).exists()
+    ]
+    if missing:
+        raise ValueError(f"Workflow loads models that are not installed: {', '.join(missing)}")
+    index = load_node_index(NODE_INDEX_PATH)
+    if index:
+        packs, unknown = required_packs(index, template.workflow)
+        if unknown:
+            raise ValueError(f"Workflow uses unknown node types: {', '.join(sorted(unknown))}")
+        # In lazy mode, packs no deployed workflow uses are disabled in every container
+        disabled = packs - enabled_packs(CUSTOM_NODES_DIR)
+        if disabled:
+            raise ValueError(f"Workflow uses custom node packs that are not loaded: {', '.join(sorted(disabled))}")
+
+def describe_template(template: WorkflowTemplate) -> Dict:
+    """Name, version and parameter types of a template."""
+    return {
+        "template": template.name,
+        "version": template.version,
+        "params": {name: type(param.default).__name__ for name, param in template.parameters.items()},
+    }
+
+# Serve cache hits from a CPU container so that they never start a GPU
+@app.function(
+    volumes={RESULT_CACHE_DIR: cache_vol, RESULTS_DIR: results_vol},
+    timeout=600,
 )
-@modal.concurrent(max_inputs=5)  # Run 5 inputs per container
-class ComfyUIAPI:
+def serve_cached_result(workflow_json: Dict, result_mode: str = "inline") -> Dict:
+    """Return the cached result of a workflow, running it on a worker if the entry is gone."""
+    run_id = str(uuid.uuid4())
+    output_files = result_cache.get(workflow_hash(workflow_json))
+    if output_files is None:
+        # The entry was evicted after submit_workflow saw it, run the workflow instead
+        logger.warning(f"Result cache entry vanished for run_id {run_id}, running workflow on a worker")
+        result = worker_for(workflow_json).execute_workflow.remote(workflow_json, result_mode)
+    else:
+        images = build_result_images(output_files, run_id, result_mode)
+        logger.info(f"Served cached result for run_id: {run_id} with {len(images)} images")
+        result = {
+            "status": "COMPLETED",
+            "cached": True,
+            "output": {
+                "images": images
+            }
+        }
+    publish_status(modal.current_function_call_id(), result)
+    notify_callbacks(modal.current_function_call_id(), result)
+    # Write the access time back only after the callbacks went out
+    result_cache.flush()
+    return result
+
+# Evict least recently used result cache entries off the request path
+@app.function(
+    volumes={RESULT_CACHE_DIR: cache_vol},
+    schedule=modal.Period(minutes=int(os.environ.get("RESULT_CACHE_EVICT_MINUTES", 30))),
+    timeout=600,
+)
+def evict_result_cache():
+    """Shrink the result cache to RESULT_CACHE_MAX_BYTES."""
+    cache_vol.reload()
+    evicted = result_cache.evict()
+    logger.info(f"Evicted {evicted} result cache entries")
+
+# Base class holding the ComfyUI server lifecycle shared by the web API and the workers
+class ComfyServer:
     port: int = 8000
+    # Stage the deployed models on local disk and preload their weights before the snapshot
+    warm_models: bool = True
+
+    def stage_deployed_models(self):
+        """Copy the models of the deployed workflows from the cache volume to local disk."""
+        self.staged_models = []
+        if self.warm_models:
+            self.staged_models = stage_from_env(required_models(*load_deployed_workflows().values()))
+
+    def select_custom_nodes(self):
+        """In lazy mode, disable the custom node packs no deployed workflow uses."""
+        mode = os.environ.get("CUSTOM_NODE_MODE", "all")
+        if mode not in CUSTOM_NODE_MODES:
+            logger.warning(f"Unknown CUSTOM_NODE_MODE {mode}, loading all custom nodes")
+            mode = "all"
+
+        index = load_node_index(NODE_INDEX_PATH) if mode == "lazy" else {}
+        if mode == "lazy" and not index:
+            logger.warning("No custom node index found, loading all custom nodes")
+        workflows = list(load_deployed_workflows().values())
+        packs, unknown = required_packs(index, *workflows)
+        if unknown:
+            logger.warning(f"Node types missing from the custom node index: {', '.join(sorted(unknown))}, loading all custom nodes")
+        if mode == "all" or not index or unknown:
+            # Also re-enables packs disabled by an earlier lazy start
+            packs = {path.name.removesuffix(".disabled") for path in Path(CUSTOM_NODES_DIR).iterdir() if path.is_dir()}
+        disabled = enable_only(packs, CUSTOM_NODES_DIR)
+        if disabled:
+            logger.info(f"Lazy custom nodes: loading {', '.join(sorted(packs))}, skipping {', '.join(disabled)}")
+
+    def report_node_imports(self):
+        """Log how long each custom node pack took to import and how much memory it added."""
+        profile = load_import_profile()
+        for entry in profile:
+            logger.info(f"Custom node {entry['pack']}: {entry['seconds']:.2f}s, {entry['rss_bytes'] / 1024 ** 2:.0f} MB")
+        self.timeline.mark(
+            "custom_node_imports",
+            seconds=round(sum(entry["seconds"] for entry in profile), 3),
+            packs={entry["pack"]: {"seconds": entry["seconds"], "rss_bytes": entry["rss_bytes"]} for entry in profile},
+        )
 
     @modal.enter(snap=True)
     def launch_comfy_background(self):
-        """Launch ComfyUI server in the background."""
+        """Stage the models, then launch ComfyUI server in the background."""
+        self.timeline = Timeline(type(self).__name__)
+        self.templates = load_deployed_templates(template_dict)
+        with self.timeline.span("stage_models"):
+            self.stage_deployed_models()
+        self.select_custom_nodes()
         try:
             logger.info(f"Launching ComfyUI server on port {self.port}")
             cmd = f"comfy launch --background -- --port {self.port}"
-            subprocess.run(cmd, shell=True, check=True)
+            with self.timeline.span("launch_comfy"):
+                subprocess.run(cmd, shell=True, check=True)
             logger.info("ComfyUI server launched successfully")
+            self.engine = ComfyEngine(port=self.port)
         except subprocess.SubprocessError as e:
             logger.error(f"Failed to launch ComfyUI server: {str(e)}")
             logger.debug(f"Detailed error: {traceback.format_exc()}")
             raise RuntimeError(f"ComfyUI server launch failed: {str(e)}")
+        self.report_node_imports()
+        if self.warm_models:
+            with self.timeline.span("preload_weights"):
+                self.preload_weights()
+        # The memory snapshot is captured right after this method returns
+        self.timeline.mark("snapshot_ready")
+
+    def preload_weights(self):
+        """Load the weights selected in DEPLOYED_WORKFLOWS into host RAM, so the snapshot captures them."""
+        import requests
+
+        paths = []
+        for workflow_file, workflow in load_deployed_workflows().items():
+            folders = DEPLOYED_WORKFLOWS[workflow_file]
+            for subfolder, filename in required_models(workflow):
+                path = f"{COMFY_MODELS_DIR}/{subfolder}/{filename}"
+                if subfolder in folders and path not in paths:
+                    paths.append(path)
+        if not paths:
+            return
+
+        try:
+            logger.info(f"Preloading {len(paths)} model files into host RAM")
+            response = requests.post(
+                f"http://127.0.0.1:{self.port}/snapshot/preload", json={"paths": paths}, timeout=1200
+            )
+            response.raise_for_status()
+            result = response.json()
+            logger.info(f"Preloaded {len(result['loaded'])} model files ({result['bytes']} bytes) in {result['seconds']:.1f}s")
+            for path, error in result["failed"].items():
+                logger.warning(f"Failed to preload {path}: {error}")
+        except requests.RequestException as e:
+            # The models are loaded from disk on first use instead
+            logger.error(f"Error preloading model weights: {str(e)}")
+            logger.debug(f"Detailed error: {traceback.format_exc()}")
 
     @modal.enter(snap=False)
     def restore_snapshot(self):
         """Initialize GPU for ComfyUI after snapshot restore."""
         import requests
+
+        self.timeline.restored()
+
+        # Fall back to the volume for staged copies the restored container does not have
+        verify_staged(self.staged_models)
         
         try:
             logger.info("Initializing GPU after snapshot restore")
-            response = requests.post(f"http://127.0.0.1:{self.port}/cuda/set_device")
+            with self.timeline.span("set_device"):
+                response = requests.post(f"http://127.0.0.1:{self.port}/cuda/set_device")
             
             if response.status_code != 200:
                 logger.error(f"Failed to set CUDA device: Status code {response.status_code}")
@@ -442,227 +909,277 @@ class ComfyUIAPI:
             # Don't raise here as we want to continue even if GPU init fails
             # The server health check will catch more serious issues
 
-    def poll_server_health(self) -> Dict:
-        """Check if the ComfyUI server is healthy."""
-        import socket
-        import urllib
+        self.start_health_monitor()
+        self.start_watchdog()
+        self.admission = AdmissionController(
+            max_queued_seconds=float(os.environ.get("ADMISSION_MAX_QUEUED_SECONDS", DEFAULT_MAX_QUEUED_SECONDS)),
+        )
+
+    def start_health_monitor(self):
+        """Poll the server in the background, draining the container once it stops answering."""
+        self.health = HealthMonitor(
+            self.port,
+            interval=float(os.environ.get("HEALTH_CHECK_INTERVAL", HEALTH_INTERVAL)),
+            on_unhealthy=self.drain,
+        )
+        self.health.start()
+
+    def start_watchdog(self):
+        """Recycle the server in place once its memory use has grown past the thresholds."""
+        self.watchdog = LeakWatchdog(
+            max_rss_growth=int(os.environ.get("SERVER_MAX_RSS_GROWTH_MB", DEFAULT_MAX_RSS_GROWTH // 1024 ** 2)) * 1024 ** 2,
+            max_vram_growth=int(os.environ.get("SERVER_MAX_VRAM_GROWTH_MB", DEFAULT_MAX_VRAM_GROWTH // 1024 ** 2)) * 1024 ** 2,
+            sustained_jobs=int(os.environ.get("SERVER_LEAK_JOBS", DEFAULT_SUSTAINED_JOBS)),
+        )
+        self.server_gate = ServerGate()
+
+    def check_for_leaks(self, generation: int, workflow: Dict):
+        """Sample the server's memory after a job, recycling it in the background if it leaked."""
+        pid = find_server_pid(self.port)
+        rss = process_rss(pid) if pid else None
+        state = self.health.check()
+        vram_used = None
+        if state.vram_total is not None and state.vram_free is not None:
+            vram_used = state.vram_total - state.vram_free
+        reason = self.watchdog.sample(rss, vram_used, required_models(workflow))
+        if reason:
+            # The job's result is returned without waiting for the restart
+            threading.Thread(target=self.recycle_server, args=(reason, generation), daemon=True).start()
+
+    def recycle_server(self, reason: str, generation: int):
+        """Restart the server once the running prompts are done, holding new ones meanwhile."""
+        import requests
+
+        def restart():
+            logger.warning(f"Recycling ComfyUI server: {reason}")
+            with self.timeline.span("recycle_server", reason=reason), self.health.paused():
+                subprocess.run("comfy stop", shell=True, check=True)
+                subprocess.run(f"comfy launch --background -- --port {self.port}", shell=True, check=True)
+                response = requests.post(f"http://127.0.0.1:{self.port}/cuda/set_device", timeout=30)
+                response.raise_for_status()
+            self.watchdog.reset()
+            logger.info("ComfyUI server recycled")
 
         try:
-            # Check if the server is up (response should be immediate)
-            req = urllib.request.Request(f"http://127.0.0.1:{self.port}/system_stats")
-            response = urllib.request.urlopen(req, timeout=5)
-            response_data = response.read().decode('utf-8')
-            logger.info("ComfyUI server is healthy")
-            logger.debug(f"Health check response: {response_data}")
-            return {"status": "healthy"}
-        except (socket.timeout, urllib.error.URLError) as e:
-            # If no response in 5 seconds, stop the container
-            logger.error(f"Server health check failed: {str(e)}")
+            self.server_gate.recycle(restart, generation)
+        except Exception as e:
+            # The health monitor drains the container if the server did not come back
+            logger.error(f"Failed to recycle ComfyUI server: {str(e)}")
             logger.debug(f"Detailed error: {traceback.format_exc()}")
-            modal.experimental.stop_fetching_inputs()
 
-            # All queued inputs will be marked "Failed"
-            raise RuntimeError(f"ComfyUI server is not healthy, stopping container: {str(e)}")
+    def drain(self, state: HealthState):
+        """Stop taking inputs, so new jobs go to healthy containers."""
+        logger.error(f"Draining container, ComfyUI server is unhealthy: {state.error}")
+        modal.experimental.stop_fetching_inputs()
 
-    @modal.method()
-    def run_workflow(self, workflow_json: Dict) -> Dict:
-        """Run a ComfyUI workflow and return the results."""
+    def execute(self, workflow_json: Dict, result_mode: str = "inline", use_cache: bool = True, admit: bool = True) -> Dict:
+        """Admit a workflow on this container, check the cached server health, then run the workflow.
+
+        Raises AdmissionRejected when `admit` is set and the workflow does not
+        fit on this container soon.
+        """
         # Generate a unique ID for this run
         run_id = str(uuid.uuid4())
-        workflow_path = f"/tmp/{run_id}.json"
         logger.info(f"Starting workflow execution for run_id: {run_id}")
-        
-        try:
-            # Validate workflow JSON
-            if not isinstance(workflow_json, dict) or not workflow_json:
-                error_msg = "Invalid workflow format: must be a non-empty JSON object"
-                logger.error(f"Error for run_id {run_id}: {error_msg}")
-                return {
-                    "status": "FAILED",
-                    "error": error_msg
-                }
-            
-            # Check server health
-            try:
-                health_result = self.poll_server_health()
-                logger.info(f"Server health check passed for run_id {run_id}: {health_result}")
-            except Exception as e:
-                error_msg = f"ComfyUI server is not healthy: {str(e)}"
-                logger.error(f"Server health check failed for run_id {run_id}: {str(e)}")
-                logger.debug(f"Detailed error: {traceback.format_exc()}")
-                return {
-                    "status": "FAILED",
-                    "error": error_msg
-                }
+        self.timeline.first_request()
 
-            # Save workflow to a temporary file
-            try:
-                with open(workflow_path, "w") as f:
-                    json.dump(workflow_json, f)
-                logger.info(f"Saved workflow to {workflow_path} for run_id {run_id}")
-            except (IOError, OSError) as e:
-                error_msg = f"Failed to save workflow to temporary file: {str(e)}"
-                logger.error(f"Error for run_id {run_id}: {error_msg}")
-                logger.debug(f"Detailed error: {traceback.format_exc()}")
+        cost = estimate_cost(workflow_json)
+        logger.info(f"Estimated cost of run_id {run_id}: {cost.describe()}")
+        admission = (
+            self.admission.admitted(cost, self.health, float(os.environ.get("ADMISSION_WAIT", DEFAULT_ADMISSION_WAIT)))
+            if admit
+            else nullcontext()
+        )
+
+        # Waits for room on this container, then while the server is being recycled
+        with admission, self.server_gate.job() as generation:
+            # Check the server health cached by the background monitor
+            health = self.health.state
+            if not health.healthy:
+                logger.error(f"Server health check failed for run_id {run_id}: {health.error}")
                 return {
                     "status": "FAILED",
-                    "error": error_msg
+                    "error": f"ComfyUI server is not healthy: {health.error}"
                 }
 
-            # Run the workflow
+            result = run_comfy_workflow(self.engine, workflow_json, run_id, result_mode, use_cache, self.timeline)
+
+        self.check_for_leaks(generation, workflow_json)
+        return result
+
+# Define a warm, snapshot-enabled worker class for asynchronous workflow execution
+@app.cls(
+    gpu="L4",
+    volumes={CACHE_DIR: vol, RESULTS_DIR: results_vol, RESULT_CACHE_DIR: cache_vol, INPUTS_DIR: inputs_vol},
+    timeout=600,  # 10 minutes timeout for long workflows
+    scaledown_window=60,  # Keep the server warm between asynchronous jobs
+    enable_memory_snapshot=True,  # Snapshot container state for faster cold starts
+)
+# Aim for 5 inputs per container but accept up to 10, admission control decides which ones run
+@modal.concurrent(max_inputs=10, target_inputs=5)
+class ComfyUIWorker(ComfyServer):
+    # Pool of containers this worker belongs to, see `worker_for`
+    pool: str = modal.parameter(default=pool_name(0))
+
+    @modal.enter(snap=False)
+    def start_advertising(self):
+        """Advertise the models this container holds and how busy it is, refreshed periodically."""
+        self.container_id = os.environ.get("MODAL_TASK_ID", str(uuid.uuid4()))
+        self.resident = ResidentSet()
+        self.active_jobs = 0
+        self.jobs_lock = threading.Lock()
+
+        def heartbeat():
+            while True:
+                self.advertise()
+                time.sleep(HEARTBEAT_INTERVAL)
+
+        threading.Thread(target=heartbeat, name="residency", daemon=True).start()
+
+    @modal.exit()
+    def stop_advertising(self):
+        residency_board.withdraw(self.container_id)
+        # Write back the access times of the cache hits this container served
+        result_cache.flush()
+
+    def advertise(self):
+        try:
+            residency_board.advertise(self.container_id, self.pool, self.resident.signatures, self.active_jobs)
+        except Exception as e:
+            logger.warning(f"Failed to advertise worker residency: {str(e)}")
+
+    @contextmanager
+    def running(self, workflow_json: Dict):
+        """Count a job as active, and its models as resident once it has run."""
+        with self.jobs_lock:
+            self.active_jobs += 1
+        self.advertise()
+        try:
+            yield
+            self.resident.touch(loader_signature(workflow_json))
+        finally:
+            with self.jobs_lock:
+                self.active_jobs -= 1
+            self.advertise()
+
+    @modal.method()
+    def execute_workflow(
+        self,
+        workflow_json: Dict,
+        result_mode: str = "inline",
+        use_cache: bool = True,
+        inflight_key: Optional[str] = None,
+        job_id: Optional[str] = None,
+    ) -> Dict:
+        """Run a ComfyUI workflow on this container's live server.
+
+        This is the target of `submit_workflow`, which spawns it asynchronously.
+        `inflight_key` is the single-flight key to release once the run is over.
+        `job_id` is the call id the client was given, when this call runs a
+        requeued job. Jobs that fail because the server is unhealthy, or that
+        do not fit on this container soon, are handed to another container.
+        """
+        call_id = modal.current_function_call_id()
+        job_id = job_id or call_id
+        requeued_to = None
+        try:
             try:
-                cmd = f"comfy run --workflow {workflow_path} --wait --timeout 1200 --verbose"
-                logger.info(f"Executing command for run_id {run_id}: {cmd}")
-                process = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
-                logger.info(f"Workflow execution completed for run_id: {run_id}")
-                logger.debug(f"Command output: {process.stdout}")
-            except subprocess.CalledProcessError as e:
-                error_msg = f"ComfyUI workflow execution failed with exit code {e.returncode}"
-                logger.error(f"Error for run_id {run_id}: {error_msg}")
-                logger.debug(f"Command output: {e.stdout}")
-                logger.debug(f"Command error: {e.stderr}")
-                logger.debug(f"Detailed error: {traceback.format_exc()}")
-                return {
-                    "status": "FAILED",
-                    "error": error_msg,
-                    "details": {
-                        "stdout": e.stdout,
-                        "stderr": e.stderr,
-                        "exit_code": e.returncode
-                    }
-                }
-            except Exception as e:
-                error_msg = f"Failed to execute ComfyUI workflow: {str(e)}"
-                logger.error(f"Error for run_id {run_id}: {error_msg}")
-                logger.debug(f"Detailed error: {traceback.format_exc()}")
-                return {
-                    "status": "FAILED",
-                    "error": error_msg
-                }
+                with self.running(workflow_json):
+                    result = self.execute(workflow_json, result_mode, use_cache)
+            except AdmissionRejected as e:
+                if e.permanent:
+                    logger.error(f"Rejected job {job_id}: {str(e)}")
+                    result = {"status": "FAILED", "error": str(e)}
+                else:
+                    requeued_to = requeue_workflow(job_id, call_id, str(e), avoid_pool=self.pool)
+                    if requeued_to is None:
+                        # Out of requeues, queue it on this server rather than failing it
+                        with self.running(workflow_json):
+                            result = self.execute(workflow_json, result_mode, use_cache, admit=False)
+            else:
+                if result["status"] == "FAILED" and not self.health.check().healthy:
+                    requeued_to = requeue_workflow(job_id, call_id, f"server unhealthy: {result.get('error')}")
+        finally:
+            if inflight_key and requeued_to is None:
+                single_flight.release(inflight_key, job_id)
+        if requeued_to:
+            # The new call notifies the callbacks once the job is done
+            return {"status": "REQUEUED", "requeued_to": requeued_to}
+        publish_status(job_id, result)
+        notify_callbacks(job_id, result)
+        return result
 
-            # Get output images
-            output_dir = "/root/comfy/ComfyUI/output"
-            images = []
+    @modal.method()
+    def execute_batch(self, workflows: List[Dict], result_mode: str = "inline", use_cache: bool = True) -> Dict:
+        """Run workflows that share their models back to back on this container.
 
-            # Look for any SaveImage nodes in the workflow
+        Images are always stored in the results volume, and only the compact
+        item results (status, error, image references) are published to
+        `batch_dict` as soon as they are ready and returned. `result_mode` is
+        recorded so that `get_status` can inline the images of inline batches.
+        """
+        call_id = modal.current_function_call_id()
+        results = []
+        for index, workflow_json in enumerate(workflows):
             try:
-                save_image_nodes = [
-                    node for node_id, node in workflow_json.items()
-                    if node.get("class_type") == "SaveImage"
-                ]
-
-                # If there are no SaveImage nodes, return an error
-                if not save_image_nodes:
-                    error_msg = "No SaveImage nodes found in workflow"
-                    logger.error(f"Error for run_id {run_id}: {error_msg}")
-                    return {
-                        "status": "FAILED",
-                        "error": error_msg
-                    }
-
-                # Process each SaveImage node
-                for node in save_image_nodes:
-                    file_prefix = node.get("inputs", {}).get("filename_prefix", "")
-                    logger.info(f"Looking for images with prefix: {file_prefix} for run_id {run_id}")
-                    
-                    # Check if output directory exists
-                    if not Path(output_dir).exists():
-                        error_msg = f"Output directory {output_dir} does not exist"
-                        logger.error(f"Error for run_id {run_id}: {error_msg}")
-                        return {
-                            "status": "FAILED",
-                            "error": error_msg
-                        }
-                    
-                    # Find all files with this prefix
-                    found_images = False
-                    for f in Path(output_dir).iterdir():
-                        if f.name.startswith(file_prefix):
-                            found_images = True
-                            logger.info(f"Found output image: {f.name} for run_id {run_id}")
-                            try:
-                                # Read the file and encode it as base64
-                                image_data = base64.b64encode(f.read_bytes()).decode("utf-8")
-                                images.append({
-                                    "filename": f.name,
-                                    "type": "base64",
-                                    "data": image_data
-                                })
-                            except (IOError, OSError) as e:
-                                logger.warning(f"Failed to read image file {f.name} for run_id {run_id}: {str(e)}")
-                                logger.debug(f"Detailed error: {traceback.format_exc()}")
-                                # Continue with other images
-                    
-                    if not found_images:
-                        logger.warning(f"No images found with prefix {file_prefix} for run_id {run_id}")
-            
-                # Check if we found any images
-                if not images:
-                    error_msg = "No output images found after workflow execution"
-                    logger.error(f"Error for run_id {run_id}: {error_msg}")
-                    return {
-                        "status": "FAILED",
-                        "error": error_msg
-                    }
+                with self.running(workflow_json):
+                    try:
+                        result = self.execute(workflow_json, "reference", use_cache)
+                    except AdmissionRejected as e:
+                        if e.permanent:
+                            raise
+                        # The chunk runs its items one at a time, so the item waits its turn here
+                        result = self.execute(workflow_json, "reference", use_cache, admit=False)
             except Exception as e:
-                error_msg = f"Error processing output images: {str(e)}"
-                logger.error(f"Error for run_id {run_id}: {error_msg}")
+                # One failing item must not fail the rest of the chunk
+                logger.error(f"Batch item {index} of call {call_id} failed: {str(e)}")
                 logger.debug(f"Detailed error: {traceback.format_exc()}")
-                return {
-                    "status": "FAILED",
-                    "error": error_msg
-                }
+                result = {"status": "FAILED", "error": str(e)}
+            record = {key: value for key, value in compact_result(item_id(call_id, index), result).items() if key != "id"}
+            record["result_mode"] = result_mode
+            batch_dict[item_id(call_id, index)] = record
+            results.append(record)
+        return {"status": "COMPLETED", "items": results}
 
-            # Return the results
-            logger.info(f"Successfully completed workflow for run_id: {run_id} with {len(images)} images")
-            return {
-                "status": "COMPLETED",
-                "output": {
-                    "images": images
-                }
-            }
-        except Exception as e:
-            # Log the error for any uncaught exceptions
-            error_msg = f"Unexpected error during workflow execution: {str(e)}"
-            logger.error(f"Error for run_id {run_id}: {error_msg}")
-            logger.debug(f"Detailed error: {traceback.format_exc()}")
-            
-            # Return error information
-            return {
-                "status": "FAILED",
-                "error": error_msg
-            }
+# Define a class to handle ComfyUI operations
+@app.cls(
+    scaledown_window=5,  # 5 seconds container keep alive after it processes an input
+    cpu=8.0,  
+    volumes={CACHE_DIR: vol, RESULTS_DIR: results_vol, RESULT_CACHE_DIR: cache_vol, INPUTS_DIR: inputs_vol},
+    enable_memory_snapshot=True,  # Snapshot container state for faster cold starts
+)
+@modal.concurrent(max_inputs=5)  # Run 5 inputs per container
+class ComfyUIAPI(ComfyServer):
+    # The web API serves requests on CPU and hands workflows to the workers
+    warm_models = False
 
-    # @modal.fastapi_endpoint(method="GET")
-    # async def health_check(self) -> Dict:
-    #     """API endpoint to check if the service is healthy."""
-    #     logger.info("Health check requested")
-        
-    #     try:
-    #         # Check ComfyUI server health
-    #         comfy_health = self.poll_server_health()
-            
-    #         # Return detailed health information
-    #         return {
-    #             "status": "healthy",
-    #             "message": "ComfyUI API is running",
-    #             "comfyui_server": comfy_health,
-    #             "timestamp": str(logging.Formatter().converter())
-    #         }
-    #     except Exception as e:
-    #         logger.error(f"Health check failed: {str(e)}")
-    #         logger.debug(f"Detailed error: {traceback.format_exc()}")
-            
-    #         # Still return a response, but indicate the service is unhealthy
-    #         return {
-    #             "status": "unhealthy",
-    #             "message": f"ComfyUI API is running but ComfyUI server is unhealthy: {str(e)}",
-    #             "timestamp": str(logging.Formatter().converter())
-    #         }
+    @modal.method()
+    def run_workflow(self, workflow_json: Dict, result_mode: str = "inline", use_cache: bool = True) -> Dict:
+        """Run a ComfyUI workflow and return the results."""
+        try:
+            return self.execute(workflow_json, result_mode, use_cache)
+        except AdmissionRejected as e:
+            logger.error(f"Rejected workflow: {str(e)}")
+            return {"status": "FAILED", "error": str(e)}
+
+    @modal.fastapi_endpoint(method="GET")
+    async def health_check(self) -> Dict:
+        """API endpoint to check if the service is healthy, from the cached server health."""
+        health = self.health.state
+        return {
+            "status": "healthy" if health.healthy else "unhealthy",
+            "message": "ComfyUI API is running" if health.healthy else f"ComfyUI server is unhealthy: {health.error}",
+            "comfyui_server": health.to_dict(),
+        }
 
     @modal.fastapi_endpoint(method="POST")
-    async def submit_workflow(self, request_data: Dict) -> Dict:
-        """API endpoint to submit a workflow."""
+    async def submit_workflow(self, request_data: Dict, request: "Request") -> Dict:
+        """API endpoint to submit a workflow.
+
+        Clients may send an `Idempotency-Key` header (or `idempotency_key` field);
+        retries with the same key return the original call id. An optional
+        `callback_url` is POSTed a compact result when the job finishes.
+        """
         from fastapi import HTTPException
         
         try:
@@ -670,6 +1187,12 @@ class ComfyUIAPI:
             if not request_data:
                 logger.error("Empty request body")
                 raise HTTPException(status_code=400, detail="Request body cannot be empty")
+
+            workflow_key = None
+            if "template" in request_data:
+                # Template versions are validated and canonicalized once, so only the bound values are hashed here
+                workflow, workflow_key = await asyncio.to_thread(self.bind_template, request_data)
+                request_data = {**request_data, "workflow": workflow}
                 
             if "workflow" not in request_data:
                 logger.error("Missing workflow in request body")
@@ -681,27 +1204,91 @@ class ComfyUIAPI:
                 logger.error("Invalid workflow format: must be a non-empty JSON object")
                 raise HTTPException(status_code=400, detail="Invalid workflow format: must be a non-empty JSON object")
             
+            if workflow_key is None:
+                # Embedded base64 images go to the input store, so only their keys travel with the job
+                try:
+                    workflow = await asyncio.to_thread(input_store.ingest, workflow)
+                except ValueError as e:
+                    logger.error(f"Invalid input image: {str(e)}")
+                    raise HTTPException(status_code=400, detail=f"Invalid input image: {str(e)}")
+
             # Check for SaveImage nodes
-            save_image_nodes = [
-                node for node_id, node in workflow.items()
-                if node.get("class_type") == "SaveImage"
-            ]
-            
-            if not save_image_nodes:
+            if not find_save_nodes(workflow):
                 logger.warning("No SaveImage nodes found in workflow. Output may be empty.")
+
+            # Validate how the results should be delivered
+            result_mode = request_data.get("result_mode", "inline")
+            if result_mode not in RESULT_MODES:
+                logger.error(f"Invalid result_mode: {result_mode}")
+                raise HTTPException(status_code=400, detail=f"Invalid result_mode: must be one of {', '.join(RESULT_MODES)}")
             
-            # Get a reference to the standalone function and spawn it
-            logger.info("Spawning asynchronous workflow execution")
-            execute_comfy_workflow_async = modal.Function.from_name("comfyui-api", "execute_comfy_workflow_async")
-            call = execute_comfy_workflow_async.spawn(workflow)
-            call_id = call.object_id
-            logger.info(f"Generated call_id: {call_id} for new workflow submission")
+            # Validate the idempotency key, if any
+            idempotency_key = request.headers.get("idempotency-key") or request_data.get("idempotency_key")
+            if idempotency_key is not None and (not isinstance(idempotency_key, str) or not 0 < len(idempotency_key) <= 255):
+                logger.error(f"Invalid idempotency key: {idempotency_key}")
+                raise HTTPException(status_code=400, detail="Invalid idempotency key: must be a string of 1 to 255 characters")
+
+            # Validate the completion webhook, if any
+            callback_url = request_data.get("callback_url")
+            if callback_url is not None and not await asyncio.to_thread(validate_callback_url, callback_url):
+                logger.error(f"Invalid callback_url: {callback_url}")
+                raise HTTPException(status_code=400, detail="Invalid callback_url: must be an absolute http(s) URL of a public host")
+
+            use_cache = bool(request_data.get("cache", True))
+            workflow_key = workflow_key or workflow_hash(workflow)
+            deduplicated = False
+
+            # Blocking calls (volume reads, job records, spawns) run in threads to keep the event loop free
+            async def dispatch() -> str:
+                nonlocal deduplicated
+                # Identical workflows that already ran are served from the result cache without a GPU
+                if use_cache and await asyncio.to_thread(result_cache.contains, workflow_key):
+                    logger.info("Result cache hit, serving cached result")
+                    serve_cached_result = modal.Function.from_name("comfyui-api", "serve_cached_result")
+                    return (await serve_cached_result.spawn.aio(workflow, result_mode)).object_id
+                if use_cache:
+                    # Identical submissions still in flight attach to the running call instead of spawning another
+                    inflight_key = f"{workflow_key}:{result_mode}"
+                    call_id, deduplicated = await single_flight.submit(
+                        inflight_key,
+                        lambda: asyncio.to_thread(spawn_workflow, workflow, result_mode, use_cache, inflight_key),
+                    )
+                    return call_id
+                return await asyncio.to_thread(spawn_workflow, workflow, result_mode, use_cache)
+
+            replayed = False
+            if idempotency_key:
+                # Retries within the TTL window get the original call id back
+                try:
+                    call_id, replayed = await idempotency_keys.submit(
+                        idempotency_key, dispatch, fingerprint=f"{workflow_key}:{result_mode}:{use_cache}"
+                    )
+                except KeyConflictError:
+                    logger.error(f"Idempotency key reused for a different request: {idempotency_key}")
+                    raise HTTPException(status_code=422, detail="Idempotency key was already used for a different request")
+            else:
+                call_id = await dispatch()
+
+            if replayed:
+                logger.info(f"Replayed call_id: {call_id} for idempotency key {idempotency_key}")
+            elif deduplicated:
+                logger.info(f"Attached submission to in-flight call_id: {call_id}")
+            else:
+                logger.info(f"Generated call_id: {call_id} for new workflow submission")
+
+            if callback_url:
+                await asyncio.to_thread(self.register_callback, call_id, callback_url)
             
             # Return the call ID immediately
-            return {
+            response = {
                 "id": call_id,
                 "status": "RUNNING"
             }
+            if deduplicated:
+                response["deduplicated"] = True
+            if replayed:
+                response["replayed"] = True
+            return response
         except HTTPException:
             # Re-raise FastAPI exceptions
             raise
@@ -711,9 +1298,240 @@ class ComfyUIAPI:
             logger.debug(f"Detailed error: {traceback.format_exc()}")
             raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+    def bind_template(self, request_data: Dict) -> Tuple[Dict, str]:
+        """Build the workflow of a `{"template", "version", "params", "image_ref"}` request and its hash.
+
+        `image_ref` is the key of an uploaded input image or of a stored result
+        (see `result_mode`), passed to the template's `image` parameter.
+        Raises HTTPException for bad input.
+        """
+        from fastapi import HTTPException
+
+        name = request_data["template"]
+        version = request_data.get("version")
+        params = request_data.get("params", {})
+        if version is not None and (not isinstance(version, int) or isinstance(version, bool) or version < 1):
+            logger.error(f"Invalid template version: {version}")
+            raise HTTPException(status_code=400, detail="Invalid version: must be a positive integer")
+        if not isinstance(params, dict):
+            logger.error("Invalid template params: must be a JSON object")
+            raise HTTPException(status_code=400, detail="Invalid params: must be a JSON object")
+        try:
+            template = self.templates.get(name, version) if isinstance(name, str) else None
+        except KeyError:
+            template = None
+        if template is None:
+            logger.error(f"Unknown template: {name} version {version or 'latest'}")
+            raise HTTPException(status_code=400, detail=f"Unknown template: {name} version {version or 'latest'}")
+
+        image_ref = request_data.get("image_ref")
+        if image_ref is not None:
+            if "image" not in template.parameters or "image" in params:
+                logger.error(f"Invalid image_ref for template {name}")
+                raise HTTPException(status_code=400, detail="Invalid image_ref: the template must have an image parameter not set in params")
+            if input_store.resolve(image_ref) is not None:
+                params = {**params, "image": image_ref}
+            else:
+                # A stored result, e.g. of an earlier job in a chain, is copied into the input store
+                path = result_store.resolve(image_ref) if isinstance(image_ref, str) else None
+                if path is None:
+                    logger.error(f"Unknown image_ref: {image_ref}")
+                    raise HTTPException(status_code=400, detail="Unknown image_ref")
+                params = {**params, "image": input_store.put(path.read_bytes())[0]}
+
+        try:
+            # Base64 images sent as parameters go to the input store, so only their keys are bound
+            base64_paths = base64_image_paths(template.workflow)
+            for param, value in list(params.items()):
+                binding = template.parameters.get(param)
+                if binding and set(binding.paths) & base64_paths and isinstance(value, str) and value and not is_input_key(value):
+                    params = {**params, param: input_store.put_base64(value)}
+            return template.bind_keyed(params)
+        except ValueError as e:
+            logger.error(f"Invalid params for template {name}: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Invalid params: {str(e)}")
+
+    @modal.fastapi_endpoint(method="POST")
+    async def upload_image(self, request: "Request") -> Dict:
+        """API endpoint to upload an input image as the raw request body.
+
+        Images are stored once under the hash of their bytes; the returned
+        `image_ref` can be passed to templates or used as the `image` of an
+        `ETN_LoadImageBase64` node instead of base64 data.
+        """
+        from fastapi import HTTPException
+
+        too_large = HTTPException(status_code=413, detail=f"Input image is larger than {MAX_INPUT_BYTES // 1024 ** 2} MB")
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_INPUT_BYTES:
+            logger.error(f"Input image too large: {content_length} bytes")
+            raise too_large
+        # Chunked uploads have no length header, stop reading them at the limit
+        body = bytearray()
+        async for chunk in request.stream():
+            body.extend(chunk)
+            if len(body) > MAX_INPUT_BYTES:
+                logger.error(f"Input image too large: more than {MAX_INPUT_BYTES} bytes")
+                raise too_large
+        data = bytes(body)
+        try:
+            key, stored = await asyncio.to_thread(input_store.put, data)
+        except ValueError as e:
+            logger.error(f"Invalid input image upload: {str(e)}")
+            raise HTTPException(status_code=400, detail=str(e))
+        logger.info(f"Uploaded input image {key} ({len(data)} bytes, {'new' if stored else 'already stored'})")
+        return {"image_ref": key, "size": len(data), "deduplicated": not stored}
+
+    @modal.fastapi_endpoint(method="POST")
+    async def register_template(self, request_data: Dict) -> Dict:
+        """API endpoint to publish a workflow as a named, versioned template.
+
+        The body is `{"name", "workflow", "params": {parameter: "<node id>.<input>"}, "version"?}`.
+        Versions are immutable: re-publishing the same contents is a no-op,
+        other contents under an existing version return 409.
+        """
+        from fastapi import HTTPException
+
+        name = request_data.get("name")
+        workflow = request_data.get("workflow")
+        bindings = request_data.get("params", {})
+        version = request_data.get("version")
+        if not isinstance(name, str) or not TEMPLATE_NAME_PATTERN.match(name):
+            logger.error(f"Invalid template name: {name}")
+            raise HTTPException(status_code=400, detail="Invalid name: must be 1 to 64 letters, digits, '-' or '_'")
+        if not isinstance(workflow, dict) or not workflow:
+            logger.error("Invalid workflow format: must be a non-empty JSON object")
+            raise HTTPException(status_code=400, detail="Invalid workflow format: must be a non-empty JSON object")
+        if not isinstance(bindings, dict) or not all(
+            isinstance(paths, str) or (isinstance(paths, list) and paths and all(isinstance(p, str) for p in paths))
+            for paths in bindings.values()
+        ):
+            logger.error("Invalid template params: must map names to node input paths")
+            raise HTTPException(status_code=400, detail='Invalid params: must map names to "<node id>.<input>" paths')
+        if version is not None and (not isinstance(version, int) or isinstance(version, bool) or version < 1):
+            logger.error(f"Invalid template version: {version}")
+            raise HTTPException(status_code=400, detail="Invalid version: must be a positive integer")
+
+        try:
+            # The registry makes blocking Dict calls
+            template = await asyncio.to_thread(self.templates.publish, name, workflow, bindings, version, validate=validate_template)
+        except TemplateConflictError as e:
+            logger.error(str(e))
+            raise HTTPException(status_code=409, detail=str(e))
+        except ValueError as e:
+            logger.error(f"Invalid template {name}: {str(e)}")
+            raise HTTPException(status_code=400, detail=f"Invalid template: {str(e)}")
+
+        logger.info(f"Published template {name} version {template.version}")
+        return describe_template(template)
+
     @modal.fastapi_endpoint(method="GET")
-    async def get_status(self, call_id: str) -> Dict:
-        """API endpoint to get the status of a job."""
+    async def list_templates(self) -> Dict:
+        """API endpoint to list the latest version of every template and its parameters."""
+        return {"templates": await asyncio.to_thread(self.describe_templates)}
+
+    def describe_templates(self) -> List[Dict]:
+        return [describe_template(self.templates.get(name, version)) for name, version in self.templates.catalog().items()]
+
+    def register_callback(self, call_id: str, callback_url: str):
+        """Register a webhook for a call, firing it right away if the call already finished."""
+        callback_registry.register(call_id, callback_url)
+        # Deduplicated and replayed submissions may point at a job that is already done
+        entry = job_dict.get(call_id)
+        current_call_id = JobTracker.current_call(entry, call_id)
+        try:
+            result = modal.functions.FunctionCall.from_id(current_call_id).get(timeout=0)
+        except TimeoutError:
+            return
+        except modal.exception.ExecutionError as e:
+            if entry is not None and requeue_workflow(call_id, current_call_id, f"call {current_call_id} failed: {str(e)}"):
+                return
+            result = {"status": "FAILED", "error": f"Execution error: {str(e)}"}
+        if result.get("status") == "REQUEUED":
+            return
+        notify_callbacks(call_id, result)
+
+    @modal.fastapi_endpoint(method="POST")
+    async def submit_batch(self, request_data: Dict) -> Dict:
+        """API endpoint to submit many workflows, or many inputs for one workflow.
+
+        Items whose loader nodes load the same models are dispatched together,
+        in chunks that each run back to back on one warm worker.
+        """
+        from fastapi import HTTPException
+
+        try:
+            request_data = request_data or {}
+            if "workflows" in request_data:
+                workflows = request_data["workflows"]
+                if not isinstance(workflows, list) or not all(isinstance(w, dict) and w for w in workflows):
+                    logger.error("Invalid workflows in batch request")
+                    raise HTTPException(status_code=400, detail="workflows must be a list of non-empty JSON objects")
+            elif "workflow" in request_data and "inputs" in request_data:
+                # One workflow with per-item node input overrides
+                workflow = request_data["workflow"]
+                inputs = request_data["inputs"]
+                if not isinstance(workflow, dict) or not workflow or not isinstance(inputs, list):
+                    logger.error("Invalid workflow or inputs in batch request")
+                    raise HTTPException(status_code=400, detail="workflow must be a non-empty JSON object and inputs a list")
+                try:
+                    workflows = [apply_inputs(workflow, overrides) for overrides in inputs]
+                except ValueError as e:
+                    logger.error(f"Invalid batch inputs: {str(e)}")
+                    raise HTTPException(status_code=400, detail=str(e))
+            else:
+                logger.error("Missing workflows in batch request")
+                raise HTTPException(status_code=400, detail="Request body must contain workflows, or workflow and inputs")
+
+            if not workflows or len(workflows) > MAX_BATCH_ITEMS:
+                logger.error(f"Invalid batch size: {len(workflows)}")
+                raise HTTPException(status_code=400, detail=f"A batch must contain 1 to {MAX_BATCH_ITEMS} items")
+
+            # Embedded base64 images go to the input store, so only their keys travel with the jobs
+            try:
+                workflows = [await asyncio.to_thread(input_store.ingest, workflow) for workflow in workflows]
+            except ValueError as e:
+                logger.error(f"Invalid input image in batch: {str(e)}")
+                raise HTTPException(status_code=400, detail=f"Invalid input image: {str(e)}")
+
+            result_mode = request_data.get("result_mode", "inline")
+            if result_mode not in RESULT_MODES:
+                logger.error(f"Invalid result_mode: {result_mode}")
+                raise HTTPException(status_code=400, detail=f"Invalid result_mode: must be one of {', '.join(RESULT_MODES)}")
+            use_cache = bool(request_data.get("cache", True))
+
+            # Dispatch the chunks of each model group one after the other
+            chunks = plan_batch(workflows, BATCH_CHUNK_SIZE)
+            items: List[Optional[Dict]] = [None] * len(workflows)
+            for signature, indexes in chunks:
+                call_id = await asyncio.to_thread(spawn_batch_chunk, [workflows[i] for i in indexes], result_mode, use_cache)
+                for position, index in enumerate(indexes):
+                    items[index] = {"index": index, "id": item_id(call_id, position), "group": signature}
+
+            batch_id = str(uuid.uuid4())
+            await batch_dict.put.aio(f"batch:{batch_id}", [item["id"] for item in items])
+            logger.info(f"Submitted batch {batch_id} with {len(workflows)} items in {len(chunks)} chunks")
+            return {
+                "batch_id": batch_id,
+                "status": "RUNNING",
+                "items": items
+            }
+        except HTTPException:
+            # Re-raise FastAPI exceptions
+            raise
+        except Exception as e:
+            # Log unexpected errors
+            logger.error(f"Unexpected error in submit_batch: {str(e)}")
+            logger.debug(f"Detailed error: {traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    @modal.fastapi_endpoint(method="GET")
+    async def get_status(self, call_id: str, wait: float = 0) -> Dict:
+        """API endpoint to get the status of a job.
+
+        With `wait`, the request is held open for up to that many seconds
+        (capped at MAX_STATUS_WAIT) until the job finishes.
+        """
         from fastapi import HTTPException
         
         logger.info(f"Received status request for call_id: {call_id}")
@@ -721,49 +1539,44 @@ class ComfyUIAPI:
         if not call_id or not isinstance(call_id, str):
             logger.error(f"Invalid call_id format: {call_id}")
             raise HTTPException(status_code=400, detail="Invalid call_id format")
+
+        if wait < 0:
+            logger.error(f"Invalid wait: {wait}")
+            raise HTTPException(status_code=400, detail="Invalid wait: must not be negative")
+        wait = min(wait, MAX_STATUS_WAIT)
         
         try:
-            # Create a FunctionCall object from the call_id
-            try:
-                function_call = modal.functions.FunctionCall.from_id(call_id)
-            except ValueError as e:
-                logger.error(f"Invalid call_id format: {call_id}, error: {str(e)}")
-                raise HTTPException(status_code=400, detail=f"Invalid call_id format: {str(e)}")
-            except Exception as e:
-                logger.error(f"Error creating FunctionCall from call_id {call_id}: {str(e)}")
-                logger.debug(f"Detailed error: {traceback.format_exc()}")
-                raise HTTPException(status_code=404, detail=f"Call ID not found or invalid: {str(e)}")
-            
-            # Try to get the result with a timeout of 0 (non-blocking)
-            try:
-                result = function_call.get(timeout=0)
-                # If we get here, the function has completed
-                logger.info(f"Function completed for call_id: {call_id}")
-                
-                # Add the call_id to the result
-                result["id"] = call_id
-                
-                # Log error details if status is FAILED
-                if result.get("status") == "FAILED":
-                    logger.error(f"Workflow execution failed for call_id {call_id}: {result.get('error', 'Unknown error')}")
-                
-                return result
-            except TimeoutError:
-                # Function is still running
+            if ":" in call_id:
+                # Batch items are resolved through the chunk call that runs them
+                try:
+                    result = await resolve_batch_item(call_id, wait)
+                    # Workers store batch images as references, inline batches get them embedded here
+                    result = await asyncio.to_thread(inline_batch_item, result)
+                except ValueError as e:
+                    logger.error(f"Invalid batch item id: {call_id}, error: {str(e)}")
+                    raise HTTPException(status_code=400, detail=f"Invalid call_id format: {str(e)}")
+            else:
+                # Create a FunctionCall object from the call_id
+                try:
+                    function_call = modal.functions.FunctionCall.from_id(call_id)
+                except ValueError as e:
+                    logger.error(f"Invalid call_id format: {call_id}, error: {str(e)}")
+                    raise HTTPException(status_code=400, detail=f"Invalid call_id format: {str(e)}")
+                except Exception as e:
+                    logger.error(f"Error creating FunctionCall from call_id {call_id}: {str(e)}")
+                    logger.debug(f"Detailed error: {traceback.format_exc()}")
+                    raise HTTPException(status_code=404, detail=f"Call ID not found or invalid: {str(e)}")
+
+                # Try to get the result, waiting up to `wait` seconds and following requeues
+                result = await resolve_job(call_id, wait)
+            if result["status"] == "RUNNING":
                 logger.info(f"Function still running for call_id: {call_id}")
-                return {
-                    "id": call_id,
-                    "status": "RUNNING"
-                }
-            except modal.exception.ExecutionError as e:
-                # Function execution failed with an exception
-                logger.error(f"Function execution failed for call_id {call_id}: {str(e)}")
-                logger.debug(f"Detailed error: {traceback.format_exc()}")
-                return {
-                    "id": call_id,
-                    "status": "FAILED",
-                    "error": f"Execution error: {str(e)}"
-                }
+            elif result["status"] == "FAILED":
+                # Log error details if status is FAILED
+                logger.error(f"Workflow execution failed for call_id {call_id}: {result.get('error', 'Unknown error')}")
+            else:
+                logger.info(f"Function completed for call_id: {call_id}")
+            return result
         except HTTPException:
             # Re-raise FastAPI exceptions
             raise
@@ -772,3 +1585,56 @@ class ComfyUIAPI:
             logger.error(f"Error retrieving function call for call_id {call_id}: {str(e)}")
             logger.debug(f"Detailed error: {traceback.format_exc()}")
             raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    @modal.fastapi_endpoint(method="POST")
+    async def get_status_bulk(self, request_data: Dict) -> Dict:
+        """API endpoint to get the compact status of many jobs at once.
+
+        Takes `call_ids` or the `batch_id` of a `submit_batch` request. Results
+        are returned without inline image data; use `get_status` or
+        `download_result` to fetch the images of a finished job.
+        """
+        from fastapi import HTTPException
+
+        request_data = request_data or {}
+        call_ids = request_data.get("call_ids")
+        if call_ids is None and "batch_id" in request_data:
+            call_ids = await batch_dict.get.aio(f"batch:{request_data['batch_id']}")
+            if call_ids is None:
+                logger.error(f"Unknown batch_id: {request_data['batch_id']}")
+                raise HTTPException(status_code=404, detail="Batch not found")
+        if not isinstance(call_ids, list) or not call_ids or not all(isinstance(c, str) and c for c in call_ids):
+            logger.error("Invalid call_ids in bulk status request")
+            raise HTTPException(status_code=400, detail="call_ids must be a non-empty list of strings")
+        if len(call_ids) > MAX_BULK_IDS:
+            logger.error(f"Too many call_ids in bulk status request: {len(call_ids)}")
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_IDS} call_ids per request")
+
+        logger.info(f"Received bulk status request for {len(call_ids)} call_ids")
+        semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+        async def status_of(call_id: str) -> Dict:
+            async with semaphore:
+                try:
+                    if ":" not in call_id:
+                        # Finished jobs publish a compact status, read it instead of downloading the result
+                        status = await status_dict.get.aio(call_id)
+                        if status is not None:
+                            return status
+                    # Without a record the job is still running or was lost, neither returns images
+                    return compact_result(call_id, await resolve_status(call_id))
+                except Exception as e:
+                    logger.error(f"Error retrieving function call for call_id {call_id}: {str(e)}")
+                    return {"id": call_id, "status": "NOT_FOUND", "error": str(e)}
+
+        # Duplicate ids are resolved once
+        unique_ids = list(dict.fromkeys(call_ids))
+        statuses = await asyncio.gather(*(status_of(call_id) for call_id in unique_ids))
+        by_id = dict(zip(unique_ids, statuses))
+        return {"statuses": [by_id[call_id] for call_id in call_ids]}
+
+    @modal.fastapi_endpoint(method="GET")
+    def download_result(self, key: str, request: "Request"):
+        """API endpoint to stream a stored result file, with HTTP Range support."""
+        logger.info(f"Received download request for key: {key}")
+        return download_response(result_store, key, request.headers.get("range"))
@@ -5,7 +5,6 @@ This module implements a serverless API for ComfyUI using Modal.com.
 It allows users to submit ComfyUI workflows dynamically and retrieve results via polling.
 """
 
-import json
 import subprocess
 import uuid
 import os
@@ -17,6 +16,9 @@ from typing import Dict, List, Tuple, Optional
 
 import modal
 
+from comfy_runtime import ComfyEngine, ComfyExecutionError
+from comfy_runtime.outputs import cleanup_outputs, collect_output_files, find_save_nodes, isolate_outputs
+
 # Define the Modal Image
 image = (
     modal.Image.debian_slim(
@@ -165,6 +167,9 @@ image = (
     )
 )
 
+# Install the websocket client used to follow prompt progress in-process
+image = image.pip_install("websocket-client")
+
 # Add memory snapshot helper for faster cold starts
 image = image.add_local_dir(
     local_path=Path(__file__).parent / "memory_snapshot_helper",
@@ -172,6 +177,9 @@ image = image.add_local_dir(
     copy=True,
 )
 
+# Add the shared runtime package (execution engine and helpers)
+image = image.add_local_python_source("comfy_runtime")
+
 # Configure logging with more detailed format
 logging.basicConfig(
     level=logging.INFO,
@@ -201,6 +209,7 @@ class ComfyUIAPI:
             cmd = f"comfy launch --background -- --port {self.port}"
             subprocess.run(cmd, shell=True, check=True)
             logger.info("ComfyUI server launched successfully")
+            self.engine = ComfyEngine(port=self.port)
         except subprocess.SubprocessError as e:
             logger.error(f"Failed to launch ComfyUI server: {str(e)}")
             logger.debug(f"Detailed error: {traceback.format_exc()}")
@@ -253,7 +262,6 @@ class ComfyUIAPI:
         """Run a ComfyUI workflow and return the results."""
         # Generate a unique ID for this run
         run_id = str(uuid.uuid4())
-        workflow_path = f"/tmp/{run_id}.json"
         logger.info(f"Starting workflow execution for run_id: {run_id}")
         
         try:
@@ -279,41 +287,28 @@ class ComfyUIAPI:
                     "error": error_msg
                 }
 
-            # Save workflow to a temporary file
-            try:
-                with open(workflow_path, "w") as f:
-                    json.dump(workflow_json, f)
-                logger.info(f"Saved workflow to {workflow_path} for run_id {run_id}")
-            except (IOError, OSError) as e:
-                error_msg = f"Failed to save workflow to temporary file: {str(e)}"
+            # Make sure the workflow saves something, otherwise there is nothing to return
+            if not find_save_nodes(workflow_json):
+                error_msg = "No SaveImage nodes found in workflow"
                 logger.error(f"Error for run_id {run_id}: {error_msg}")
-                logger.debug(f"Detailed error: {traceback.format_exc()}")
                 return {
                     "status": "FAILED",
                     "error": error_msg
                 }
 
-            # Run the workflow
+            # Run the workflow on the ComfyUI server, writing outputs into a per-run subdirectory
             try:
-                cmd = f"comfy run --workflow {workflow_path} --wait --timeout 1200 --verbose"
-                logger.info(f"Executing command for run_id {run_id}: {cmd}")
-                process = subprocess.run(cmd, shell=True, check=True, capture_output=True, text=True)
-                logger.info(f"Workflow execution completed for run_id: {run_id}")
-                logger.debug(f"Command output: {process.stdout}")
-            except subprocess.CalledProcessError as e:
-                error_msg = f"ComfyUI workflow execution failed with exit code {e.returncode}"
+                logger.info(f"Submitting workflow to ComfyUI for run_id {run_id}")
+                execution = self.engine.run(isolate_outputs(workflow_json, run_id))
+                logger.info(f"Workflow execution completed for run_id: {run_id} (prompt_id {execution.prompt_id})")
+            except ComfyExecutionError as e:
+                error_msg = f"ComfyUI workflow execution failed: {str(e)}"
                 logger.error(f"Error for run_id {run_id}: {error_msg}")
-                logger.debug(f"Command output: {e.stdout}")
-                logger.debug(f"Command error: {e.stderr}")
                 logger.debug(f"Detailed error: {traceback.format_exc()}")
                 return {
                     "status": "FAILED",
                     "error": error_msg,
-                    "details": {
-                        "stdout": e.stdout,
-                        "stderr": e.stderr,
-                        "exit_code": e.returncode
-                    }
+                    "details": e.details
                 }
             except Exception as e:
                 error_msg = f"Failed to execute ComfyUI workflow: {str(e)}"
@@ -324,62 +319,25 @@ class ComfyUIAPI:
                     "error": error_msg
                 }
 
-            # Get output images
-            output_dir = "/root/comfy/ComfyUI/output"
+            # Get the output images recorded for this prompt
             images = []
-
-            # Look for any SaveImage nodes in the workflow
             try:
-                save_image_nodes = [
-                    node for node_id, node in workflow_json.items()
-                    if node.get("class_type") == "SaveImage"
-                ]
-
-                # If there are no SaveImage nodes, return an error
-                if not save_image_nodes:
-                    error_msg = "No SaveImage nodes found in workflow"
-                    logger.error(f"Error for run_id {run_id}: {error_msg}")
-                    return {
-                        "status": "FAILED",
-                        "error": error_msg
-                    }
+                for f in collect_output_files(execution, run_id):
+                    logger.info(f"Found output image: {f.name} for run_id {run_id}")
+                    try:
+                        # Read the file and encode it as base64
+                        image_data = base64.b64encode(f.read_bytes()).decode("utf-8")
+                        images.append({
+                            "filename": f.name,
+                            "type": "base64",
+                            "data": image_data
+                        })
+                    except (IOError, OSError) as e:
+                        logger.warning(f"Failed to read image file {f.name} for run_id {run_id}: {str(e)}")
+                        logger.debug(f"Detailed error: {traceback.format_exc()}")
+                        # Continue with other images
+                cleanup_outputs(run_id)
 
-                # Process each SaveImage node
-                for node in save_image_nodes:
-                    file_prefix = node.get("inputs", {}).get("filename_prefix", "")
-                    logger.info(f"Looking for images with prefix: {file_prefix} for run_id {run_id}")
-                    
-                    # Check if output directory exists
-                    if not Path(output_dir).exists():
-                        error_msg = f"Output directory {output_dir} does not exist"
-                        logger.error(f"Error for run_id {run_id}: {error_msg}")
-                        return {
-                            "status": "FAILED",
-                            "error": error_msg
-                        }
-                    
-                    # Find all files with this prefix
-                    found_images = False
-                    for f in Path(output_dir).iterdir():
-                        if f.name.startswith(file_prefix):
-                            found_images = True
-                            logger.info(f"Found output image: {f.name} for run_id {run_id}")
-                            try:
-                                # Read the file and encode it as base64
-                                image_data = base64.b64encode(f.read_bytes()).decode("utf-8")
-                                images.append({
-                                    "filename": f.name,
-                                    "type": "base64",
-                                    "data": image_data
-                                })
-                            except (IOError, OSError) as e:
-                                logger.warning(f"Failed to read image file {f.name} for run_id {run_id}: {str(e)}")
-                                logger.debug(f"Detailed error: {traceback.format_exc()}")
-                                # Continue with other images
-                    
-                    if not found_images:
-                        logger.warning(f"No images found with prefix {file_prefix} for run_id {run_id}")
-            
                 # Check if we found any images
                 if not images:
                     error_msg = "No output images found after workflow execution"
@@ -470,12 +428,7 @@ class ComfyUIAPI:
                 raise HTTPException(status_code=400, detail="Invalid workflow format: must be a non-empty JSON object")
             
             # Check for SaveImage nodes
-            save_image_nodes = [
-                node for node_id, node in workflow.items()
-                if node.get("class_type") == "SaveImage"
-            ]
-            
-            if not save_image_nodes:
+            if not find_save_nodes(workflow):
                 logger.warning("No SaveImage nodes found in workflow. Output may be empty.")
             
             # Check server health before processing
@@ -0,0 +1,21 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# The runtime package is imported as a top-level module, like in the containers
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from comfy_runtime.loaders import load_workflow_file  # noqa: E402
+
+
+@pytest.fixture
+def upscale_workflow1():
+    return load_workflow_file(ROOT / "upscale_workflow1.json")
+
+
+@pytest.fixture
+def upscale_workflow2():
+    return load_workflow_file(ROOT / "upscale_workflow2_API.json")
@@ -0,0 +1,113 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from comfy_runtime import admission
+from comfy_runtime.admission import (
+    BASE_SECONDS,
+    SAMPLING_SECONDS_PER_MEGAPIXEL_STEP,
+    AdmissionController,
+    AdmissionRejected,
+    WorkflowCost,
+    estimate_cost,
+)
+
+GB = 1024 ** 3
+
+
+def cost_of(workflow, tmp_path):
+    # Model files and stored inputs are not available in tests
+    return estimate_cost(workflow, models_dir=str(tmp_path), inputs_dir=str(tmp_path))
+
+
+def test_ultimate_sd_upscale_uses_tiles_and_denoise(upscale_workflow1, tmp_path):
+    cost = cost_of(upscale_workflow1, tmp_path)
+
+    # 1024x1024 upscaled by 2 is 4x4 tiles of 512x512, and 30 steps at 0.1 denoise run 3 steps
+    tile_megapixels = 512 * 512 / 1e6
+    assert cost.seconds == pytest.approx(BASE_SECONDS + 16 * 3 * tile_megapixels * SAMPLING_SECONDS_PER_MEGAPIXEL_STEP)
+    assert cost.peak_megapixels == pytest.approx(2048 * 2048 / 1e6)
+    assert cost.model_bytes == 0
+
+
+def test_downscale_to_size_limits_the_sampled_image(upscale_workflow2, tmp_path):
+    cost = cost_of(upscale_workflow2, tmp_path)
+
+    # The 1024px input is scaled down to 717px, upscaled 4x, halved, then sampled for 14 of 20 steps
+    sampled_megapixels = (717 * 4 * 0.5) ** 2 / 1e6
+    assert cost.peak_megapixels == pytest.approx((717 * 4 * 0.5 * 4) ** 2 / 1e6)
+    assert cost.activation_bytes == int(sampled_megapixels * admission.SAMPLING_BYTES_PER_MEGAPIXEL)
+    sampling = 14 * sampled_megapixels * SAMPLING_SECONDS_PER_MEGAPIXEL_STEP
+    assert cost.seconds > BASE_SECONDS + sampling
+
+
+def test_downscale_leaves_small_images_alone(upscale_workflow2, tmp_path, monkeypatch):
+    monkeypatch.setattr(admission, "image_size", lambda data: (600, 400))
+    workflow = {**upscale_workflow2, "97": {**upscale_workflow2["97"], "inputs": {"image": "aGk="}}}
+
+    cost = cost_of(workflow, tmp_path)
+
+    assert cost.peak_megapixels == pytest.approx(600 * 400 * 4 ** 2 * 0.5 ** 2 * 4 ** 2 / 1e6)
+
+
+@pytest.mark.parametrize("mode, megapixels", [(True, 2000 * 1000 / 1e6), (False, 4000 * 2000 / 1e6)])
+def test_downscale_by_longer_or_shorter_side(tmp_path, monkeypatch, mode, megapixels):
+    monkeypatch.setattr(admission, "image_size", lambda data: (2000, 1000))
+    workflow = {
+        "1": {"class_type": "ETN_LoadImageBase64", "inputs": {"image": "aGk="}},
+        "2": {"class_type": "easy imageScaleDownToSize", "inputs": {"size": 500, "mode": mode, "images": ["1", 0]}},
+        "3": {"class_type": "ImageScaleBy", "inputs": {"scale_by": 4, "image": ["2", 0]}},
+    }
+    assert cost_of(workflow, tmp_path).peak_megapixels == pytest.approx(megapixels)
+
+
+def health(vram_total=24 * GB):
+    return SimpleNamespace(state=SimpleNamespace(vram_total=vram_total, vram_free=1 * GB))
+
+
+def cost(seconds, activation_gb=1):
+    return WorkflowCost(activation_gb * GB, 0, seconds, 1.0)
+
+
+def test_rejects_jobs_too_large_for_the_gpu():
+    controller = AdmissionController()
+    with pytest.raises(AdmissionRejected) as e:
+        with controller.admitted(cost(10, activation_gb=23), health(), wait=0):
+            pass
+    assert e.value.permanent
+
+
+def test_low_free_vram_does_not_block_queued_jobs():
+    controller = AdmissionController(max_queued_seconds=100)
+    with controller.admitted(cost(40), health()):
+        with controller.admitted(cost(40, activation_gb=8), health(), wait=0):
+            assert controller.queued_seconds == 80
+
+
+def test_rejects_when_queued_seconds_are_exhausted():
+    controller = AdmissionController(max_queued_seconds=100)
+    with controller.admitted(cost(80), health()):
+        with pytest.raises(AdmissionRejected) as e:
+            with controller.admitted(cost(40), health(), wait=0):
+                pass
+    assert not e.value.permanent
+    assert controller.queued_seconds == 0
+
+
+def test_idle_container_takes_any_job():
+    controller = AdmissionController(max_queued_seconds=100)
+    with controller.admitted(cost(500), health(), wait=0):
+        assert controller.queued_seconds == 500
+
+
+def test_waits_for_room():
+    controller = AdmissionController(max_queued_seconds=100)
+    first = controller.admitted(cost(80), health())
+    first.__enter__()
+    threading.Timer(0.1, first.__exit__, (None, None, None)).start()
+
+    start = time.monotonic()
+    with controller.admitted(cost(40), health(), wait=5):
+        assert time.monotonic() - start < 2
@@ -0,0 +1,75 @@
+import time
+
+from comfy_runtime.affinity import ResidencyBoard, ResidentSet, pool_name
+from comfy_runtime.shared_state import LocalDict
+
+
+def board(pools=4, capacity=5):
+    return ResidencyBoard(LocalDict(), pools=pools, capacity=capacity)
+
+
+def test_routes_to_least_busy_resident_container():
+    b = board()
+    b.advertise("ta-1", "pool-1", ["flux"], active=3)
+    b.advertise("ta-2", "pool-2", ["flux", "sdxl"], active=1)
+    b.advertise("ta-3", "pool-3", ["sdxl"], active=0)
+
+    assert b.choose_pool("flux") == ("pool-2", "resident")
+
+
+def test_full_resident_containers_fall_back_to_least_loaded():
+    b = board(capacity=2)
+    b.advertise("ta-1", "pool-1", ["flux"], active=2)
+    b.advertise("ta-2", "pool-2", ["sdxl"], active=1)
+
+    assert b.choose_pool("flux") == ("pool-2", "least-loaded")
+
+
+def test_no_room_hashes_the_signature():
+    b = board(capacity=1)
+    b.advertise("ta-1", "pool-1", ["flux"], active=1)
+
+    pool, reason = b.choose_pool("flux")
+    assert reason == "hashed" and pool == b.hashed_pool("flux")
+    assert b.choose_pool("flux") == (pool, "hashed")
+
+
+def test_avoided_pool_is_skipped():
+    b = board()
+    b.advertise("ta-1", "pool-1", ["flux"], active=0)
+    assert b.choose_pool("flux", avoid="pool-1")[0] != "pool-1"
+
+    empty = board()
+    pool = empty.hashed_pool("sdxl")
+    assert empty.choose_pool("sdxl", avoid=pool) == (pool_name((int(pool[-1]) + 1) % 4), "hashed")
+
+
+def test_single_pool_is_never_avoided():
+    b = board(pools=1)
+    b.advertise("ta-1", "pool-0", ["flux"], active=0)
+    assert b.choose_pool("flux", avoid="pool-0") == ("pool-0", "resident")
+
+
+def test_stale_and_withdrawn_ads_are_ignored():
+    b = board()
+    b.advertise("ta-1", "pool-1", ["flux"], active=0)
+    b.advertise("ta-2", "pool-2", ["flux"], active=0)
+    b.store["ta-1"] = {**b.store["ta-1"], "updated_at": time.time() - 1000}
+    b.withdraw("ta-2")
+    b.withdraw("ta-missing")
+
+    assert b.live() == {}
+    assert b.choose_pool("flux")[1] == "hashed"
+
+
+def test_advertisement_keeps_recent_signatures():
+    b = board()
+    b.advertise("ta-1", "pool-1", ["a", "b", "c"], active=0)
+    assert b.store["ta-1"]["signatures"] == ["a", "b"]
+
+
+def test_resident_set_keeps_most_recent_first():
+    resident = ResidentSet(size=2)
+    for signature in ("a", "b", "a", "c"):
+        resident.touch(signature)
+    assert resident.signatures == ["c", "a"]
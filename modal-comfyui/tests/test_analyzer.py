@@ -0,0 +1,58 @@
+import logging
+
+from comfy_runtime.analyzer import analyze_workflows, log_report, match_models
+from comfy_runtime.custom_nodes import CORE_PACK
+from comfy_runtime.models import ModelSpec, read_model_list
+from conftest import ROOT
+
+PACK_NODES = {
+    "ETN_LoadImageBase64": "comfyui-tooling-nodes",
+    "DownloadAndLoadFlorence2Model": "ComfyUI-Florence2",
+    "Florence2Run": "ComfyUI-Florence2",
+    "easy imageScaleDownToSize": "ComfyUI-Easy-Use",
+    "easy showAnything": "ComfyUI-Easy-Use",
+}
+
+
+def node_index(workflow):
+    return {node["class_type"]: PACK_NODES.get(node["class_type"], CORE_PACK) for node in workflow.values()}
+
+
+def test_match_models_uses_link_names():
+    spec = ModelSpec.from_tuple(("org/repo", "dir/model.safetensors|renamed.safetensors", "unet"))
+    matched, missing = match_models([("unet", "renamed.safetensors"), ("unet", "model.safetensors")], [spec])
+    assert matched == {("unet", "renamed.safetensors"): spec}
+    assert missing == [("unet", "model.safetensors")]
+
+
+def test_analyze_deployed_workflow(upscale_workflow2):
+    specs = read_model_list(ROOT / "modal_comfyui_api.py")
+    index = node_index(upscale_workflow2)
+    del index["Florence2Run"]
+
+    report = analyze_workflows(
+        {"upscale_workflow2_API.json": upscale_workflow2},
+        specs,
+        node_index=index,
+        installed_packs=["ComfyUI-Easy-Use", "ComfyUI-Florence2", "comfyui-tooling-nodes", "was-node-suite", "memory_snapshot_helper"],
+    )
+
+    assert report["packs"] == ["ComfyUI-Easy-Use", "ComfyUI-Florence2", "comfyui-tooling-nodes"]
+    assert report["unknown_nodes"] == ["Florence2Run"]
+    assert report["missing_models"] == []
+    assert "black-forest-labs/FLUX.1-dev/flux1-dev.safetensors" in report["models"]
+    assert len(report["models"]) + len(report["unused_models"]) == len({spec.key for spec in specs})
+    assert report["unused_packs"] == ["was-node-suite"]
+
+
+def test_analyze_without_index_reports_models_only(upscale_workflow2):
+    report = analyze_workflows({"w": upscale_workflow2}, [])
+
+    assert report["packs"] == [] and "unused_packs" not in report
+    assert "unet/flux1-dev.safetensors" in report["missing_models"]
+
+
+def test_log_report_warns_about_missing_models(upscale_workflow2, caplog):
+    with caplog.at_level(logging.INFO):
+        log_report(analyze_workflows({"w": upscale_workflow2}, []))
+    assert any(record.levelno == logging.WARNING and "flux1-dev" in record.message for record in caplog.records)
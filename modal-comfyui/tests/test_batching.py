@@ -0,0 +1,48 @@
+import pytest
+
+from comfy_runtime.batching import apply_inputs, item_id, loader_signature, parse_item_id, plan_batch
+
+
+def with_unet(workflow, unet_name):
+    return apply_inputs(workflow, {"12": {"unet_name": unet_name}})
+
+
+def test_loader_signature_ignores_non_loader_inputs(upscale_workflow2):
+    changed = apply_inputs(upscale_workflow2, {"79": {"seed": 1234}})
+    assert loader_signature(changed) == loader_signature(upscale_workflow2)
+
+
+def test_loader_signature_changes_with_models(upscale_workflow2):
+    assert loader_signature(with_unet(upscale_workflow2, "other.safetensors")) != loader_signature(upscale_workflow2)
+
+
+def test_apply_inputs_copies_workflow(upscale_workflow2):
+    changed = apply_inputs(upscale_workflow2, {"79": {"seed": 1234}})
+    assert changed["79"]["inputs"]["seed"] == 1234
+    assert upscale_workflow2["79"]["inputs"]["seed"] != 1234
+
+
+@pytest.mark.parametrize("overrides", [[], {"missing": {"seed": 1}}, {"79": 5}])
+def test_apply_inputs_rejects_invalid_overrides(upscale_workflow2, overrides):
+    with pytest.raises(ValueError):
+        apply_inputs(upscale_workflow2, overrides)
+
+
+def test_plan_batch_groups_and_chunks(upscale_workflow2):
+    other = with_unet(upscale_workflow2, "other.safetensors")
+    workflows = [upscale_workflow2, other, upscale_workflow2, upscale_workflow2, other]
+
+    chunks = plan_batch(workflows, chunk_size=2)
+
+    assert [indexes for _, indexes in chunks] == [[0, 2], [3], [1, 4]]
+    assert chunks[0][0] == chunks[1][0] == loader_signature(upscale_workflow2)
+
+
+def test_item_id_round_trip():
+    assert parse_item_id(item_id("fc-01H:abc", 3)) == ("fc-01H:abc", 3)
+
+
+@pytest.mark.parametrize("value", ["fc-01H", ":3", "fc-01H:x"])
+def test_parse_item_id_rejects_invalid_ids(value):
+    with pytest.raises(ValueError):
+        parse_item_id(value)
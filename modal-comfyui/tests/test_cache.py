@@ -0,0 +1,90 @@
+import json
+
+from comfy_runtime.cache import META_FILENAME, ResultCache
+
+
+class FakeVolume:
+    def __init__(self):
+        self.commits = 0
+        self.reloads = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def reload(self):
+        self.reloads += 1
+
+
+def output_file(tmp_path, name, size):
+    path = tmp_path / "outputs" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(b"x" * size)
+    return path
+
+
+def last_access(cache, key):
+    return json.loads((cache.root / key / META_FILENAME).read_text())["last_access"]
+
+
+def test_put_and_get(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    cache.put("k1", [output_file(tmp_path, "a.png", 10)])
+    assert cache.contains("k1")
+    files = cache.get("k1")
+    assert [f.name for f in files] == ["a.png"]
+    assert files[0].read_bytes() == b"x" * 10
+    assert cache.get("missing") is None
+
+
+def test_put_keeps_first_entry(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    cache.put("k1", [output_file(tmp_path, "a.png", 10)])
+    cache.put("k1", [output_file(tmp_path, "b.png", 10)])
+    assert [f.name for f in cache.get("k1")] == ["a.png"]
+    assert not [p for p in cache.root.iterdir() if p.name.startswith(".tmp-")]
+
+
+def test_incomplete_entry_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    cache.put("k1", [output_file(tmp_path, "a.png", 10)])
+    (cache.root / "k1" / "a.png").unlink()
+    assert cache.get("k1") is None
+
+
+def test_misses_reload_at_most_once_per_interval(tmp_path):
+    volume = FakeVolume()
+    cache = ResultCache(str(tmp_path / "cache"), volume, reload_interval=60)
+    for _ in range(5):
+        assert not cache.contains("missing")
+        assert cache.get("missing") is None
+    assert volume.reloads == 1
+
+
+def test_hits_are_written_back_in_batches(tmp_path):
+    volume = FakeVolume()
+    cache = ResultCache(str(tmp_path / "cache"), volume, flush_interval=60)
+    cache.put("k1", [output_file(tmp_path, "a.png", 10)])
+    commits = volume.commits
+    stored = last_access(cache, "k1")
+    for _ in range(5):
+        cache.get("k1")
+    # Hits neither rewrite the entry nor commit until the cache is flushed
+    assert volume.commits == commits
+    assert last_access(cache, "k1") == stored
+    cache.flush()
+    assert volume.commits == commits + 1
+    assert last_access(cache, "k1") > stored
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=15, flush_interval=0)
+    for key in ("k1", "k2", "k3"):
+        cache.put(key, [output_file(tmp_path, f"{key}.png", 10)])
+    # Evicting is not done by put
+    assert all(cache.contains(key) for key in ("k1", "k2", "k3"))
+    # Using k1 makes k2 the least recently used entry
+    cache.get("k1")
+    assert cache.evict() == 2
+    assert cache.contains("k1")
+    assert not cache.contains("k2") and not cache.contains("k3")
+    assert cache.evict() == 0
@@ -0,0 +1,99 @@
+import ipaddress
+import socket
+
+import pytest
+
+from comfy_runtime import callbacks
+from comfy_runtime.callbacks import CallbackRegistry, blocked_reason, post_with_retry, validate_callback_url
+from comfy_runtime.shared_state import LocalDict
+
+ADDRESSES = {
+    "hooks.example.com": ["93.184.216.34"],
+    "internal.example.com": ["10.0.0.5"],
+    "mixed.example.com": ["93.184.216.34", "192.168.1.10"],
+    "v6.example.com": ["2606:2800:220:1:248:1893:25c8:1946"],
+    "mapped.example.com": ["::ffff:127.0.0.1"],
+}
+
+
+@pytest.fixture(autouse=True)
+def fake_dns(monkeypatch):
+    def getaddrinfo(host, port, *args, **kwargs):
+        try:
+            addresses = ADDRESSES.get(host) or [str(ipaddress.ip_address(host))]
+        except ValueError:
+            raise socket.gaierror(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port)) for address in addresses]
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+
+
+@pytest.mark.parametrize("url", ["https://hooks.example.com/done", "http://v6.example.com:8080/cb"])
+def test_public_hosts_are_accepted(url):
+    assert validate_callback_url(url)
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "http://localhost/cb",
+        "http://127.0.0.1:8188/prompt",
+        "http://169.254.169.254/latest/meta-data",
+        "http://internal.example.com/cb",
+        "http://mixed.example.com/cb",
+        "http://mapped.example.com/cb",
+        "http://[::1]/cb",
+        "http://0.0.0.0/cb",
+        "http://unknown.invalid/cb",
+        "ftp://hooks.example.com/cb",
+        "/relative/path",
+        "http://hooks.example.com:99999/cb",
+    ],
+)
+def test_private_and_invalid_urls_are_rejected(url):
+    assert not validate_callback_url(url)
+
+
+def test_blocked_reason_names_the_address():
+    assert "10.0.0.5" in blocked_reason("http://internal.example.com/cb")
+    assert blocked_reason("https://hooks.example.com/cb") is None
+
+
+def test_delivery_rechecks_the_host(monkeypatch):
+    posted = []
+    monkeypatch.setattr(callbacks, "blocked_reason", lambda url: "resolves to non-public address 10.0.0.5")
+    import requests
+
+    monkeypatch.setattr(requests, "post", lambda *args, **kwargs: posted.append(args))
+    assert not post_with_retry("https://hooks.example.com/cb", {"id": "c1"}, max_attempts=1)
+    assert posted == []
+
+
+def test_delivery_retries_server_errors_without_redirects(monkeypatch):
+    import requests
+
+    calls = []
+
+    class Response:
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    statuses = [503, 200]
+
+    def post(url, **kwargs):
+        calls.append(kwargs)
+        return Response(statuses.pop(0))
+
+    monkeypatch.setattr(requests, "post", post)
+    assert post_with_retry("https://hooks.example.com/cb", {"id": "c1"}, base_delay=0)
+    assert len(calls) == 2
+    assert all(call["allow_redirects"] is False for call in calls)
+
+
+def test_registry_takes_urls_once():
+    registry = CallbackRegistry(LocalDict())
+    registry.register("c1", "https://a.example.com")
+    registry.register("c1", "https://a.example.com")
+    registry.register("c1", "https://b.example.com")
+    assert registry.take("c1") == ["https://a.example.com", "https://b.example.com"]
+    assert registry.take("c1") == []
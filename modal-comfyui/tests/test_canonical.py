@@ -0,0 +1,37 @@
+from comfy_runtime.canonical import PAYLOAD_MIN_LENGTH, canonical_hash, canonicalize_workflow, workflow_hash
+
+
+def workflow(**inputs):
+    return {
+        "3": {"class_type": "KSampler", "inputs": {"seed": 1, "denoise": 0.5, **inputs}, "_meta": {"title": "Sampler"}},
+        "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "out", "images": ["3", 0]}},
+    }
+
+
+def test_hash_ignores_meta_and_key_order():
+    reordered = {"9": workflow()["9"], "3": {"inputs": {"denoise": 0.5, "seed": 1}, "class_type": "KSampler"}}
+    assert workflow_hash(workflow()) == workflow_hash(reordered)
+
+
+def test_hash_normalizes_numbers():
+    assert workflow_hash(workflow(cfg=1.0)) == workflow_hash(workflow(cfg=1))
+    assert workflow_hash(workflow(cfg=0.1 + 0.2)) == workflow_hash(workflow(cfg=0.3))
+
+
+def test_hash_keeps_seeds_exact():
+    assert workflow_hash(workflow(seed=2 ** 53)) != workflow_hash(workflow(seed=2 ** 53 + 1))
+
+
+def test_hash_changes_with_inputs():
+    assert workflow_hash(workflow()) != workflow_hash(workflow(steps=30))
+
+
+def test_large_payloads_are_hashed():
+    image = "A" * PAYLOAD_MIN_LENGTH
+    canonical = canonicalize_workflow(workflow(image=image))
+    assert canonical["3"]["inputs"]["image"].startswith("sha256:")
+    assert workflow_hash(workflow(image=image)) != workflow_hash(workflow(image="B" * PAYLOAD_MIN_LENGTH))
+
+
+def test_canonical_hash_matches_workflow_hash():
+    assert canonical_hash(canonicalize_workflow(workflow())) == workflow_hash(workflow())
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from comfy_runtime.custom_nodes import (
+    CORE_PACK,
+    build_node_index,
+    enable_only,
+    enabled_packs,
+    load_import_profile,
+    load_node_index,
+    required_packs,
+    write_node_index,
+)
+
+
+@pytest.fixture
+def custom_nodes(tmp_path):
+    for name in ("ComfyUI_UltimateSDUpscale", "ComfyUI-Easy-Use.disabled", "memory_snapshot_helper", "__pycache__"):
+        (tmp_path / name).mkdir()
+    (tmp_path / "example_node.py").write_text("")
+    return tmp_path
+
+
+def test_build_node_index():
+    object_info = {
+        "KSampler": {"python_module": "nodes"},
+        "UltimateSDUpscale": {"python_module": "custom_nodes.ComfyUI_UltimateSDUpscale.nodes"},
+    }
+    assert build_node_index(object_info) == {"KSampler": CORE_PACK, "UltimateSDUpscale": "ComfyUI_UltimateSDUpscale"}
+
+
+def test_node_index_round_trip(tmp_path):
+    path = str(tmp_path / "index.json")
+    assert load_node_index(path) == {}
+    write_node_index({"KSampler": CORE_PACK}, path)
+    assert load_node_index(path) == {"KSampler": CORE_PACK}
+
+
+def test_required_packs():
+    index = {"KSampler": CORE_PACK, "UltimateSDUpscale": "ComfyUI_UltimateSDUpscale"}
+    workflow = {
+        "1": {"class_type": "KSampler"},
+        "2": {"class_type": "UltimateSDUpscale"},
+        "3": {"class_type": "Mystery"},
+    }
+    assert required_packs(index, workflow) == ({"ComfyUI_UltimateSDUpscale"}, {"Mystery"})
+
+
+def test_enable_only_toggles_packs(custom_nodes):
+    disabled = enable_only({"ComfyUI-Easy-Use"}, str(custom_nodes))
+
+    assert disabled == ["ComfyUI_UltimateSDUpscale"]
+    assert enabled_packs(str(custom_nodes)) == {"ComfyUI-Easy-Use", "memory_snapshot_helper"}
+    assert (custom_nodes / "ComfyUI_UltimateSDUpscale.disabled").is_dir()
+
+
+def test_enabled_packs_skips_disabled_and_private(custom_nodes):
+    assert enabled_packs(str(custom_nodes)) == {"ComfyUI_UltimateSDUpscale", "memory_snapshot_helper"}
+
+
+def test_load_import_profile_sorts_slowest_first(tmp_path):
+    path = tmp_path / "profile.json"
+    path.write_text(json.dumps([{"pack": "a", "seconds": 0.5}, {"pack": "b", "seconds": 2.0}]))
+    assert [entry["pack"] for entry in load_import_profile(str(path))] == ["b", "a"]
+    assert load_import_profile(str(tmp_path / "missing.json")) == []
@@ -0,0 +1,109 @@
+import json
+import time
+
+import pytest
+
+from comfy_runtime.engine import ComfyEngine, ComfyExecutionError, ExecutionResult
+
+
+class FakeWebSocket:
+    def __init__(self, events):
+        self.messages = [json.dumps(event) if isinstance(event, dict) else event for event in events]
+        self.closed = False
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self):
+        return self.messages.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeEngine(ComfyEngine):
+    """Serves `/prompt` and `/history` from memory instead of a ComfyUI server."""
+
+    def __init__(self, ws=None, history=None):
+        super().__init__()
+        self.ws = ws
+        self.history = history or {}
+        self.requests = []
+
+    def _open_websocket(self, client_id):
+        if self.ws is None:
+            raise ConnectionError("no websocket")
+        return self.ws
+
+    def _request(self, method, path, payload=None, timeout=30):
+        self.requests.append((method, path))
+        if path == "/prompt":
+            return {"prompt_id": "p1", "number": 0}
+        if path.startswith("/history/"):
+            return self.history
+        return {}
+
+
+HISTORY = {
+    "p1": {
+        "status": {"status_str": "success", "completed": True},
+        "outputs": {"9": {"images": [{"filename": "out.png", "subfolder": "", "type": "output"}]}},
+    }
+}
+
+
+def events(*nodes):
+    messages = [{"type": "executing", "data": {"node": node, "prompt_id": "p1"}} for node in nodes]
+    return messages + [{"type": "executing", "data": {"node": None, "prompt_id": "p1"}}]
+
+
+def test_run_follows_the_websocket_and_reads_history():
+    ws = FakeWebSocket([b"preview", {"type": "executing", "data": {"node": "1", "prompt_id": "other"}}] + events("3", "9"))
+    engine = FakeEngine(ws, HISTORY)
+
+    result = engine.run({"9": {}})
+
+    assert result.prompt_id == "p1"
+    assert set(result.node_timings) == {"3", "9"}
+    assert result.images() == [{"filename": "out.png", "subfolder": "", "type": "output", "node_id": "9"}]
+    assert ws.closed
+
+
+def test_run_polls_history_without_a_websocket():
+    result = FakeEngine(history=HISTORY).run({"9": {}})
+    assert result.node_timings == {}
+    assert result.outputs == HISTORY["p1"]["outputs"]
+
+
+def test_node_errors_are_raised_with_details():
+    ws = FakeWebSocket(
+        [
+            {
+                "type": "execution_error",
+                "data": {"prompt_id": "p1", "node_id": "3", "node_type": "KSampler", "exception_message": "OOM\n"},
+            }
+        ]
+    )
+    with pytest.raises(ComfyExecutionError) as excinfo:
+        FakeEngine(ws, HISTORY).run({"3": {}})
+    assert str(excinfo.value) == "Node 3 (KSampler) failed: OOM"
+    assert excinfo.value.details["node_type"] == "KSampler"
+
+
+def test_failed_history_status_is_an_error():
+    history = {"p1": {"status": {"status_str": "error", "messages": [["execution_error", {}]]}, "outputs": {}}}
+    with pytest.raises(ComfyExecutionError):
+        FakeEngine(history=history).run({"3": {}})
+
+
+def test_timeout_removes_the_prompt_from_the_queue():
+    engine = FakeEngine()
+    with pytest.raises(TimeoutError):
+        engine._poll_history("p1", time.monotonic() + 0.05, interval=0.01)
+    with pytest.raises(TimeoutError):
+        engine.run({"3": {}}, timeout=0.05)
+    assert ("POST", "/queue") in engine.requests
+
+
+def test_images_are_empty_without_image_outputs():
+    assert ExecutionResult(prompt_id="p1", outputs={"9": {"text": ["hi"]}}).images() == []
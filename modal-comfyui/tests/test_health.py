@@ -0,0 +1,109 @@
+import threading
+import time
+
+import requests
+
+from comfy_runtime.health import HealthMonitor
+
+STATS = {
+    "system": {"ram_total": 64, "ram_free": 32},
+    "devices": [{"vram_total": 24, "vram_free": 20}],
+}
+QUEUE = {"queue_running": [["p-1"]], "queue_pending": [["p-2"], ["p-3"]]}
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+    """Answers like a healthy server until `down` is set."""
+
+    def __init__(self):
+        self.down = False
+        self.calls = 0
+
+    def get(self, url, timeout):
+        self.calls += 1
+        if self.down:
+            raise requests.ConnectionError("connection refused")
+        return FakeResponse(STATS if url.endswith("/system_stats") else QUEUE)
+
+
+def monitor(**kwargs):
+    health = HealthMonitor(8000, **kwargs)
+    health._session = FakeSession()
+    return health
+
+
+def test_check_parses_stats_and_queue():
+    state = monitor().check()
+
+    assert state.healthy and state.consecutive_failures == 0
+    assert (state.vram_total, state.vram_free, state.ram_total, state.ram_free) == (24, 20, 64, 32)
+    assert (state.queue_running, state.queue_pending) == (1, 2)
+
+
+def test_unhealthy_after_threshold_and_notifies_once():
+    calls = []
+    health = monitor(failure_threshold=2, on_unhealthy=calls.append)
+    health.check()
+    health._session.down = True
+
+    first = health.check()
+    second = health.check()
+    health.check()
+
+    assert first.healthy and first.consecutive_failures == 1
+    assert not second.healthy and second.vram_free == 20
+    assert len(calls) == 1
+
+
+def test_recovers_when_server_answers_again():
+    health = monitor(failure_threshold=1)
+    health._session.down = True
+    assert not health.check().healthy
+
+    health._session.down = False
+    state = health.check()
+
+    assert state.healthy and state.error is None
+    assert health.state is state
+
+
+def test_paused_checks_when_done():
+    health = monitor()
+    with health.paused():
+        assert health._paused.is_set()
+    assert not health._paused.is_set()
+    assert health._session.calls == 2
+
+
+def test_concurrent_checks_are_serialized():
+    health = monitor()
+    active, overlaps = [0], []
+
+    class SlowSession(FakeSession):
+        def get(self, url, timeout):
+            active[0] += 1
+            overlaps.append(active[0])
+            time.sleep(0.01)
+            active[0] -= 1
+            return super().get(url, timeout)
+
+    health._session = SlowSession()
+    threads = [threading.Thread(target=health.check) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(overlaps) == 1
+    assert health._session.calls == 8
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from comfy_runtime.shared_state import LocalDict
+from comfy_runtime.singleflight import KeyConflictError, SingleFlight
+
+
+def idempotency_keys(**kwargs):
+    # Configured like the idempotency keys of submit_workflow
+    return SingleFlight(LocalDict(), ttl=24 * 60 * 60, **kwargs)
+
+
+def spawner(call_ids):
+    async def spawn():
+        return call_ids.pop(0)
+
+    return spawn
+
+
+def test_retry_with_the_same_key_is_replayed():
+    keys = idempotency_keys()
+    spawn = spawner(["call-1", "call-2"])
+    assert asyncio.run(keys.submit("client-key", spawn, fingerprint="wf:inline:True")) == ("call-1", False)
+    assert asyncio.run(keys.submit("client-key", spawn, fingerprint="wf:inline:True")) == ("call-1", True)
+
+
+def test_key_reused_for_another_request_conflicts():
+    keys = idempotency_keys()
+    asyncio.run(keys.submit("client-key", spawner(["call-1"]), fingerprint="wf-a:inline:True"))
+    with pytest.raises(KeyConflictError):
+        asyncio.run(keys.submit("client-key", spawner(["call-2"]), fingerprint="wf-b:inline:True"))
+    # The result mode and cache flag are part of the fingerprint too
+    with pytest.raises(KeyConflictError):
+        asyncio.run(keys.submit("client-key", spawner(["call-2"]), fingerprint="wf-a:reference:True"))
+
+
+def test_conflict_while_the_leader_is_still_spawning():
+    keys = idempotency_keys()
+
+    async def slow_spawn():
+        await asyncio.sleep(0.2)
+        return "call-1"
+
+    async def run():
+        leader = asyncio.create_task(keys.submit("client-key", slow_spawn, fingerprint="a"))
+        await asyncio.sleep(0.05)
+        with pytest.raises(KeyConflictError):
+            await keys.submit("client-key", spawner(["call-2"]), fingerprint="b")
+        return await leader
+
+    assert asyncio.run(run()) == ("call-1", False)
+
+
+def test_expired_key_starts_a_new_job():
+    store = LocalDict()
+    keys = SingleFlight(store, ttl=60)
+    store["client-key"] = {"call_id": "call-1", "claimed_at": 0, "fingerprint": "a"}
+    # After the TTL even another fingerprint may use the key
+    assert asyncio.run(keys.submit("client-key", spawner(["call-2"]), fingerprint="b")) == ("call-2", False)
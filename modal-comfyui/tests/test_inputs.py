@@ -0,0 +1,80 @@
+import base64
+import hashlib
+
+import pytest
+
+from comfy_runtime.inputs import (
+    BASE64_LOADER,
+    FILE_LOADER,
+    InputStore,
+    base64_image_paths,
+    image_extension,
+    is_input_key,
+)
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 16
+PNG_KEY = f"{hashlib.sha256(PNG).hexdigest()}.png"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return InputStore(str(tmp_path / "inputs"))
+
+
+@pytest.mark.parametrize(
+    "data, extension",
+    [(PNG, "png"), (b"\xff\xd8\xff\xe0", "jpg"), (b"RIFF\x00\x00\x00\x00WEBPVP8 ", "webp"), (b"GIF89a", "gif"), (b"text", None)],
+)
+def test_image_extension(data, extension):
+    assert image_extension(data) == extension
+
+
+def test_is_input_key():
+    assert is_input_key(PNG_KEY)
+    assert not is_input_key("../" + PNG_KEY)
+    assert not is_input_key("photo.png")
+    assert not is_input_key(None)
+
+
+def test_put_deduplicates(store):
+    assert store.put(PNG) == (PNG_KEY, True)
+    assert store.put(PNG) == (PNG_KEY, False)
+    assert store.resolve(PNG_KEY).read_bytes() == PNG
+
+
+@pytest.mark.parametrize("data", ["not base64!", base64.b64encode(b"text").decode()])
+def test_put_base64_rejects_non_images(store, data):
+    with pytest.raises(ValueError):
+        store.put_base64(data)
+
+
+def test_put_base64_accepts_data_urls(store):
+    assert store.put_base64("data:image/png;base64," + base64.b64encode(PNG).decode()) == PNG_KEY
+
+
+def test_ingest_replaces_base64_with_keys(store, upscale_workflow2):
+    workflow = {**upscale_workflow2, "97": {**upscale_workflow2["97"], "inputs": {"image": base64.b64encode(PNG).decode()}}}
+
+    ingested = store.ingest(workflow)
+
+    assert base64_image_paths(workflow) == {"97.image"}
+    assert ingested["97"]["inputs"]["image"] == PNG_KEY
+    assert ingested["12"] is workflow["12"]
+    assert store.ingest(ingested) is ingested
+
+
+def test_use_input_files_places_images_and_switches_loader(store, tmp_path, upscale_workflow2):
+    store.put(PNG)
+    workflow = {**upscale_workflow2, "97": {"class_type": BASE64_LOADER, "inputs": {"image": PNG_KEY}}}
+    input_dir = tmp_path / "comfy-input"
+
+    graph = store.use_input_files(workflow, str(input_dir))
+
+    assert graph["97"] == {"class_type": FILE_LOADER, "inputs": {"image": PNG_KEY}}
+    assert (input_dir / PNG_KEY).read_bytes() == PNG
+    assert workflow["97"]["class_type"] == BASE64_LOADER
+
+
+def test_place_requires_stored_image(store, tmp_path):
+    with pytest.raises(FileNotFoundError):
+        store.place(PNG_KEY, str(tmp_path / "comfy-input"))
@@ -0,0 +1,41 @@
+import json
+
+from comfy_runtime.loaders import load_workflow_file, required_models
+
+
+def test_load_workflow_file_unwraps_request_bodies(tmp_path):
+    graph = {"1": {"class_type": "VAELoader", "inputs": {"vae_name": "ae.safetensors"}}}
+    wrapped = tmp_path / "wrapped.json"
+    wrapped.write_text(json.dumps({"input": {"workflow": graph}}))
+    plain = tmp_path / "plain.json"
+    plain.write_text(json.dumps(graph))
+
+    assert load_workflow_file(wrapped) == graph
+    assert load_workflow_file(plain) == graph
+
+
+def test_required_models_of_the_upscale_workflow(upscale_workflow1):
+    assert required_models(upscale_workflow1) == [
+        ("unet", "flux1-dev.safetensors"),
+        ("clip", "clip_l.safetensors"),
+        ("clip", "t5xxl_fp8_e4m3fn.safetensors"),
+        ("vae", "ae.safetensors"),
+        ("upscale_models", "4x_foolhardy_Remacri.pth"),
+    ]
+
+
+def test_required_models_are_deduplicated_across_workflows(upscale_workflow1, upscale_workflow2):
+    models = required_models(upscale_workflow1, upscale_workflow2)
+    assert len(models) == len(set(models))
+    assert models[0] == ("unet", "flux1-dev.safetensors")
+    assert models[-2:] == [("upscale_models", "4x_foolhardy_Remacri.pth"), ("upscale_models", "4x_NMKD-Siax_200k.pth")]
+
+
+def test_required_models_skip_links_and_unknown_nodes():
+    workflow = {
+        "1": {"class_type": "LoraLoader", "inputs": {"lora_name": ["9", 0]}},
+        "2": {"class_type": "KSampler", "inputs": {"seed": 1}},
+        "3": {"class_type": "VAELoader", "inputs": {"vae_name": ""}},
+        "4": {"class_type": "LoraLoader", "inputs": {"lora_name": "detail.safetensors"}},
+    }
+    assert required_models(workflow) == [("loras", "detail.safetensors")]
@@ -0,0 +1,85 @@
+import hashlib
+
+import pytest
+
+from comfy_runtime import models
+from comfy_runtime.models import ModelDownloader, ModelSpec, load_lockfile, read_model_list, write_lockfile
+from conftest import ROOT
+
+SPEC = ModelSpec.from_tuple(("org/repo", "weights/model.safetensors|renamed.safetensors", "unet"))
+DATA = b"model weights"
+
+
+def locked_entry(data=DATA):
+    return {"revision": "abc", "size": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def cached_model(tmp_path, data=DATA):
+    path = SPEC.cache_path(str(tmp_path / "cache"))
+    path.parent.mkdir(parents=True)
+    path.write_bytes(data)
+    return path
+
+
+def downloader(tmp_path, lock, **kwargs):
+    return ModelDownloader(str(tmp_path / "cache"), lock=lock, models_dir=str(tmp_path / "models"), **kwargs)
+
+
+def test_spec_from_tuple():
+    assert SPEC.key == "org/repo/weights/model.safetensors"
+    assert SPEC.link_name == "renamed.safetensors"
+    plain = ModelSpec.from_tuple(("org/repo", "dir/model.safetensors", "vae"))
+    assert plain.link_name == "model.safetensors"
+
+
+@pytest.mark.parametrize("app", ["modal_comfyui_api.py", "comfyapp.py"])
+def test_read_model_list_parses_apps(app):
+    specs = read_model_list(ROOT / app)
+    assert specs
+    assert all(isinstance(spec, ModelSpec) for spec in specs)
+
+
+def test_read_model_list_requires_definition(tmp_path):
+    app = tmp_path / "app.py"
+    app.write_text("MODELS = []\n")
+    with pytest.raises(ValueError):
+        read_model_list(app)
+
+
+def test_lockfile_round_trip(tmp_path):
+    path = tmp_path / models.LOCKFILE_NAME
+    assert load_lockfile(path) == {}
+    write_lockfile(path, {SPEC.key: locked_entry()})
+    assert load_lockfile(path) == {SPEC.key: locked_entry()}
+
+
+def test_ensure_keeps_verified_file_and_links_it(tmp_path):
+    path = cached_model(tmp_path)
+    d = downloader(tmp_path, {SPEC.key: locked_entry()})
+
+    assert d.ensure(SPEC) == path
+    link = SPEC.link_path(str(tmp_path / "models"))
+    assert link.is_symlink() and link.resolve() == path.resolve()
+    assert d._is_current(SPEC, locked_entry())
+
+
+def test_verify_rejects_mismatched_digest(tmp_path):
+    path = cached_model(tmp_path, b"other weights")
+    d = downloader(tmp_path, {})
+    with pytest.raises(ValueError):
+        d._verify(SPEC, locked_entry(b"other weightz"), path)
+
+
+def test_require_lock_rejects_unlocked_models(tmp_path):
+    with pytest.raises(ValueError):
+        downloader(tmp_path, {}, require_lock=True).ensure(SPEC)
+
+
+def test_sync_reports_failures(tmp_path):
+    with pytest.raises(RuntimeError, match="Failed to download 1 models"):
+        downloader(tmp_path, {}, require_lock=True).sync([SPEC])
+
+
+def test_hf_transfer_needs_opt_in(monkeypatch):
+    monkeypatch.delenv("HF_HUB_ENABLE_HF_TRANSFER", raising=False)
+    assert models._hf_transfer() is None
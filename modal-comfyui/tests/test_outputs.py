@@ -0,0 +1,57 @@
+from comfy_runtime.engine import ExecutionResult
+from comfy_runtime.outputs import cleanup_outputs, collect_output_files, isolate_outputs
+
+
+def save_workflow(prefix):
+    return {
+        "1": {"class_type": "LoadImage", "inputs": {"image": "in.png"}},
+        "2": {"class_type": "SaveImage", "inputs": {"filename_prefix": prefix, "images": ["1", 0]}},
+    }
+
+
+def test_isolate_outputs_prefixes_run_id():
+    workflow = save_workflow("upscaled")
+    isolated = isolate_outputs(workflow, "run1")
+    assert isolated["2"]["inputs"]["filename_prefix"] == "run1/upscaled"
+    # The original graph is not modified and untouched nodes are shared
+    assert workflow["2"]["inputs"]["filename_prefix"] == "upscaled"
+    assert isolated["1"] is workflow["1"]
+
+
+def test_isolate_outputs_defaults_empty_prefix():
+    assert isolate_outputs(save_workflow(""), "run1")["2"]["inputs"]["filename_prefix"] == "run1/ComfyUI"
+
+
+def test_isolate_outputs_leaves_linked_prefix():
+    workflow = save_workflow(["5", 0])
+    assert isolate_outputs(workflow, "run1")["2"]["inputs"]["filename_prefix"] == ["5", 0]
+
+
+def test_collect_output_files_uses_recorded_outputs(tmp_path):
+    (tmp_path / "run1").mkdir()
+    (tmp_path / "run1" / "a_00001_.png").write_bytes(b"png")
+    execution = ExecutionResult(
+        "p1",
+        outputs={
+            "2": {"images": [{"filename": "a_00001_.png", "subfolder": "run1", "type": "output"}]},
+            "3": {"images": [{"filename": "preview.png", "subfolder": "", "type": "temp"}]},
+        },
+    )
+    assert collect_output_files(execution, "run1", output_dir=str(tmp_path)) == [tmp_path / "run1" / "a_00001_.png"]
+
+
+def test_collect_output_files_falls_back_to_run_dir(tmp_path):
+    (tmp_path / "run1" / "sub").mkdir(parents=True)
+    (tmp_path / "run1" / "sub" / "b.png").write_bytes(b"png")
+    files = collect_output_files(ExecutionResult("p1"), "run1", output_dir=str(tmp_path))
+    assert files == [tmp_path / "run1" / "sub" / "b.png"]
+    assert collect_output_files(ExecutionResult("p1"), "other", output_dir=str(tmp_path)) == []
+
+
+def test_cleanup_outputs(tmp_path):
+    (tmp_path / "run1").mkdir()
+    (tmp_path / "run1" / "b.png").write_bytes(b"png")
+    cleanup_outputs("run1", output_dir=str(tmp_path))
+    assert not (tmp_path / "run1").exists()
+    # Cleaning up twice is harmless
+    cleanup_outputs("run1", output_dir=str(tmp_path))
@@ -0,0 +1,83 @@
+import threading
+import time
+
+from comfy_runtime.requeue import JobTracker
+from comfy_runtime.shared_state import LocalDict
+
+SPEC = {"workflow_json": {"1": {}}, "result_mode": "reference"}
+
+
+class Spawner:
+    def __init__(self):
+        self.specs = []
+
+    def __call__(self, spec):
+        self.specs.append(spec)
+        return f"fc-{len(self.specs) + 1}"
+
+
+def tracked(max_requeues=2, publish_wait=1.0):
+    tracker = JobTracker(LocalDict(), max_requeues=max_requeues, publish_wait=publish_wait)
+    tracker.record("fc-1", SPEC)
+    return tracker
+
+
+def test_record_keeps_the_first_spec():
+    tracker = tracked()
+    tracker.record("fc-1", {"other": True})
+    assert tracker.store.get("fc-1") == {"spec": SPEC, "calls": ["fc-1"]}
+
+
+def test_current_call_follows_requeues():
+    tracker = tracked()
+    spawn = Spawner()
+
+    assert tracker.requeue("fc-1", "fc-1", spawn, "unhealthy") == "fc-2"
+    assert spawn.specs == [SPEC]
+    assert JobTracker.current_call(tracker.store.get("fc-1"), "fc-1") == "fc-2"
+    assert JobTracker.current_call(None, "fc-9") == "fc-9"
+
+
+def test_requeue_of_an_already_requeued_call_returns_the_new_call():
+    tracker = tracked()
+    spawn = Spawner()
+    tracker.requeue("fc-1", "fc-1", spawn, "unhealthy")
+
+    assert tracker.requeue("fc-1", "fc-1", spawn, "unhealthy") == "fc-2"
+    assert len(spawn.specs) == 1
+
+
+def test_requeue_gives_up_after_max_requeues():
+    tracker = tracked(max_requeues=1)
+    spawn = Spawner()
+
+    assert tracker.requeue("fc-1", "fc-1", spawn, "crashed") == "fc-2"
+    assert tracker.requeue("fc-1", "fc-2", spawn, "crashed") is None
+    assert len(spawn.specs) == 1
+
+
+def test_untracked_jobs_are_not_requeued():
+    assert tracked().requeue("fc-9", "fc-9", Spawner(), "crashed") is None
+
+
+def test_observer_waits_for_the_winning_requeue():
+    tracker = tracked()
+    # Another container claimed the requeue of fc-1 and publishes its call shortly after
+    tracker.store.put("requeue:fc-1", time.time())
+
+    def publish():
+        time.sleep(0.2)
+        tracker.store["fc-1"] = {"spec": SPEC, "calls": ["fc-1", "fc-7"]}
+
+    publisher = threading.Thread(target=publish)
+    publisher.start()
+    spawn = Spawner()
+    assert tracker.requeue("fc-1", "fc-1", spawn, "unhealthy") == "fc-7"
+    publisher.join()
+    assert spawn.specs == []
+
+
+def test_observer_gives_up_when_the_winner_never_publishes():
+    tracker = tracked(publish_wait=0.2)
+    tracker.store.put("requeue:fc-1", time.time())
+    assert tracker.requeue("fc-1", "fc-1", Spawner(), "unhealthy") is None
@@ -0,0 +1,78 @@
+import pytest
+
+from comfy_runtime import results
+from comfy_runtime.results import ResultStore, compact_result, iter_file, parse_range
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        (None, None),
+        ("", None),
+        ("bytes=0-99", (0, 99)),
+        ("bytes=10-", (10, 999)),
+        ("bytes=900-5000", (900, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=-5000", (0, 999)),
+        ("bytes=0-1,5-6", None),
+        ("items=0-1", None),
+        ("bytes=-", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=50-10", "bytes=-0"])
+def test_parse_range_rejects_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
+
+
+def test_iter_file_reads_range(tmp_path, monkeypatch):
+    monkeypatch.setattr(results, "CHUNK_SIZE", 3)
+    path = tmp_path / "data.bin"
+    path.write_bytes(bytes(range(20)))
+
+    assert b"".join(iter_file(path)) == bytes(range(20))
+    assert b"".join(iter_file(path, 5, 12)) == bytes(range(5, 13))
+
+
+def test_store_put_and_resolve(tmp_path):
+    src = tmp_path / "ComfyUI_00001_.png"
+    src.write_bytes(b"png")
+    store = ResultStore(str(tmp_path / "results"))
+
+    ref = store.put("run-1", src)
+
+    assert ref == {
+        "filename": "ComfyUI_00001_.png",
+        "type": "ref",
+        "key": "run-1/ComfyUI_00001_.png",
+        "size": 3,
+        "content_type": "image/png",
+    }
+    assert store.resolve(ref["key"]).read_bytes() == b"png"
+
+
+@pytest.mark.parametrize("key", ["../secret", "run-1/../../etc/passwd", "/etc/passwd", "run-1/missing.png", "run-1"])
+def test_store_rejects_invalid_or_missing_keys(tmp_path, key):
+    assert ResultStore(str(tmp_path)).resolve(key) is None
+
+
+def test_compact_result_strips_inline_data():
+    result = {
+        "status": "COMPLETED",
+        "cached": True,
+        "output": {"images": [{"filename": "a.png", "type": "base64", "data": "aGk="}]},
+    }
+    assert compact_result("fc-1", result) == {
+        "id": "fc-1",
+        "status": "COMPLETED",
+        "cached": True,
+        "output": {"images": [{"filename": "a.png", "type": "base64"}]},
+    }
+
+
+def test_compact_result_keeps_errors():
+    assert compact_result("fc-1", {"status": "FAILED", "error": "boom"}) == {"id": "fc-1", "status": "FAILED", "error": "boom"}
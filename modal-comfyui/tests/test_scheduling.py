@@ -0,0 +1,49 @@
+import threading
+import time
+
+from comfy_runtime.scheduling import GroupingScheduler
+
+
+def run_queued(scheduler, first_key, keys):
+    """Hold the server with `first_key`, queue jobs with `keys` in order, then return the order they ran in."""
+    order = []
+
+    def job(name, key):
+        with scheduler.slot(key):
+            order.append(name)
+
+    threads = []
+    with scheduler.slot(first_key):
+        for index, key in enumerate(keys):
+            thread = threading.Thread(target=job, args=(f"{key}{index}", key))
+            thread.start()
+            threads.append(thread)
+            # Queue the jobs in a known order
+            while scheduler.snapshot()["waiting"] < index + 1:
+                time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def test_prefers_jobs_with_the_current_key():
+    scheduler = GroupingScheduler()
+    order = run_queued(scheduler, "a", ["b", "a", "b", "a"])
+
+    assert order == ["a1", "a3", "b0", "b2"]
+    assert scheduler.snapshot() == {"jobs": 5, "switches": 2, "bypassed": 3, "waiting": 0, "current_key": "b"}
+
+
+def test_bypassed_jobs_do_not_starve():
+    scheduler = GroupingScheduler(max_bypass=1)
+    order = run_queued(scheduler, "a", ["b", "a", "a"])
+
+    assert order == ["a1", "b0", "a2"]
+
+
+def test_without_waiters_the_slot_is_free():
+    scheduler = GroupingScheduler()
+    with scheduler.slot(None):
+        pass
+    with scheduler.slot("a"):
+        assert scheduler.snapshot()["current_key"] == "a"
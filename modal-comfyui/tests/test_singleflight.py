@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+
+from comfy_runtime.shared_state import LocalDict
+from comfy_runtime.singleflight import SingleFlight
+
+
+class Spawner:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return f"call-{self.calls}"
+
+
+def test_first_submission_spawns():
+    flight = SingleFlight(LocalDict())
+    spawn = Spawner()
+    assert asyncio.run(flight.submit("k", spawn)) == ("call-1", False)
+    assert spawn.calls == 1
+
+
+def test_identical_submissions_attach_to_the_running_call():
+    flight = SingleFlight(LocalDict())
+    spawn = Spawner(delay=0.2)
+
+    async def submit_three():
+        return await asyncio.gather(*(flight.submit("k", spawn) for _ in range(3)))
+
+    results = asyncio.run(submit_three())
+    assert spawn.calls == 1
+    assert sorted(results) == [("call-1", False), ("call-1", True), ("call-1", True)]
+
+
+def test_followers_do_not_block_the_event_loop():
+    flight = SingleFlight(LocalDict())
+    ticks = []
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(1)
+            await asyncio.sleep(0.05)
+
+    async def run():
+        await asyncio.gather(flight.submit("k", Spawner(delay=0.3)), flight.submit("k", Spawner()), ticker())
+
+    asyncio.run(run())
+    assert len(ticks) == 5
+
+
+def test_release_lets_the_next_submission_spawn():
+    flight = SingleFlight(LocalDict())
+    spawn = Spawner()
+    call_id, _ = asyncio.run(flight.submit("k", spawn))
+    # Releasing with another call id is ignored
+    flight.release("k", "other-call")
+    assert asyncio.run(flight.submit("k", spawn)) == (call_id, True)
+    flight.release("k", call_id)
+    assert asyncio.run(flight.submit("k", spawn)) == ("call-2", False)
+
+
+def test_failed_spawn_releases_the_claim():
+    flight = SingleFlight(LocalDict())
+
+    async def failing():
+        raise RuntimeError("spawn failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(flight.submit("k", failing))
+    assert asyncio.run(flight.submit("k", Spawner())) == ("call-1", False)
+
+
+def test_expired_claims_are_taken_over():
+    store = LocalDict()
+    flight = SingleFlight(store, ttl=60)
+    store["k"] = {"call_id": "old-call", "claimed_at": 0, "fingerprint": None}
+    assert asyncio.run(flight.submit("k", Spawner())) == ("call-1", False)
+
+
+def test_unpublished_claim_is_taken_over_after_the_wait():
+    store = LocalDict()
+    flight = SingleFlight(store, publish_wait=0.2)
+    # A leader that claimed the key and died before publishing its call id
+    asyncio.run(flight._claim("k", "dead-leader"))
+    assert asyncio.run(flight.submit("k", Spawner())) == ("call-1", False)
+
+
+def test_only_one_follower_takes_over_an_unpublished_claim():
+    store = LocalDict()
+    flight = SingleFlight(store, publish_wait=0.2)
+    asyncio.run(flight._claim("k", "dead-leader"))
+    spawn = Spawner(delay=0.1)
+
+    async def submit_three():
+        return await asyncio.gather(*(flight.submit("k", spawn) for _ in range(3)))
+
+    results = asyncio.run(submit_three())
+    assert spawn.calls == 1
+    assert sorted(results) == [("call-1", False), ("call-1", True), ("call-1", True)]
+
+
+def test_slow_leader_does_not_overwrite_the_claim_that_replaced_it():
+    store = LocalDict()
+    flight = SingleFlight(store, publish_wait=0.1)
+
+    async def slow():
+        await asyncio.sleep(0.5)
+        return "slow-call"
+
+    async def fast():
+        return "fast-call"
+
+    async def run():
+        leader = asyncio.create_task(flight.submit("k", slow))
+        await asyncio.sleep(0.05)
+        return await asyncio.gather(leader, flight.submit("k", fast))
+
+    assert asyncio.run(run()) == [("slow-call", False), ("fast-call", False)]
+    assert store.get("k")["call_id"] == "fast-call"
+    # The slow call finishing does not release the claim of the fast one
+    flight.release("k", "slow-call")
+    assert store.get("k")["call_id"] == "fast-call"
+
+
+def test_release_with_a_stale_token_keeps_the_new_claim():
+    store = LocalDict()
+    flight = SingleFlight(store)
+    asyncio.run(flight._claim("k", "new-leader"))
+    flight.release("k", token="old-leader")
+    assert store.get("k")["token"] == "new-leader"
+    flight.release("k", token="new-leader")
+    assert "k" not in store
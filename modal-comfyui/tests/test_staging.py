@@ -0,0 +1,61 @@
+import pytest
+
+from comfy_runtime import staging
+from comfy_runtime.staging import stage_from_env, stage_models, verify_staged
+
+
+@pytest.fixture
+def models_dir(tmp_path):
+    volume = tmp_path / "volume"
+    volume.mkdir()
+    for subfolder, filename, size in (("unet", "big.safetensors", 64), ("vae", "small.safetensors", 8)):
+        (volume / filename).write_bytes(b"x" * size)
+        link = tmp_path / "models" / subfolder / filename
+        link.parent.mkdir(parents=True)
+        link.symlink_to(volume / filename)
+    return tmp_path / "models"
+
+
+MODELS = [("unet", "big.safetensors"), ("vae", "small.safetensors"), ("loras", "missing.safetensors")]
+
+
+def test_copy_relinks_to_local_copies(tmp_path, models_dir):
+    staged = stage_models(MODELS, models_dir=str(models_dir), staging_dir=str(tmp_path / "staged"))
+
+    assert [model.link.name for model in staged] == ["big.safetensors", "small.safetensors"]
+    for model in staged:
+        assert model.local.read_bytes() == model.source.read_bytes()
+        assert model.link.resolve() == model.local.resolve()
+
+
+def test_readahead_keeps_links(tmp_path, models_dir):
+    staged = stage_models(MODELS, mode="readahead", models_dir=str(models_dir), staging_dir=str(tmp_path / "staged"))
+
+    assert all(model.local is None and model.link.resolve() == model.source for model in staged)
+    assert not (tmp_path / "staged").exists()
+
+
+def test_off_stages_nothing(models_dir):
+    assert stage_models(MODELS, mode="off", models_dir=str(models_dir)) == []
+
+
+def test_verify_staged_falls_back_to_volume(tmp_path, models_dir):
+    staged = stage_models(MODELS, models_dir=str(models_dir), staging_dir=str(tmp_path / "staged"))
+    staged[0].local.unlink()
+
+    verify_staged(staged)
+
+    assert staged[0].link.resolve() == staged[0].source
+    assert staged[1].link.resolve() == staged[1].local.resolve()
+
+
+def test_stage_from_env_rejects_unknown_mode(monkeypatch):
+    monkeypatch.setenv("MODEL_STAGING", "bogus")
+    monkeypatch.setattr(staging, "stage_models", lambda *args, **kwargs: pytest.fail("staged models"))
+    assert stage_from_env(MODELS) == []
+
+
+def test_stage_from_env_never_raises(monkeypatch):
+    monkeypatch.setenv("MODEL_STAGING", "copy")
+    monkeypatch.setenv("MODEL_STAGING_CONCURRENCY", "many")
+    assert stage_from_env(MODELS) == []
@@ -0,0 +1,162 @@
+import threading
+
+import pytest
+
+from comfy_runtime.canonical import workflow_hash
+from comfy_runtime.shared_state import LocalDict
+from comfy_runtime.templates import TemplateConflictError, TemplateRegistry, WorkflowTemplate
+
+BINDINGS = {"image": "97.image", "seed": ["79.seed", "92.seed"], "denoise": "79.denoise", "size": "91.size"}
+
+
+@pytest.fixture
+def template(upscale_workflow2):
+    return WorkflowTemplate.compile("upscale", upscale_workflow2, BINDINGS)
+
+
+def test_compile_reads_defaults(template, upscale_workflow2):
+    assert template.defaults() == {
+        "image": "",
+        "seed": upscale_workflow2["79"]["inputs"]["seed"],
+        "denoise": upscale_workflow2["79"]["inputs"]["denoise"],
+        "size": 717,
+    }
+    assert template.parameters["seed"].paths == ["79.seed", "92.seed"]
+
+
+def test_compile_copies_the_workflow(template, upscale_workflow2):
+    upscale_workflow2["91"]["inputs"]["size"] = 1
+    assert template.workflow["91"]["inputs"]["size"] == 717
+
+
+@pytest.mark.parametrize("path", ["missing.image", "91.missing", "76.image"])
+def test_compile_rejects_bad_paths(upscale_workflow2, path):
+    with pytest.raises(ValueError):
+        WorkflowTemplate.compile("upscale", upscale_workflow2, {"p": path})
+
+
+def test_bind_copies_only_changed_nodes(template):
+    graph = template.bind({"seed": 7, "size": 512.0})
+
+    assert graph["79"]["inputs"]["seed"] == graph["92"]["inputs"]["seed"] == 7
+    assert graph["91"]["inputs"]["size"] == 512 and isinstance(graph["91"]["inputs"]["size"], int)
+    assert graph["12"] is template.workflow["12"]
+    assert template.workflow["79"]["inputs"]["seed"] != 7
+
+
+@pytest.mark.parametrize(
+    "values",
+    [{"unknown": 1}, {"seed": "7"}, {"seed": True}, {"image": 5}],
+)
+def test_bind_rejects_unknown_or_mistyped_values(template, values):
+    with pytest.raises(ValueError):
+        template.bind(values)
+
+
+def test_float_parameters_accept_integers(template):
+    assert template.bind({"denoise": 1})["79"]["inputs"]["denoise"] == 1
+
+
+def test_bind_keyed_matches_full_hash(template):
+    values = {"seed": 7, "denoise": 0.5, "image": "aGk="}
+    graph, key = template.bind_keyed(values)
+    assert key == workflow_hash(graph)
+    assert key != template.bind_keyed({"seed": 8})[1]
+
+
+def registry_with_store(upscale_workflow2, store=None):
+    registry = TemplateRegistry(store if store is not None else LocalDict())
+    registry.register(WorkflowTemplate.compile("upscale", upscale_workflow2, BINDINGS))
+    return registry
+
+
+def test_publish_assigns_next_versions(upscale_workflow2):
+    registry = registry_with_store(upscale_workflow2)
+
+    assert registry.publish("upscale", upscale_workflow2, {"seed": "79.seed"}).version == 2
+    assert registry.publish("mine", upscale_workflow2, {"seed": "79.seed"}).version == 1
+    assert registry.publish("mine", upscale_workflow2, {"size": "91.size"}).version == 2
+    assert registry.catalog() == {"mine": 2, "upscale": 2}
+    assert "mine" in registry and "other" not in registry
+
+
+def test_republishing_a_version_is_a_no_op_and_conflicts_raise(upscale_workflow2):
+    registry = registry_with_store(upscale_workflow2)
+    registry.publish("mine", upscale_workflow2, {"seed": "79.seed"})
+
+    assert registry.publish("mine", upscale_workflow2, {"seed": "79.seed"}, version=1).version == 1
+    with pytest.raises(TemplateConflictError):
+        registry.publish("mine", upscale_workflow2, {"size": "91.size"}, version=1)
+    with pytest.raises(TemplateConflictError):
+        registry.publish("upscale", upscale_workflow2, {"size": "91.size"}, version=1)
+
+
+def test_explicit_versions_may_not_skip(upscale_workflow2):
+    registry = registry_with_store(upscale_workflow2)
+    with pytest.raises(ValueError, match="next version is 1"):
+        registry.publish("mine", upscale_workflow2, {}, version=3)
+    assert registry.publish("mine", upscale_workflow2, {}, version=1).version == 1
+
+
+def test_validate_can_reject(upscale_workflow2):
+    registry = registry_with_store(upscale_workflow2)
+
+    def reject(template):
+        raise ValueError("no")
+
+    with pytest.raises(ValueError):
+        registry.publish("mine", upscale_workflow2, {}, validate=reject)
+    assert registry.catalog() == {"upscale": 1}
+
+
+def test_other_containers_compile_published_versions(upscale_workflow2):
+    store = LocalDict()
+    registry_with_store(upscale_workflow2, store).publish("mine", upscale_workflow2, {"seed": "79.seed"})
+
+    other = registry_with_store(upscale_workflow2, store)
+    template = other.get("mine")
+    assert template.version == 1 and list(template.parameters) == ["seed"]
+    with pytest.raises(KeyError):
+        other.get("mine", 2)
+
+
+def test_latest_never_moves_backwards(upscale_workflow2):
+    store = LocalDict()
+    registry = registry_with_store(upscale_workflow2, store)
+    for _ in range(3):
+        registry.publish("mine", upscale_workflow2, {})
+    # A slower publisher overwrote the hint with an older version
+    store["latest:mine"] = 1
+
+    assert registry.latest_version("mine") == 3
+    assert registry.publish("mine", upscale_workflow2, {}).version == 4
+
+
+def test_concurrent_publishes_get_distinct_versions(upscale_workflow2):
+    store = LocalDict()
+    registries = [registry_with_store(upscale_workflow2, store) for _ in range(4)]
+    versions = []
+
+    def publish(registry, seed):
+        # Different contents, so that every publish needs its own version
+        workflow = WorkflowTemplate.compile("mine", upscale_workflow2, {"seed": "79.seed"}).bind({"seed": seed})
+        versions.append(registry.publish("mine", workflow, {}).version)
+
+    threads = [threading.Thread(target=publish, args=(registry, seed)) for seed, registry in enumerate(registries)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(versions) == [1, 2, 3, 4]
+    assert all(registry.latest_version("mine") == 4 for registry in registries)
+
+
+def test_catalog_does_not_read_stored_workflows(upscale_workflow2):
+    class KeysOnly(LocalDict):
+        def items(self):
+            raise AssertionError("catalog read the stored workflows")
+
+    registry = registry_with_store(upscale_workflow2, KeysOnly())
+    registry.publish("mine", upscale_workflow2, {})
+    assert registry.catalog() == {"mine": 1, "upscale": 1}
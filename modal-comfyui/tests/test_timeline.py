@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from comfy_runtime.engine import ExecutionResult
+from comfy_runtime.timeline import Timeline
+
+
+@pytest.fixture
+def timeline(tmp_path, monkeypatch):
+    monkeypatch.setenv("MODAL_TASK_ID", "ta-1")
+    return Timeline("worker", path=str(tmp_path / "timeline.jsonl"))
+
+
+def events(timeline):
+    return [json.loads(line) for line in open(timeline.path)]
+
+
+def test_span_records_duration_and_errors(timeline):
+    with timeline.span("launch_comfy"):
+        pass
+    with pytest.raises(RuntimeError):
+        with timeline.span("preload_weights"):
+            raise RuntimeError("boom")
+
+    logged = events(timeline)
+    assert [event["event"] for event in logged] == ["process_start", "launch_comfy", "preload_weights"]
+    assert logged[2]["error"] == "boom"
+    assert set(timeline.durations) == {"launch_comfy", "preload_weights"}
+    assert all(event["container_id"] == "ta-1" for event in logged)
+
+
+def test_restore_updates_container_and_since_restore(timeline, monkeypatch):
+    monkeypatch.setenv("MODAL_TASK_ID", "ta-2")
+    timeline.restored()
+    event = timeline.mark("set_device")
+
+    assert event["restored"] and event["container_id"] == "ta-2"
+    assert "since_restore" in event
+    assert timeline.metrics()["restored_from_snapshot"]
+
+
+def test_first_prompt_records_loader_time_once(timeline, upscale_workflow2):
+    loaders = [node_id for node_id, node in upscale_workflow2.items() if node["class_type"] == "UNETLoader"]
+    execution = ExecutionResult("p-1", elapsed=12.0, node_timings={loaders[0]: 3.5, "79": 6.0})
+
+    timeline.first_request()
+    timeline.record_prompt(execution, upscale_workflow2)
+    timeline.record_prompt(execution, upscale_workflow2)
+
+    logged = events(timeline)
+    assert [event["event"] for event in logged].count("cold_start") == 1
+    first_prompt = next(event for event in logged if event["event"] == "first_prompt")
+    assert first_prompt["model_load_seconds"] == 3.5
+    metrics = logged[-1]["metrics"]
+    assert metrics["phases"]["first_prompt"] == 12.0
+    assert "idle_before_first_request_seconds" in metrics
@@ -0,0 +1,109 @@
+import threading
+import time
+
+from comfy_runtime.watchdog import LeakWatchdog, ServerGate, process_rss
+
+GB = 1024 ** 3
+FLUX = [("unet", "flux1-dev.safetensors")]
+SDXL = [("checkpoints", "juggernaut.safetensors")]
+
+
+def watchdog(**kwargs):
+    return LeakWatchdog(max_rss_growth=2 * GB, max_vram_growth=1 * GB, **kwargs)
+
+
+def test_recycles_after_sustained_growth():
+    dog = watchdog(sustained_jobs=3)
+    assert dog.sample(10 * GB, 5 * GB, FLUX) is None
+    assert dog.sample(13 * GB, 5 * GB, FLUX) is None
+    assert dog.sample(13 * GB, 5 * GB, FLUX) is None
+    reason = dog.sample(13 * GB, 5 * GB, FLUX)
+    assert reason is not None and "RSS" in reason and "3 jobs" in reason
+
+
+def test_one_large_job_does_not_recycle():
+    dog = watchdog(sustained_jobs=2)
+    dog.sample(10 * GB, 5 * GB, FLUX)
+    assert dog.sample(13 * GB, 5 * GB, FLUX) is None
+    assert dog.sample(10.5 * GB, 5 * GB, FLUX) is None
+    assert dog.sample(13 * GB, 5 * GB, FLUX) is None
+
+
+def test_new_models_start_a_new_baseline():
+    dog = watchdog(sustained_jobs=1)
+    dog.sample(10 * GB, 5 * GB, FLUX)
+    # Loading another model grows both, which is not a leak
+    assert dog.sample(17 * GB, 12 * GB, SDXL) is None
+    assert dog.sample(17 * GB, 12 * GB, FLUX) is None
+    assert dog.sample(17.5 * GB, 13.5 * GB, SDXL) is not None
+
+
+def test_baseline_is_lowest_sample():
+    dog = watchdog(sustained_jobs=1)
+    dog.sample(12 * GB, None, FLUX)
+    dog.sample(10 * GB, None, FLUX)
+    assert dog.baseline_rss == 10 * GB
+    assert dog.sample(12.5 * GB, None, FLUX) is not None
+
+
+def test_reset_forgets_models_and_baseline():
+    dog = watchdog(sustained_jobs=1)
+    dog.sample(10 * GB, 5 * GB, FLUX)
+    dog.reset()
+    assert dog.models == set() and dog.baseline_rss is None
+    assert dog.sample(20 * GB, 10 * GB, FLUX) is None
+
+
+def test_zero_threshold_disables_check():
+    dog = LeakWatchdog(max_rss_growth=0, max_vram_growth=0, sustained_jobs=1)
+    dog.sample(1 * GB, 1 * GB)
+    assert dog.sample(100 * GB, 100 * GB) is None
+
+
+def test_process_rss_of_this_process():
+    import os
+
+    assert process_rss(os.getpid()) > 0
+    assert process_rss(-1) is None
+
+
+def test_gate_holds_jobs_while_recycling():
+    gate = ServerGate()
+    order = []
+    started = threading.Event()
+
+    def job():
+        started.wait()
+        with gate.job() as generation:
+            order.append(("job", generation))
+
+    def restart():
+        started.set()
+        time.sleep(0.1)
+        order.append(("restart", None))
+
+    worker = threading.Thread(target=job)
+    worker.start()
+    assert gate.recycle(restart, 0)
+    worker.join()
+
+    assert order == [("restart", None), ("job", 1)]
+
+
+def test_gate_ignores_stale_recycles():
+    gate = ServerGate()
+    assert gate.recycle(lambda: None, 0)
+    assert not gate.recycle(lambda: None, 0)
+    assert gate.generation == 1
+
+
+def test_gate_waits_for_running_jobs():
+    gate = ServerGate()
+    order = []
+    with gate.job() as generation:
+        recycler = threading.Thread(target=gate.recycle, args=(lambda: order.append("restart"), generation))
+        recycler.start()
+        time.sleep(0.1)
+        order.append("job done")
+    recycler.join()
+    assert order == ["job done", "restart"]
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import pytest
+
+from comfy_runtime.admission import AdmissionController
+from comfy_runtime.cache import ResultCache
+from comfy_runtime.engine import ExecutionResult
+from comfy_runtime.health import HealthState
+from comfy_runtime.inputs import InputStore
+from comfy_runtime.requeue import JobTracker
+from comfy_runtime.shared_state import LocalDict
+from comfy_runtime.timeline import Timeline
+from comfy_runtime.watchdog import ServerGate
+
+# The app module defines its Modal images and classes at import time
+pytest.importorskip("modal")
+api = pytest.importorskip("modal_comfyui_api")
+
+WORKFLOW = {
+    "3": {"class_type": "KSampler", "inputs": {"seed": 1}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "out", "images": ["8", 0]}},
+}
+
+
+class FakeEngine:
+    """Stands in for the `ComfyEngine` of the server launched once per container."""
+
+    def __init__(self):
+        self.prompts = []
+
+    def run(self, workflow):
+        self.prompts.append(workflow)
+        return ExecutionResult(prompt_id=f"p{len(self.prompts)}", outputs={"9": {"images": []}})
+
+
+class FakeHealth:
+    def __init__(self, healthy=True):
+        self.state = HealthState(healthy=healthy, error=None if healthy else "server stopped answering")
+
+    def check(self):
+        return self.state
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    image = tmp_path / "out.png"
+    image.write_bytes(b"\x89PNG\r\n\x1a\n")
+    monkeypatch.setattr(api, "result_cache", ResultCache(str(tmp_path / "cache")))
+    monkeypatch.setattr(api, "input_store", InputStore(str(tmp_path / "inputs")))
+    monkeypatch.setattr(api, "collect_output_files", lambda execution, run_id: [image])
+    monkeypatch.setattr(api, "cleanup_outputs", lambda run_id: None)
+
+    def launch(*args, **kwargs):
+        raise AssertionError("a job launched a ComfyUI server")
+
+    monkeypatch.setattr(api.subprocess, "run", launch)
+
+    # A worker as left by its enter hooks: the server is up and the engine points at it
+    server = api.ComfyServer()
+    server.engine = FakeEngine()
+    server.timeline = Timeline("ComfyUIWorker")
+    server.health = FakeHealth()
+    server.admission = AdmissionController()
+    server.server_gate = ServerGate()
+    server.check_for_leaks = lambda generation, workflow: None
+    return server
+
+
+def test_jobs_reuse_the_warm_server(server):
+    first = server.execute(WORKFLOW, use_cache=False)
+    second = server.execute(WORKFLOW, use_cache=False)
+
+    assert first["status"] == second["status"] == "COMPLETED"
+    assert first["output"]["images"][0]["type"] == "base64"
+    assert len(server.engine.prompts) == 2
+    # Every job writes into its own output subdirectory of the shared server
+    prefixes = [prompt["9"]["inputs"]["filename_prefix"] for prompt in server.engine.prompts]
+    assert prefixes[0] != prefixes[1]
+    assert all(prefix.endswith("/out") for prefix in prefixes)
+
+
+def test_unhealthy_server_fails_the_job_without_running_it(server):
+    server.health = FakeHealth(healthy=False)
+    result = server.execute(WORKFLOW, use_cache=False)
+    assert result == {"status": "FAILED", "error": "ComfyUI server is not healthy: server stopped answering"}
+    assert server.engine.prompts == []
+
+
+def test_async_submissions_spawn_onto_the_worker_class(monkeypatch):
+    spawned = []
+
+    class Method:
+        def spawn(self, *args):
+            spawned.append(args)
+            return SimpleNamespace(object_id="fc-1")
+
+    monkeypatch.setattr(api, "worker_for", lambda workflow, avoid_pool=None: SimpleNamespace(execute_workflow=Method()))
+    monkeypatch.setattr(api, "job_tracker", JobTracker(LocalDict()))
+
+    assert api.spawn_workflow(WORKFLOW, "reference") == "fc-1"
+    assert spawned == [(WORKFLOW, "reference", True, None, None)]
+    assert api.job_tracker.store.get("fc-1")["spec"]["workflow_json"] == WORKFLOW